@@ -10,10 +10,13 @@ a = Analysis(
     hiddenimports=[
         'telethon',
         'telethon.tl.types',
+        'telethon.sessions',
         'nicegui',
         'pandas',
         'matplotlib',
         'matplotlib.pyplot',
+        'matplotlib.figure',
+        'matplotlib.backends.backend_agg',
         'dotenv',
         'asyncio',
         'datetime',
@@ -0,0 +1,103 @@
+"""
+Пакетный анализ каналов из командной строки
+
+Результат по каждому каналу выводится строкой JSON (JSON Lines), как только
+канал обработан: метрики, сравнение с предыдущим периодом (--compare),
+рекомендации по времени публикаций или ошибка. Итог — в stderr.
+
+Список каналов — аргументы или файл (--input, «-» — stdin), по строке на канал:
+    @channel_one
+    https://t.me/channel_two 2024-01-01 2024-03-31
+
+Использование:
+    python batch.py @channel_one @channel_two --from 2024-01-01 --to 2024-01-31
+    python batch.py --input channels.txt --compare --concurrency 8 --output report.jsonl
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from dotenv import load_dotenv
+
+
+def get_env_path():
+    """Получает путь к файлу .env"""
+    if '__file__' in globals():
+        return os.path.join(os.path.dirname(__file__), 'idandhash.env')
+    return os.path.join(os.getcwd(), 'idandhash.env')
+
+
+load_dotenv(get_env_path())
+
+from core.batch import BATCH_FETCH_LIMIT, default_period, parse_job, run_batch
+from core.compute import stop_compute
+from core.fetch_workers import stop_fetch_workers
+from core.post_cache import POST_CACHE_TTL
+
+
+def read_jobs(args) -> list:
+    start_date, end_date = args.date_from, args.date_to
+    lines = list(args.channels)
+    if args.input:
+        stream = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+        with stream:
+            lines.extend(stream.read().splitlines())
+    jobs = []
+    for number, line in enumerate(lines, start=1):
+        try:
+            job = parse_job(line, start_date, end_date)
+        except ValueError as e:
+            raise SystemExit(f"❌ Ошибка в строке {number}: {e}")
+        if job:
+            jobs.append(job)
+    return jobs
+
+
+async def run(args, jobs: list, out) -> int:
+    api_id = os.getenv('API_ID', '')
+    api_hash = os.getenv('API_HASH', '')
+    failed = 0
+    started = time.perf_counter()
+    try:
+        async for result in run_batch(api_id, api_hash, jobs, concurrency=args.concurrency, compare=args.compare,
+                                      limit=args.limit, max_age=0 if args.no_cache else POST_CACHE_TTL):
+            failed += result['status'] != 'ok'
+            out.write(json.dumps(result, ensure_ascii=False, default=str) + '\n')
+            out.flush()
+    finally:
+        stop_compute()
+        stop_fetch_workers()
+    print(f"Каналов: {len(jobs)}, с ошибкой: {failed}, время: {time.perf_counter() - started:.1f} с", file=sys.stderr)
+    return failed
+
+
+def main(argv=None) -> int:
+    default_from, default_to = default_period()
+    parser = argparse.ArgumentParser(description='Пакетный анализ Telegram-каналов (JSON Lines)')
+    parser.add_argument('channels', nargs='*', help='Каналы (@username или ссылка t.me)')
+    parser.add_argument('--input', '-i', default='', help='Файл со списком каналов («-» — stdin)')
+    parser.add_argument('--from', dest='date_from', default=default_from, help='Дата от (YYYY-MM-DD) по умолчанию')
+    parser.add_argument('--to', dest='date_to', default=default_to, help='Дата до (YYYY-MM-DD) по умолчанию')
+    parser.add_argument('--compare', action='store_true', help='Сравнить с предыдущим периодом той же длины')
+    parser.add_argument('--concurrency', type=int, default=4, help='Одновременных загрузок на весь запуск')
+    parser.add_argument('--limit', type=int, default=BATCH_FETCH_LIMIT, help='Сообщений, просматриваемых в канале')
+    parser.add_argument('--no-cache', action='store_true', help='Не брать посты из кеша')
+    parser.add_argument('--output', '-o', default='', help='Файл результатов (по умолчанию stdout)')
+    args = parser.parse_args(argv)
+
+    jobs = read_jobs(args)
+    if not jobs:
+        parser.error('не указаны каналы')
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        failed = asyncio.run(run(args, jobs, out))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+Нагрузочный тест пути загрузки без сети
+
+Пользователи одновременно запрашивают периоды популярных каналов через
+core.post_cache.fetch_posts_cached (кеш постов, очередь загрузок, бюджет запросов),
+а Telegram заменен core.fake_telegram с заданными задержками, FloodWait и обрывами.
+Отчет: задержка запросов (p50/p90/p99), ошибки, попадания в кеш, очередь,
+число страниц и сообщений, запрошенных у «Telegram».
+
+Использование:
+    python -m bench.fetch_path --users 20 --requests 5 --channels 5
+    python -m bench.fetch_path --users 50 --page-latency 0.3 --flood-rate 0.02 --max-concurrent 2
+    python -m bench.fetch_path --no-cache --disconnect-rate 0.01
+"""
+import sys
+import time
+import random
+import asyncio
+import argparse
+import datetime
+import tempfile
+import statistics
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core import post_cache
+from core.admission import FETCH_ADMISSION
+from core.services import set_client_factory
+from core.fake_telegram import FakeTelegramConfig, fake_client_factory, FAKE_STATS, CASSETTE_DIR
+
+
+# Длины периодов, которые выбирают пользователи (дни), и их доли
+PERIOD_DAYS = (7, 30, 90, 365)
+PERIOD_WEIGHTS = (3, 4, 2, 1)
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def user_session(user: int, args, rng: random.Random, latencies: list, errors: Counter):
+    channels = [f"bench_channel_{i}" for i in range(args.channels)]
+    # Популярность каналов убывает по закону Ципфа
+    weights = [1 / (i + 1) for i in range(len(channels))]
+    today = datetime.date.today()
+    await asyncio.sleep(rng.uniform(0, args.ramp_up))
+    for _ in range(args.requests):
+        channel = rng.choices(channels, weights=weights)[0]
+        days = rng.choices(PERIOD_DAYS, weights=PERIOD_WEIGHTS)[0]
+        start = (today - datetime.timedelta(days=days)).strftime('%Y-%m-%d')
+        end = today.strftime('%Y-%m-%d')
+        started = time.perf_counter()
+        try:
+            await post_cache.fetch_posts_cached(
+                '1', 'bench', channel, start, end, limit=args.limit,
+                max_age=0 if args.no_cache else post_cache.POST_CACHE_TTL, client_key=f"user{user}"
+            )
+            latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            errors[type(e).__name__] += 1
+        await asyncio.sleep(rng.expovariate(1 / args.think_time) if args.think_time > 0 else 0)
+
+
+async def run(args) -> dict:
+    config = FakeTelegramConfig(
+        page_size=args.page_size,
+        page_latency=args.page_latency,
+        connect_latency=args.connect_latency,
+        channel_posts=args.channel_posts,
+        flood_rate=args.flood_rate,
+        flood_seconds=args.flood_seconds,
+        disconnect_rate=args.disconnect_rate,
+        cassette_dir=Path(args.cassettes) if args.cassettes else CASSETTE_DIR,
+        seed=args.seed,
+    )
+    set_client_factory(fake_client_factory(config))
+    FETCH_ADMISSION.max_concurrent = args.max_concurrent
+    rng = random.Random(args.seed)
+    latencies, errors = [], Counter()
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        user_session(user, args, random.Random(rng.random()), latencies, errors)
+        for user in range(args.users)
+    ))
+    elapsed = time.perf_counter() - started
+    set_client_factory(None)
+    return {'elapsed': elapsed, 'latencies': latencies, 'errors': errors}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Нагрузочный тест пути загрузки с поддельным Telegram')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=5, help='Запросов на пользователя')
+    parser.add_argument('--channels', type=int, default=5)
+    parser.add_argument('--think-time', type=float, default=2.0, help='Средняя пауза между запросами (секунды)')
+    parser.add_argument('--ramp-up', type=float, default=5.0, help='Пользователи подключаются за это время (секунды)')
+    parser.add_argument('--limit', type=int, default=1500)
+    parser.add_argument('--no-cache', action='store_true', help='Каждый запрос идет в «Telegram»')
+    parser.add_argument('--max-concurrent', type=int, default=FETCH_ADMISSION.max_concurrent)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--page-latency', type=float, default=0.15)
+    parser.add_argument('--connect-latency', type=float, default=0.3)
+    parser.add_argument('--channel-posts', type=int, default=1500)
+    parser.add_argument('--flood-rate', type=float, default=0.0)
+    parser.add_argument('--flood-seconds', type=int, default=5)
+    parser.add_argument('--disconnect-rate', type=float, default=0.0)
+    parser.add_argument('--cassettes', default='', help='Каталог кассет (по умолчанию cache/cassettes)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='analtg-bench-') as cache_dir:
+        # Кеш постов бенчмарка не смешивается с кешем приложения
+        post_cache.CACHE_DIR = Path(cache_dir)
+        result = asyncio.run(run(args))
+
+    latencies = result['latencies']
+    total = len(latencies) + sum(result['errors'].values())
+    print(f"requests: {total} in {result['elapsed']:.1f} s ({total / result['elapsed']:.2f}/s), "
+          f"users: {args.users}, max concurrent fetches: {args.max_concurrent}")
+    if latencies:
+        print(f"latency ms: p50 {percentile(latencies, 50) * 1000:.0f}, p90 {percentile(latencies, 90) * 1000:.0f}, "
+              f"p99 {percentile(latencies, 99) * 1000:.0f}, max {max(latencies) * 1000:.0f}, "
+              f"mean {statistics.mean(latencies) * 1000:.0f}")
+    print(f"errors: {dict(result['errors']) or 0}")
+    print(f"post cache: {dict(post_cache.CACHE_STATS)}")
+    summary = FETCH_ADMISSION.summary()
+    print(f"admission: admitted {summary['admitted']}, cancelled {summary['cancelled']}, "
+          f"avg fetch {summary['avg_duration']:.2f} s")
+    print(f"telegram: {dict(FAKE_STATS)}")
+    return 1 if result['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
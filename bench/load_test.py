@@ -0,0 +1,430 @@
+"""
+Нагрузочный тест приложения с одновременными пользователями
+
+Каждый пользователь — клиент NiceGUI без браузера: загружает страницу, подключается
+к websocket (socket.io) так же, как страница в браузере, и отправляет те же события:
+заполняет форму настроек, запрашивает статистику, переключает метрику топ-постов
+и строит графики. Задержка взаимодействия — время от события до ответа сервера,
+который видит пользователь (итог загрузки, обновленная карточка, графики).
+Сервер запускается отдельным процессом с TELEGRAM_BACKEND=fake (синтетические
+истории каналов с задержками FAKE_TG_*), его загрузка CPU и RSS снимаются psutil.
+Отрисовка в браузере в замер не входит.
+
+Использование:
+    python -m bench.load_test --users 10
+    python -m bench.load_test --users 50 --iterations 3 --page-latency 0.3 --ramp-up 20
+    python -m bench.load_test --url http://127.0.0.1:8000 --server-pid 12345
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import asyncio
+import argparse
+import datetime
+import tempfile
+import subprocess
+import statistics
+from collections import Counter, defaultdict
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+from bench.fetch_path import PERIOD_DAYS, PERIOD_WEIGHTS, percentile
+
+
+SOCKETIO_PATH = '/_nicegui_ws/socket.io'
+ELEMENTS_RE = re.compile(r'parseElements\(String\.raw`(.*?)`\)', re.S)
+CLIENT_ID_RE = re.compile(r"""['"]client_id['"]\s*:\s*['"]([\w-]+)['"]""")
+METRICS = ('ER', 'Просмотры', 'Лайки', 'Комментарии', 'Репосты')
+AGGREGATIONS = ('Неделя', 'Месяц', 'Квартал')
+# Итоговые сообщения загрузки в строке статуса настроек
+FETCH_DONE = ('✅', '⛔', '⏹')
+FETCH_FAILED = '⛔'
+PLOTS_EMPTY = ('Пока нет данных', 'Нет доступных графиков')
+
+
+def _elements(data: dict):
+    """Элементы из сообщения update (удаленные приходят как None)"""
+    return (element for element in data.values() if isinstance(element, dict))
+
+
+def fetch_finished(kind: str, data: dict):
+    if kind != 'update':
+        return None
+    for element in _elements(data):
+        text = element.get('text') or ''
+        if text.startswith(FETCH_DONE):
+            return text
+    return None
+
+
+def plots_shown(kind: str, data: dict):
+    if kind != 'update':
+        return None
+    for element in _elements(data):
+        if 'image' in element.get('tag', ''):
+            return 'image'
+        if (element.get('text') or '').startswith(PLOTS_EMPTY):
+            return element['text']
+    return None
+
+
+def any_response(kind: str, data: dict):
+    return kind if kind in ('update', 'run_javascript') else None
+
+
+class SimulatedUser:
+    """
+    Один пользователь: страница, websocket и события элементов по их подписям.
+    Ответы сервера разбираются ожидающими предикатами: первый подходящий
+    ответ после события завершает замер.
+    """
+
+    def __init__(self, index: int, base_url: str, http, rng: random.Random, latencies: dict, errors: Counter):
+        self.index = index
+        self.base_url = base_url.rstrip('/')
+        self.http = http
+        self.rng = rng
+        self.latencies = latencies
+        self.errors = errors
+        self.client_id = ''
+        self.elements = {}
+        self.sio = None
+        self.next_message_id = 0
+        self._waiters = []
+        # Выбранная метрика топ-постов (на странице по умолчанию ER)
+        self.metric = METRICS[0]
+
+    async def open(self):
+        started = time.perf_counter()
+        async with self.http.get(self.base_url + '/') as response:
+            response.raise_for_status()
+            html = await response.text()
+        self.latencies['page_load'].append(time.perf_counter() - started)
+        elements = ELEMENTS_RE.search(html)
+        client_id = CLIENT_ID_RE.search(html)
+        if not elements or not client_id:
+            raise RuntimeError('page layout not recognized')
+        self.elements = json.loads(elements.group(1))
+        self.client_id = client_id.group(1)
+
+    async def connect(self):
+        import socketio
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.sio.on('*', self._on_message)
+        query = (f"client_id={self.client_id}&tab_id={uuid.uuid4()}&document_id={uuid.uuid4()}"
+                 f"&next_message_id=0&implicit_handshake=true")
+        started = time.perf_counter()
+        await self.sio.connect(f"{self.base_url}?{query}", transports=['websocket'],
+                               socketio_path=SOCKETIO_PATH, wait_timeout=10)
+        self.latencies['connect'].append(time.perf_counter() - started)
+
+    async def close(self):
+        if self.sio is not None:
+            await self.sio.disconnect()
+
+    async def _on_message(self, kind, data=None):
+        if not isinstance(data, dict):
+            return
+        if '_id' in data:
+            self.next_message_id = data['_id'] + 1
+        if kind == 'run_javascript' and data.get('request_id'):
+            # Браузер отвечает на каждый вызов с ожиданием результата
+            await self.sio.emit('javascript_response', {
+                'request_id': data['request_id'], 'client_id': self.client_id, 'result': None,
+            })
+        for waiter in list(self._waiters):
+            predicate, future = waiter
+            result = predicate(kind, data)
+            if result is not None and not future.done():
+                future.set_result(result)
+                self._waiters.remove(waiter)
+
+    async def ack(self):
+        if self.sio is not None and self.sio.connected:
+            await self.sio.emit('ack', {'client_id': self.client_id, 'next_message_id': self.next_message_id})
+
+    def find(self, label: str = '', card: str = '') -> str:
+        for element_id, element in self.elements.items():
+            props = element.get('props') or {}
+            if label and label in (props.get('label'), element.get('text')):
+                return element_id
+            if card and props.get('data-lazy-card') == card:
+                return element_id
+        raise KeyError(label or card)
+
+    def listener(self, element_id: str, event: str) -> str:
+        for listener in self.elements[element_id].get('events') or []:
+            if listener['type'] == event:
+                return listener['listener_id']
+        raise KeyError(f"{element_id}:{event}")
+
+    async def emit(self, element_id: str, event: str, *args):
+        await self.sio.emit('event', {
+            'id': int(element_id),
+            'client_id': self.client_id,
+            'listener_id': self.listener(element_id, event),
+            'args': [json.dumps(arg) for arg in args],
+        })
+
+    async def interact(self, name: str, element_id: str, event: str, *args, until=any_response, timeout: float = 60):
+        """
+        Событие элемента и ожидание ответа сервера; задержка записывается под именем name.
+        Ответ, не пришедший за timeout секунд, считается ошибкой, сессия продолжается (None).
+        """
+        future = asyncio.get_running_loop().create_future()
+        waiter = (until, future)
+        self._waiters.append(waiter)
+        started = time.perf_counter()
+        await self.emit(element_id, event, *args)
+        try:
+            result = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            self.errors[f"timeout:{name}"] += 1
+            return None
+        self.latencies[name].append(time.perf_counter() - started)
+        return result
+
+    async def set_value(self, label: str, value):
+        element_id = self.find(label)
+        await self.emit(element_id, 'update:value', value)
+        await self.emit(element_id, 'change')
+
+    async def think(self, mean: float):
+        if mean > 0:
+            await asyncio.sleep(self.rng.expovariate(1 / mean))
+
+    async def session(self, args):
+        channels = [f"bench_channel_{i}" for i in range(args.channels)]
+        weights = [1 / (i + 1) for i in range(len(channels))]
+        today = datetime.date.today()
+        await self.open()
+        await self.connect()
+        for card in ('stats', 'top_posts', 'insights', 'graphs'):
+            await self.emit('0', 'analtg_card_visible', {'card': card, 'visible': True})
+        for _ in range(args.iterations):
+            days = self.rng.choices(PERIOD_DAYS, weights=PERIOD_WEIGHTS)[0]
+            await self.set_value('Ссылка на канал', '@' + self.rng.choices(channels, weights=weights)[0])
+            await self.set_value('Дата от (YYYY-MM-DD)', (today - datetime.timedelta(days=days)).strftime('%Y-%m-%d'))
+            await self.set_value('Дата до (YYYY-MM-DD)', today.strftime('%Y-%m-%d'))
+            compare = self.rng.random() < args.compare_share
+            await self.emit(self.find('Сравнить с предыдущим периодом'), 'update:modelValue', compare)
+            await self.think(args.think_time)
+
+            status = await self.interact('fetch', self.find('Получить статистику'), 'click',
+                                         until=fetch_finished, timeout=args.timeout)
+            if status is None:
+                # Без завершенной загрузки карточки и графики не замеряются
+                continue
+            if status.startswith(FETCH_FAILED):
+                self.errors['fetch_failed'] += 1
+            await self.ack()
+            await self.think(args.think_time)
+
+            for _ in range(args.metric_switches):
+                # Нажатие на уже выбранную метрику ничего не меняет, и сервер не отвечает
+                self.metric = self.rng.choice([m for m in METRICS if m != self.metric])
+                await self.interact('top_posts', self.find(self.metric), 'click', timeout=args.timeout)
+                await self.think(args.think_time / 2)
+
+            aggregation = self.rng.randrange(len(AGGREGATIONS))
+            await self.emit(self._select_id(), 'update:modelValue', {'value': aggregation, 'label': AGGREGATIONS[aggregation]})
+            await self.interact('graphs', self.find('Показать графики'), 'click', until=plots_shown, timeout=args.timeout)
+            await self.ack()
+            await self.think(args.think_time)
+
+    def _select_id(self) -> str:
+        for element_id, element in self.elements.items():
+            options = (element.get('props') or {}).get('options') or []
+            if element.get('tag') == 'nicegui-select' and any(o.get('label') == AGGREGATIONS[0] for o in options):
+                return element_id
+        raise KeyError('aggregation select')
+
+
+class ServerSampler:
+    """CPU и RSS процесса сервера (с дочерними процессами вычислений) раз в interval секунд"""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.cpu = []
+        self.rss = []
+
+    def _processes(self, process):
+        try:
+            return [process] + process.children(recursive=True)
+        except Exception:
+            return [process]
+
+    async def run(self):
+        try:
+            import psutil
+        except ImportError:
+            print("Warning: psutil is not installed, server CPU and RSS are not measured", file=sys.stderr)
+            return
+        process = psutil.Process(self.pid)
+        known = {}
+        while True:
+            cpu, rss = 0.0, 0
+            for proc in self._processes(process):
+                try:
+                    # Первый вызов cpu_percent для процесса только запоминает отсчет
+                    tracked = known.setdefault(proc.pid, proc)
+                    cpu += tracked.cpu_percent(None)
+                    rss += tracked.memory_info().rss
+                except psutil.Error:
+                    known.pop(proc.pid, None)
+            self.cpu.append(cpu)
+            self.rss.append(rss)
+            await asyncio.sleep(self.interval)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, workdir: Path):
+    """main.py отдельным процессом с поддельным Telegram и временным кешем постов"""
+    port = args.port or _free_port()
+    env = dict(os.environ)
+    env.update({
+        'PORT': str(port),
+        'TELEGRAM_BACKEND': 'fake',
+        'API_ID': env.get('API_ID') or '1',
+        'API_HASH': env.get('API_HASH') or 'bench',
+        'POST_CACHE_DIR': str(workdir / 'posts'),
+        'FAKE_TG_PAGE_LATENCY': str(args.page_latency),
+        'FAKE_TG_CONNECT_LATENCY': str(args.connect_latency),
+        'FAKE_TG_CHANNEL_POSTS': str(args.channel_posts),
+    })
+    log = open(workdir / 'server.log', 'wb')
+    process = subprocess.Popen([sys.executable, str(ROOT / 'main.py')], env=env, cwd=str(ROOT),
+                               stdout=log, stderr=subprocess.STDOUT)
+    return process, f"http://127.0.0.1:{port}"
+
+
+async def wait_ready(http, url: str, timeout: float, process=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            async with http.get(url + '/') as response:
+                if response.status == 200:
+                    return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"server at {url} is not ready after {timeout:.0f} s")
+
+
+async def user_run(user: SimulatedUser, args, started_at: float):
+    await asyncio.sleep(started_at)
+    try:
+        await user.session(args)
+    except Exception as e:
+        user.errors[type(e).__name__] += 1
+    finally:
+        try:
+            await user.close()
+        except Exception:
+            pass
+
+
+async def run(args, url: str, server_pid, process=None) -> dict:
+    import aiohttp
+    rng = random.Random(args.seed)
+    latencies, errors = defaultdict(list), Counter()
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(timeout=timeout) as http:
+        await wait_ready(http, url, args.startup_timeout, process)
+        if args.warmup > 0:
+            # Фоновый прогрев импортов (STARTUP_MODE=warm) не должен попасть в замер
+            await asyncio.sleep(args.warmup)
+        sampler = ServerSampler(server_pid) if server_pid else None
+        sampling = asyncio.create_task(sampler.run()) if sampler else None
+        users = [SimulatedUser(i, url, http, random.Random(rng.random()), latencies, errors) for i in range(args.users)]
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            user_run(user, args, args.ramp_up * i / max(1, args.users)) for i, user in enumerate(users)
+        ))
+        elapsed = time.perf_counter() - started
+        if sampling:
+            sampling.cancel()
+            try:
+                await sampling
+            except asyncio.CancelledError:
+                pass
+    return {'elapsed': elapsed, 'latencies': latencies, 'errors': errors, 'sampler': sampler}
+
+
+def report(args, result: dict):
+    latencies = result['latencies']
+    print(f"users: {args.users}, iterations: {args.iterations}, elapsed: {result['elapsed']:.1f} s")
+    print(f"{'interaction':<14}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'mean ms':>10}")
+    interactions = [name for name in ('page_load', 'connect', 'fetch', 'top_posts', 'graphs') if latencies.get(name)]
+    for name in interactions:
+        values = latencies[name]
+        print(f"{name:<14}{len(values):>8}{percentile(values, 50) * 1000:>10.0f}{percentile(values, 99) * 1000:>10.0f}"
+              f"{max(values) * 1000:>10.0f}{statistics.mean(values) * 1000:>10.0f}")
+    sampler = result['sampler']
+    if sampler and sampler.cpu:
+        # Первый отсчет cpu_percent всегда 0
+        cpu = sampler.cpu[1:] or sampler.cpu
+        print(f"server cpu %: mean {statistics.mean(cpu):.0f}, p99 {percentile(cpu, 99):.0f}, max {max(cpu):.0f}")
+        print(f"server rss MB: start {sampler.rss[0] / 1e6:.0f}, peak {max(sampler.rss) / 1e6:.0f}, "
+              f"end {sampler.rss[-1] / 1e6:.0f}")
+    print(f"errors: {dict(result['errors']) or 0}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Нагрузочный тест приложения с одновременными пользователями')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=2, help='Запросов статистики на пользователя')
+    parser.add_argument('--channels', type=int, default=5)
+    parser.add_argument('--metric-switches', type=int, default=3,
+                        help='Переключений метрики топ-постов после загрузки')
+    parser.add_argument('--compare-share', type=float, default=0.3, help='Доля запросов со сравнением периодов')
+    parser.add_argument('--think-time', type=float, default=1.0, help='Средняя пауза между действиями (секунды)')
+    parser.add_argument('--ramp-up', type=float, default=5.0, help='Пользователи подключаются за это время (секунды)')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Предельное ожидание ответа (секунды)')
+    parser.add_argument('--url', default='', help='Адрес уже запущенного приложения (иначе main.py запускается здесь)')
+    parser.add_argument('--server-pid', type=int, default=0, help='PID сервера для замера CPU и RSS при --url')
+    parser.add_argument('--port', type=int, default=0, help='Порт запускаемого сервера (по умолчанию свободный)')
+    parser.add_argument('--startup-timeout', type=float, default=60.0)
+    parser.add_argument('--warmup', type=float, default=5.0, help='Пауза после старта сервера (секунды)')
+    parser.add_argument('--page-latency', type=float, default=0.15)
+    parser.add_argument('--connect-latency', type=float, default=0.3)
+    parser.add_argument('--channel-posts', type=int, default=1500)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.url:
+        result = asyncio.run(run(args, args.url, args.server_pid or None))
+    else:
+        with tempfile.TemporaryDirectory(prefix='analtg-load-') as workdir:
+            process, url = start_server(args, Path(workdir))
+            try:
+                result = asyncio.run(run(args, url, process.pid, process))
+            finally:
+                process.terminate()
+                try:
+                    process.wait(10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+    report(args, result)
+    return 1 if result['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
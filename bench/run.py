@@ -0,0 +1,301 @@
+"""
+Бенчмарки аналитики и отображения на синтетических каналах
+
+Каждый бенчмарк выполняется на постах core.synthetic указанных размеров:
+время — медиана из нескольких повторов, память — пик выделений (tracemalloc)
+в отдельном прогоне. Результаты сравниваются с bench/baselines.json: замедление
+или рост памяти больше порога считается регрессией (код возврата 1).
+
+Использование:
+    python -m bench.run                         # размеры 1k, 10k, 100k
+    python -m bench.run --sizes 1000,1000000 --only calculate_metrics,agg_period
+    python -m bench.run --save                  # записать результаты как базовые
+    python -m bench.run --time-threshold 1.5 --json results.json
+    python -m bench.run --loop-lag --sizes 200000   # задержка event loop без исполнителя и с ним
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import statistics
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.synthetic import generate_posts, period_of
+from core.analytics import calculate_metrics, compare_periods, agg_period
+from core.posting_insights import analyze_posting_times
+
+
+BASELINES_PATH = Path(__file__).parent / 'baselines.json'
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+# Регрессия: медиана времени больше базовой в TIME_THRESHOLD раз, пик памяти — в MEMORY_THRESHOLD
+TIME_THRESHOLD = 1.3
+MEMORY_THRESHOLD = 1.2
+# Короткие замеры шумные: разница меньше этого не считается регрессией (секунды, байты)
+TIME_NOISE_FLOOR = 0.005
+MEMORY_NOISE_FLOOR = 256 * 1024
+# Повторы по умолчанию; для больших размеров и тяжелых бенчмарков — меньше
+REPEATS = 5
+REPEATS_LARGE = 2
+LARGE_SIZE = 200_000
+
+
+def _fresh(posts):
+    # stats_html и format_top_posts кешируют ER в постах ('_er') — каждый повтор на чистых копиях
+    return [dict(p) for p in posts]
+
+
+def _plot(posts, start, end):
+    from ui.graphs import plot_stat_all
+    files = plot_stat_all(posts, start, end, 'week')
+    for name in files:
+        os.unlink(name)
+
+
+class Benchmark:
+    """
+    Бенчмарк: prepare(posts, previous) возвращает (функция, аргументы) для одного
+    повтора; подготовка не входит в замер.
+    """
+
+    def __init__(self, name, prepare, heavy: bool = False):
+        self.name = name
+        self.prepare = prepare
+        # Тяжелые бенчмарки (секунды на прогон) повторяются меньше
+        self.heavy = heavy
+
+
+def _bench_agg_period(posts, previous):
+    import pandas as pd
+    return agg_period, (pd.DataFrame(posts), 'week')
+
+
+def _bench_stats_html(posts, previous):
+    from ui.stats import stats_html
+    start, end = period_of(posts)
+    return stats_html, (_fresh(posts), start, end, 'bench', compare_periods(posts, previous))
+
+
+def _bench_format_top_posts(posts, previous):
+    from ui.top_posts import format_top_posts
+    return format_top_posts, (_fresh(posts), 'bench', 'er')
+
+
+def _bench_plot_stat_all(posts, previous):
+    start, end = period_of(posts)
+    return _plot, (posts, start, end)
+
+
+BENCHMARKS = [
+    Benchmark('calculate_metrics', lambda posts, previous: (calculate_metrics, (posts,))),
+    Benchmark('compare_periods', lambda posts, previous: (compare_periods, (posts, previous))),
+    Benchmark('agg_period', _bench_agg_period),
+    Benchmark('analyze_posting_times', lambda posts, previous: (analyze_posting_times, (posts,))),
+    Benchmark('stats_html', _bench_stats_html),
+    Benchmark('format_top_posts', _bench_format_top_posts),
+    Benchmark('plot_stat_all', _bench_plot_stat_all, heavy=True),
+]
+
+
+def measure(bench: Benchmark, posts: list, previous: list, repeats: int) -> dict:
+    """Медиана и минимум времени по повторам и пик памяти одного прогона"""
+    # Прогревочный прогон: импорты и кеши шаблонов не входят в замер
+    func, args = bench.prepare(posts, previous)
+    func(*args)
+
+    timings = []
+    for _ in range(repeats):
+        func, args = bench.prepare(posts, previous)
+        started = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - started)
+
+    func, args = bench.prepare(posts, previous)
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'median': statistics.median(timings),
+        'min': min(timings),
+        'peak_bytes': peak,
+    }
+
+
+# Вычисления карточек, которые UI выполняет при загрузке канала
+LOOP_LAG_WORKLOAD = ('calculate_metrics', 'compare_periods', 'analyze_posting_times', 'stats_html')
+
+
+async def _loop_lag_run(posts: list, previous: list, use_executor: bool) -> dict:
+    from core.compute import LAG_MONITOR, run_compute
+    LAG_MONITOR.max_lag = 0.0
+    LAG_MONITOR.stalls.clear()
+    LAG_MONITOR.start()
+    # Пульс должен успеть отметиться до начала вычислений
+    await asyncio.sleep(LAG_MONITOR.interval * 2)
+    started = time.perf_counter()
+    try:
+        for bench in BENCHMARKS:
+            if bench.name not in LOOP_LAG_WORKLOAD:
+                continue
+            func, args = bench.prepare(posts, previous)
+            if use_executor:
+                await run_compute(func, *args)
+            else:
+                func(*args)
+            # Между карточками loop обрабатывает другие события, как в UI
+            await asyncio.sleep(0)
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(LAG_MONITOR.interval * 2)
+    finally:
+        LAG_MONITOR.stop()
+    return {'max_lag': LAG_MONITOR.max_lag, 'stalls': len(LAG_MONITOR.stalls), 'elapsed': elapsed}
+
+
+def measure_loop_lag(posts: list, previous: list) -> dict:
+    """
+    Наибольшая задержка event loop (LAG_MONITOR.max_lag), пока вычисляются карточки
+    канала: прямо в event loop и через исполнитель core.compute
+    """
+    from core.compute import shutdown_executor
+    # Прогрев на маленьком канале: импорты модулей карточек не входят в замер
+    warmup = generate_posts(100, seed=3)
+    for bench in BENCHMARKS:
+        if bench.name in LOOP_LAG_WORKLOAD:
+            func, args = bench.prepare(warmup, warmup)
+            func(*args)
+    results = {}
+    for mode, use_executor in (('inline', False), ('executor', True)):
+        try:
+            results[mode] = asyncio.run(_loop_lag_run(posts, previous, use_executor))
+        finally:
+            shutdown_executor()
+    return results
+
+
+def compare(results: dict, baselines: dict, time_threshold: float, memory_threshold: float) -> list:
+    """Список регрессий относительно базовых значений"""
+    regressions = []
+    for key, result in results.items():
+        base = baselines.get(key)
+        if not base:
+            continue
+        if (result['median'] > base['median'] * time_threshold
+                and result['median'] - base['median'] > TIME_NOISE_FLOOR):
+            regressions.append(f"{key}: time {base['median'] * 1000:.1f} -> {result['median'] * 1000:.1f} ms")
+        if (result['peak_bytes'] > base['peak_bytes'] * memory_threshold
+                and result['peak_bytes'] - base['peak_bytes'] > MEMORY_NOISE_FLOOR):
+            regressions.append(f"{key}: memory {base['peak_bytes'] / 1e6:.1f} -> {result['peak_bytes'] / 1e6:.1f} MB")
+    return regressions
+
+
+def load_baselines(path: Path = BASELINES_PATH) -> dict:
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'machine': None, 'results': {}}
+
+
+def machine_info() -> dict:
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Бенчмарки аналитики на синтетических каналах')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='Размеры каналов через запятую (число постов)')
+    parser.add_argument('--only', default='', help='Имена бенчмарков через запятую')
+    parser.add_argument('--repeats', type=int, default=0, help='Число повторов (по умолчанию зависит от размера)')
+    parser.add_argument('--save', action='store_true', help='Сохранить результаты как базовые')
+    parser.add_argument('--time-threshold', type=float, default=TIME_THRESHOLD)
+    parser.add_argument('--memory-threshold', type=float, default=MEMORY_THRESHOLD)
+    parser.add_argument('--json', default='', help='Записать результаты в JSON-файл')
+    parser.add_argument('--loop-lag', action='store_true',
+                        help='Измерить задержку event loop при вычислениях без исполнителя и с ним')
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    only = {s.strip() for s in args.only.split(',') if s.strip()}
+    benchmarks = [b for b in BENCHMARKS if not only or b.name in only]
+    unknown = only - {b.name for b in BENCHMARKS}
+    if unknown:
+        print(f"Unknown benchmarks: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    if args.loop_lag:
+        return main_loop_lag(sizes, args.json)
+
+    baselines = load_baselines()
+    if baselines.get('machine') and baselines['machine'] != machine_info():
+        print("Warning: baselines were recorded on a different machine, thresholds are approximate", file=sys.stderr)
+
+    results = {}
+    print(f"{'benchmark':<24}{'posts':>10}{'median ms':>12}{'min ms':>10}{'peak MB':>10}{'base ms':>10}")
+    for size in sizes:
+        posts = generate_posts(size, seed=1)
+        previous = generate_posts(size, seed=2)
+        for bench in benchmarks:
+            key = f"{bench.name}@{size}"
+            repeats = args.repeats or (REPEATS_LARGE if size >= LARGE_SIZE or bench.heavy else REPEATS)
+            result = measure(bench, posts, previous, repeats)
+            results[key] = result
+            base = baselines['results'].get(key)
+            base_ms = f"{base['median'] * 1000:.1f}" if base else '-'
+            print(f"{bench.name:<24}{size:>10}{result['median'] * 1000:>12.1f}{result['min'] * 1000:>10.1f}"
+                  f"{result['peak_bytes'] / 1e6:>10.1f}{base_ms:>10}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'machine': machine_info(), 'results': results}, f, indent=2)
+
+    if args.save:
+        baselines['machine'] = machine_info()
+        baselines['results'].update(results)
+        with open(BASELINES_PATH, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baselines saved to {BASELINES_PATH}")
+        return 0
+
+    regressions = compare(results, baselines['results'], args.time_threshold, args.memory_threshold)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+def main_loop_lag(sizes: list, json_path: str = '') -> int:
+    """
+    Сценарий задержки event loop. Результаты не сравниваются с базовыми:
+    задержка зависит от числа ядер и планировщика больше, чем время вычислений
+    """
+    results = {}
+    print(f"{'mode':<12}{'posts':>10}{'max lag ms':>12}{'stalls':>8}{'total ms':>10}")
+    for size in sizes:
+        posts = generate_posts(size, seed=1)
+        previous = generate_posts(size, seed=2)
+        for mode, result in measure_loop_lag(posts, previous).items():
+            results[f"loop_lag_{mode}@{size}"] = result
+            print(f"{mode:<12}{size:>10}{result['max_lag'] * 1000:>12.1f}{result['stalls']:>8}"
+                  f"{result['elapsed'] * 1000:>10.1f}")
+
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({'machine': machine_info(), 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Служебные маршруты администратора (/admin/...)
+
+Доступны, только если задан ADMIN_TOKEN; токен передается заголовком
+Authorization: Bearer <токен> или параметром ?token= (для скачивания из браузера).
+"""
+import os
+import hmac
+
+
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '').strip()
+ADMIN_PREFIX = '/admin'
+
+# Флаг регистрации маршрутов администратора
+_admin_routes_registered = False
+
+
+def is_admin_request(request) -> bool:
+    """Проверяет токен администратора в запросе"""
+    if not ADMIN_TOKEN:
+        return False
+    supplied = request.query_params.get('token', '')
+    auth = request.headers.get('authorization', '')
+    if auth.startswith('Bearer '):
+        supplied = auth[len('Bearer '):]
+    return hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode())
+
+
+def register_admin_routes():
+    """Регистрирует маршруты администратора (один раз на процесс)"""
+    global _admin_routes_registered
+    if _admin_routes_registered or not ADMIN_TOKEN:
+        return
+
+    from nicegui import app
+    from fastapi import Request
+    from fastapi.responses import JSONResponse, FileResponse, Response
+    from core import tracing
+
+    def denied():
+        return Response(status_code=404)
+
+    @app.get(f'{ADMIN_PREFIX}/traces', include_in_schema=False)
+    def list_traces(request: Request, slow: float = 0.0):
+        """Последние запросы (новые первыми); slow — минимальная длительность в секундах"""
+        if not is_admin_request(request):
+            return denied()
+        return JSONResponse([
+            {key: value for key, value in trace.to_dict().items() if key != 'spans'} | {'summary': trace.format_summary()}
+            for trace in reversed(tracing.RECENT_TRACES)
+            if (trace.duration or 0) >= slow
+        ])
+
+    @app.get(f'{ADMIN_PREFIX}/traces/{{request_id}}', include_in_schema=False)
+    def get_trace(request: Request, request_id: str):
+        """Все трассы запроса (загрузка, карточки, графики) с этапами"""
+        if not is_admin_request(request):
+            return denied()
+        traces = tracing.find_traces(request_id)
+        if not traces:
+            return Response(status_code=404)
+        return JSONResponse(traces)
+
+    @app.post(f'{ADMIN_PREFIX}/profile', include_in_schema=False)
+    def arm_profile(request: Request, mode: str = 'sampling'):
+        """Профилирует следующий запрос: mode=cprofile или sampling"""
+        if not is_admin_request(request):
+            return denied()
+        try:
+            tracing.arm_profile(mode)
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+        return JSONResponse({'armed': mode})
+
+    @app.get(f'{ADMIN_PREFIX}/profiles/{{name}}', include_in_schema=False)
+    def download_profile(request: Request, name: str):
+        """Скачивание профиля (.prof — cProfile, .folded — свернутые стеки)"""
+        if not is_admin_request(request):
+            return denied()
+        path = tracing.PROFILES_DIR / os.path.basename(name)
+        if path.suffix not in ('.prof', '.folded') or not path.is_file():
+            return Response(status_code=404)
+        return FileResponse(path, filename=path.name, media_type='application/octet-stream')
+
+    _admin_routes_registered = True
@@ -0,0 +1,221 @@
+"""
+Контроль допуска загрузок из Telegram
+
+Одновременно выполняется не больше FETCH_MAX_CONCURRENT загрузок, остальные ждут
+в очереди. Политика 'fair' (по умолчанию) отдает освободившийся слот ожидающему
+клиенту с наименьшим числом занятых слотов, при равенстве — пришедшему раньше;
+'fifo' — строго по порядку прихода. Фоновые загрузки получают слот, только когда
+нет ожидающих пользователей, и уступают его: если пользователю не хватает слота,
+самая поздняя фоновая загрузка отменяется и завершается исключением FetchPreempted.
+Ожидающие получают свою позицию и оценку ожидания.
+"""
+import os
+import sys
+import time
+import math
+import asyncio
+import itertools
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+from core.tracing import span
+
+
+FETCH_MAX_CONCURRENT = int(os.getenv('FETCH_MAX_CONCURRENT', '4'))
+FETCH_QUEUE_POLICY = os.getenv('FETCH_QUEUE_POLICY', 'fair').strip().lower()
+# Начальная оценка длительности загрузки до первых замеров (секунды)
+FETCH_DURATION_ESTIMATE = 10.0
+
+
+class FetchPreempted(Exception):
+    """Фоновая загрузка отменена, чтобы освободить слот загрузке пользователя"""
+
+
+class _Waiter:
+    __slots__ = ('seq', 'client_key', 'background', 'future', 'on_update')
+
+    def __init__(self, seq, client_key, background, future, on_update):
+        self.seq = seq
+        self.client_key = client_key
+        self.background = background
+        self.future = future
+        self.on_update = on_update
+
+
+class _Holder:
+    __slots__ = ('task', 'preempted')
+
+    def __init__(self, task):
+        self.task = task
+        self.preempted = False
+
+
+class AdmissionController:
+    """Ограничение числа одновременных загрузок с очередью ожидания"""
+
+    def __init__(self, max_concurrent: int = FETCH_MAX_CONCURRENT, policy: str = FETCH_QUEUE_POLICY):
+        self.max_concurrent = max(1, max_concurrent)
+        self.policy = policy
+        self.active = 0
+        self._active_by_client = Counter()
+        self._waiters = []
+        # Фоновые загрузки, занимающие слоты, в порядке получения слота
+        self._background_holders = []
+        self._seq = itertools.count()
+        # Скользящая средняя длительности загрузки — для оценки ожидания
+        self.avg_duration = FETCH_DURATION_ESTIMATE
+        self.admitted = 0
+        self.cancelled = 0
+        self.preempted = 0
+
+    @property
+    def queued(self) -> int:
+        """Число ожидающих загрузок пользователей"""
+        return sum(1 for w in self._waiters if not w.background)
+
+    def estimate_wait(self, position: int) -> float:
+        """Оценка ожидания (секунды) для позиции в очереди (1 — следующий)"""
+        return math.ceil(position / self.max_concurrent) * self.avg_duration
+
+    def _ordered_waiters(self) -> list:
+        """Ожидающие в порядке, в котором они получат слоты"""
+        active = Counter(self._active_by_client)
+        pending = list(self._waiters)
+        ordered = []
+        while pending:
+            users = [w for w in pending if not w.background] or pending
+            if self.policy == 'fifo':
+                nxt = min(users, key=lambda w: w.seq)
+            else:
+                nxt = min(users, key=lambda w: (active[w.client_key], w.seq))
+            ordered.append(nxt)
+            pending.remove(nxt)
+            active[nxt.client_key] += 1
+        return ordered
+
+    def _notify(self):
+        for position, waiter in enumerate(self._ordered_waiters(), start=1):
+            if waiter.on_update is not None:
+                try:
+                    waiter.on_update(position, self.estimate_wait(position))
+                except Exception as e:
+                    print(f"Warning: queue position callback failed: {e}", file=sys.stderr)
+
+    def _dispatch(self):
+        while self.active < self.max_concurrent:
+            ordered = self._ordered_waiters()
+            if not ordered:
+                break
+            waiter = ordered[0]
+            self._waiters.remove(waiter)
+            if waiter.future.done():
+                continue
+            self._admit(waiter.client_key)
+            waiter.future.set_result(None)
+        self._notify()
+
+    def _preempt(self):
+        """Отменяет фоновые загрузки (начиная с последней), пока ожидающим пользователям не хватает слотов"""
+        releasing = sum(1 for h in self._background_holders if h.preempted)
+        missing = self.queued - releasing - (self.max_concurrent - self.active)
+        for holder in reversed(self._background_holders):
+            if missing <= 0:
+                break
+            if holder.preempted:
+                continue
+            holder.preempted = True
+            holder.task.cancel()
+            self.preempted += 1
+            missing -= 1
+
+    def _admit(self, client_key):
+        self.active += 1
+        self._active_by_client[client_key] += 1
+        self.admitted += 1
+
+    def _release(self, client_key, duration: Optional[float]):
+        self.active -= 1
+        self._active_by_client[client_key] -= 1
+        if self._active_by_client[client_key] <= 0:
+            del self._active_by_client[client_key]
+        if duration is not None:
+            self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, client_key=None, on_update: Optional[Callable[[int, float], None]] = None, background: bool = False):
+        """
+        Занимает слот загрузки на время блока async with.
+
+        Args:
+            client_key: Идентификатор клиента (для справедливой очереди)
+            on_update: Вызывается с (позиция в очереди, оценка ожидания в секундах),
+                пока загрузка ждет слота
+            background: Фоновая загрузка (получает слот после всех пользователей
+                и уступает его им)
+
+        Raises:
+            FetchPreempted: Фоновая загрузка отменена ради загрузки пользователя
+        """
+        if self.active < self.max_concurrent and not self._waiters:
+            self._admit(client_key)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            waiter = _Waiter(next(self._seq), client_key, background, future, on_update)
+            self._waiters.append(waiter)
+            if not background:
+                self._preempt()
+            self._notify()
+            try:
+                with span('admission_wait', queued=len(self._waiters)):
+                    await future
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    # Отмена в очереди: место освобождается для следующих
+                    self._waiters.remove(waiter)
+                    self._notify()
+                elif future.done() and not future.cancelled():
+                    # Слот уже выдан, но загрузка отменена до начала
+                    self._release(client_key, None)
+                self.cancelled += 1
+                raise
+        holder = _Holder(asyncio.current_task()) if background else None
+        if holder is not None:
+            self._background_holders.append(holder)
+        started = time.monotonic()
+        completed = False
+        try:
+            yield
+            completed = True
+        except asyncio.CancelledError:
+            if holder is None or not holder.preempted:
+                raise
+            # Отмена ради пользователя снимается со счета отмен задачи; если задачу
+            # отменили и по другой причине, она остается отмененной
+            if hasattr(holder.task, 'uncancel') and holder.task.uncancel() > 0:
+                raise
+            raise FetchPreempted() from None
+        finally:
+            if holder is not None:
+                self._background_holders.remove(holder)
+            # Длительность отмененной загрузки не учитывается в оценке ожидания
+            self._release(client_key, time.monotonic() - started if completed else None)
+
+    def summary(self) -> dict:
+        """Сводка состояния очереди"""
+        return {
+            'max_concurrent': self.max_concurrent,
+            'policy': self.policy,
+            'active': self.active,
+            'queued': self.queued,
+            'queued_background': len(self._waiters) - self.queued,
+            'avg_duration': self.avg_duration,
+            'admitted': self.admitted,
+            'cancelled': self.cancelled,
+            'preempted': self.preempted,
+        }
+
+
+# Глобальный контроллер загрузок из Telegram
+FETCH_ADMISSION = AdmissionController()
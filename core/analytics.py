@@ -2,8 +2,10 @@
 Модуль для аналитики и расчетов метрик
 """
 import datetime
-import pandas as pd
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 def calculate_er(likes, comments, reposts, views):
@@ -37,6 +39,25 @@ def calculate_previous_period(start_date: str, end_date: str) -> tuple[str, str]
     return prev_start.strftime("%Y-%m-%d"), prev_end.strftime("%Y-%m-%d")
 
 
+def filter_posts_by_period(posts: list, start_date: str, end_date: str) -> list:
+    """
+    Отбирает посты, опубликованные в указанном периоде (включительно).
+    
+    Args:
+        posts: Список постов
+        start_date: Начало периода (YYYY-MM-DD)
+        end_date: Конец периода (YYYY-MM-DD)
+    
+    Returns:
+        list: Посты периода
+    """
+    # Нормализуем границы один раз, после чего даты в формате YYYY-MM-DD
+    # сравниваются как строки без парсинга каждого поста
+    start = datetime.datetime.strptime(start_date, "%Y-%m-%d").strftime("%Y-%m-%d")
+    end = datetime.datetime.strptime(end_date, "%Y-%m-%d").strftime("%Y-%m-%d")
+    return [post for post in posts if start <= post['date'] <= end]
+
+
 def calculate_metrics(posts: list) -> dict:
     """
     Рассчитывает метрики для списка постов.
@@ -130,8 +151,23 @@ def compare_periods(current_posts: list, previous_posts: list) -> dict:
     return result
 
 
-def agg_period(df: pd.DataFrame, period: str) -> pd.DataFrame:
+def compare_period_posts(posts: list, previous_posts: list, start_date: str, end_date: str,
+                         prev_start: str, prev_end: str) -> tuple[dict, int, int]:
+    """
+    Отбирает посты обоих периодов и сравнивает их метрики.
+    
+    Returns:
+        tuple: (результат compare_periods, число постов текущего периода, число постов предыдущего)
+    """
+    current_posts = filter_posts_by_period(posts, start_date, end_date)
+    period_posts = filter_posts_by_period(previous_posts, prev_start, prev_end)
+    return compare_periods(current_posts, period_posts), len(current_posts), len(period_posts)
+
+
+def agg_period(df: 'pd.DataFrame', period: str) -> 'pd.DataFrame':
     """Агрегирует данные по периоду"""
+    # pandas импортируется при первом использовании (см. core/startup.py)
+    import pandas as pd
     df = df.copy()
     df["date"] = pd.to_datetime(df["date"])
     if period == 'week':
@@ -145,6 +181,64 @@ def agg_period(df: pd.DataFrame, period: str) -> pd.DataFrame:
     return df
 
 
+def aggregate_by_period(posts: list, period: str) -> 'pd.DataFrame':
+    """
+    Суммы лайков, комментариев, репостов и просмотров, число постов и ER по периодам.
+
+    Returns:
+        pd.DataFrame: Колонки period, likes, comments, reposts, views, posts, ER
+            (по возрастанию периода); пустой, если постов нет
+    """
+    import pandas as pd
+    df = pd.DataFrame(posts)
+    if df.empty:
+        return df
+    df = agg_period(df, period)
+    grouped = df.groupby('period').agg({
+        'likes': 'sum',
+        'comments': 'sum',
+        'reposts': 'sum',
+        'views': 'sum',
+        'id': 'count'
+    }).rename(columns={'id':'posts'}).reset_index()
+    grouped = grouped.sort_values("period")
+    er_values = []
+    likes = grouped["likes"].tolist()
+    comments = grouped["comments"].tolist()
+    reposts = grouped["reposts"].tolist()
+    views = grouped["views"].tolist()
+    for i in range(len(grouped)):
+        t_eng = likes[i] + comments[i] + reposts[i]
+        er = t_eng / views[i] * 100 if views[i] > 0 else 0
+        er_values.append(er)
+    grouped['ER'] = er_values
+    return grouped
+
+
+def top_posts_by_metric(posts: list, mode: str, k: int = 5) -> list:
+    """
+    Отбирает k лучших постов по метрике так же, как блок топ-постов
+    (для ER — только посты больше чем с 50 просмотрами), не изменяя посты.
+
+    Returns:
+        list: Посты с полем 'er'
+    """
+    import heapq
+    if mode == 'er':
+        candidates = [p for p in posts if p.get('views', 0) > 50]
+    else:
+        candidates = posts
+    rows = [
+        (p, calculate_er(p.get('likes', 0), p.get('comments', 0), p.get('reposts', 0), p.get('views', 0)))
+        for p in candidates
+    ]
+    if mode == 'er':
+        top = heapq.nlargest(k, rows, key=lambda row: row[1])
+    else:
+        top = heapq.nlargest(k, rows, key=lambda row: row[0].get(mode, 0))
+    return [dict(p, er=er) for p, er in top]
+
+
 def period_by_rus(period: str) -> str:
     """Переводит период на русский"""
     return dict(week="Неделя", month="Месяц", quarter="Квартал", day="День").get(period, "Период")
@@ -159,46 +253,27 @@ def format_metric(num: int) -> str:
     return str(num)
 
 
-def format_delta(delta_abs: float, delta_percent: Optional[float], is_light_bg: bool = False) -> str:
+def delta_direction(delta_abs: float, delta_percent: Optional[float]) -> tuple[str, str, str]:
     """
-    Форматирует дельту для отображения.
+    Возвращает направление дельты для отображения.
     
     Args:
         delta_abs: Абсолютная дельта
         delta_percent: Процентная дельта (может быть None)
-        is_light_bg: Если True, использует светлые цвета для темного фона
     
     Returns:
-        str: HTML строка с форматированной дельтой
+        tuple: (направление 'up'/'down'/'flat', иконка, строка процента)
     """
     if delta_abs > 0:
-        icon = "▲"
-        if is_light_bg:
-            color = "#fff"
-        else:
-            color = "#059669"
+        direction, icon = "up", "▲"
     elif delta_abs < 0:
-        icon = "▼"
-        if is_light_bg:
-            color = "#ffcccc"
-        else:
-            color = "#dc2626"
+        direction, icon = "down", "▼"
     else:
-        icon = "—"
-        if is_light_bg:
-            color = "#e5e7eb"
-        else:
-            color = "#6b7280"
+        direction, icon = "flat", "—"
     
     if delta_percent is not None:
         percent_str = f"{delta_percent:+.1f}%"
     else:
         percent_str = "—"
     
-    return f"""
-    <div style="display: flex; align-items: center; justify-content: center; gap: 4px; margin-top: 4px;">
-        <span style="color: {color}; font-size: 14px;">{icon}</span>
-        <span style="color: {color}; font-size: 13px; font-weight: 600;">{percent_str}</span>
-    </div>
-    """
-
+    return direction, icon, percent_str
@@ -0,0 +1,323 @@
+"""
+JSON API статистики канала (/api/...)
+
+Маршруты отдают те же данные, что показывает интерфейс, для канала и периода
+(channel, start_date, end_date в формате YYYY-MM-DD):
+
+- /api/stats — calculate_metrics, при compare=true — compare_periods с предыдущим периодом;
+- /api/top_posts — топ-k постов по метрикам (metrics=er,views,...; k до API_MAX_TOP);
+- /api/aggregates — суммы и ER по периодам (period=week|month|quarter|day);
+- /api/insights — analyze_posting_times.
+
+Посты берутся из кеша постов (core.post_cache) и загружаются из Telegram, только
+если кеш не содержит период или устарел. ETag ответа зависит от параметров и от
+времени загрузки постов в кеш, поэтому повторный запрос с If-None-Match получает
+304 без вычислений, а готовые ответы хранятся в памяти (API_RESULT_CACHE_SIZE).
+Cache-Control: max-age — оставшееся время жизни записи кеша постов.
+Если задан API_TOKEN, нужен заголовок Authorization: Bearer <токен>.
+"""
+import os
+import sys
+import json
+import time
+import hmac
+import hashlib
+import datetime
+from collections import OrderedDict
+
+from core import post_cache
+from core.metrics import API_REQUESTS
+from core.analytics import (
+    aggregate_by_period, calculate_metrics, calculate_previous_period, compare_periods, top_posts_by_metric,
+)
+from core.compute import run_compute
+from core.posting_insights import analyze_posting_times
+from core.services import extract_channel_username
+
+
+API_PREFIX = '/api'
+API_TOKEN = os.getenv('API_TOKEN', '').strip()
+# Число сообщений, просматриваемых при загрузке канала (как в интерфейсе)
+API_FETCH_LIMIT = 1500
+API_MAX_TOP = 50
+# Готовых ответов в памяти процесса
+API_RESULT_CACHE_SIZE = int(os.getenv('API_RESULT_CACHE_SIZE', '256'))
+
+TOP_METRICS = ('er', 'views', 'likes', 'comments', 'reposts')
+AGG_PERIODS = ('week', 'month', 'quarter', 'day')
+
+# Флаг регистрации маршрутов API
+_api_routes_registered = False
+# Ключ ответа -> тело JSON (bytes)
+_results = OrderedDict()
+
+
+class ApiError(Exception):
+    """Ошибка запроса с HTTP-статусом"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def _parse_date(value: str, name: str) -> str:
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except (TypeError, ValueError):
+        raise ApiError(f"{name}: ожидается дата YYYY-MM-DD")
+
+
+def _period_key(channel: str, start_date: str, end_date: str) -> tuple:
+    return extract_channel_username(channel).lower(), start_date, end_date
+
+
+def _parse_period(channel: str, start_date: str, end_date: str) -> tuple[str, str, str]:
+    if not channel or not channel.strip():
+        raise ApiError("channel: не указан канал")
+    start = _parse_date(start_date, 'start_date')
+    end = _parse_date(end_date, 'end_date')
+    if start > end:
+        raise ApiError("start_date не должна быть позже end_date")
+    return channel.strip(), start, end
+
+
+async def _period_posts(api_id, api_hash, channel: str, start_date: str, end_date: str) -> tuple[list, float, float]:
+    """
+    Посты периода из кеша постов (с загрузкой, если период не в кеше или устарел).
+
+    Returns:
+        tuple: (посты, версия данных, сколько секунд данные остаются свежими)
+    """
+    entry = await post_cache.load_entry(channel)
+    fresh = (
+        post_cache.covers(entry, start_date, end_date, API_FETCH_LIMIT)
+        and time.time() - entry['fetched_at'] <= post_cache.POST_CACHE_TTL
+    )
+    if not fresh:
+        try:
+            posts = await post_cache.fetch_posts_cached(
+                api_id, api_hash, channel, start_date, end_date, limit=API_FETCH_LIMIT, client_key='api'
+            )
+        except Exception as e:
+            raise ApiError(f"Ошибка загрузки канала: {e}", status=502)
+        entry = await post_cache.load_entry(channel)
+        if not post_cache.covers(entry, start_date, end_date, API_FETCH_LIMIT):
+            # Результат не попал в кеш (например, запись другого limit) — ответ без кеширования
+            return posts, time.time(), 0.0
+    posts = post_cache.posts_in_range(entry['posts'], start_date, end_date)
+    # Продолженная запись сохраняет fetched_at, но получает новые сообщения
+    version = (entry['fetched_at'], entry.get('last_id'))
+    return posts, version, max(0.0, post_cache.POST_CACHE_TTL - (time.time() - entry['fetched_at']))
+
+
+def _etag(key: tuple) -> str:
+    return '"' + hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:24] + '"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Проверяет If-None-Match (список тегов, слабые теги W/ и '*')"""
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or any(tag.removeprefix('W/') == etag for tag in tags)
+
+
+def _remember_result(key: tuple, body: bytes):
+    _results[key] = body
+    _results.move_to_end(key)
+    while len(_results) > API_RESULT_CACHE_SIZE:
+        _results.popitem(last=False)
+
+
+def _dumps(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, default=str).encode('utf-8')
+
+
+async def _stats(api_id, api_hash, channel, start_date, end_date, compare: bool):
+    previous = None
+    prev_start = prev_end = ''
+    if compare:
+        # Оба периода — одно окно кеша постов: раздельные загрузки вытесняли бы друг друга
+        prev_start, prev_end = calculate_previous_period(start_date, end_date)
+        both, version, fresh_for = await _period_posts(api_id, api_hash, channel, prev_start, end_date)
+        posts = post_cache.posts_in_range(both, start_date, end_date)
+        previous = post_cache.posts_in_range(both, prev_start, prev_end)
+    else:
+        posts, version, fresh_for = await _period_posts(api_id, api_hash, channel, start_date, end_date)
+
+    async def compute():
+        result = {'channel': extract_channel_username(channel), 'start_date': start_date, 'end_date': end_date}
+        if compare:
+            result['previous_period'] = {'start_date': prev_start, 'end_date': prev_end}
+            result['comparison'] = await run_compute(compare_periods, posts, previous)
+            result['metrics'] = result['comparison']['current']
+        else:
+            result['metrics'] = await run_compute(calculate_metrics, posts)
+        return result
+
+    return _period_key(channel, start_date, end_date) + (compare,), [version], fresh_for, compute
+
+
+def _post_json(post: dict, channel_username: str) -> dict:
+    return {
+        'id': post['id'],
+        'date': post['date'],
+        'datetime': post['datetime'],
+        'title': post.get('title', ''),
+        'views': post.get('views', 0),
+        'likes': post.get('likes', 0),
+        'comments': post.get('comments', 0),
+        'reposts': post.get('reposts', 0),
+        'er': post['er'],
+        'link': f"https://t.me/{channel_username}/{post['id']}",
+    }
+
+
+def _top_posts_all(posts: list, modes: tuple, k: int, channel_username: str) -> dict:
+    return {
+        mode: [_post_json(p, channel_username) for p in top_posts_by_metric(posts, mode, k)]
+        for mode in modes
+    }
+
+
+def _aggregates(posts: list, period: str) -> list:
+    grouped = aggregate_by_period(posts, period)
+    if grouped.empty:
+        return []
+    return [
+        {
+            'period': str(row['period']),
+            'posts': int(row['posts']),
+            'views': int(row['views']),
+            'likes': int(row['likes']),
+            'comments': int(row['comments']),
+            'reposts': int(row['reposts']),
+            'er': float(row['ER']),
+        }
+        for row in grouped.to_dict('records')
+    ]
+
+
+def is_api_request_allowed(request) -> bool:
+    if not API_TOKEN:
+        return True
+    auth = request.headers.get('authorization', '')
+    supplied = auth[len('Bearer '):] if auth.startswith('Bearer ') else ''
+    return hmac.compare_digest(supplied.encode(), API_TOKEN.encode())
+
+
+def register_api_routes(api_id, api_hash):
+    """Регистрирует маршруты JSON API (один раз на процесс)"""
+    global _api_routes_registered
+    if _api_routes_registered:
+        return
+
+    from nicegui import app
+    from fastapi import Request
+    from fastapi.responses import JSONResponse, Response
+
+    async def respond(request: Request, endpoint: str, prepare):
+        """
+        prepare() возвращает (параметры ответа, версии данных, свежесть в секундах,
+        корутинная функция вычисления); ответ кешируется по параметрам и версиям.
+        """
+        if not is_api_request_allowed(request):
+            API_REQUESTS.inc(1, endpoint, 'unauthorized')
+            return Response(status_code=401)
+        try:
+            key_params, versions, fresh_for, compute = await prepare()
+        except ApiError as e:
+            API_REQUESTS.inc(1, endpoint, 'error')
+            return JSONResponse({'error': str(e)}, status_code=e.status)
+
+        key = (endpoint, key_params, tuple(versions))
+        etag = _etag(key)
+        headers = {
+            'ETag': etag,
+            'Cache-Control': f"{'private' if API_TOKEN else 'public'}, max-age={int(fresh_for)}",
+        }
+        if _etag_matches(request.headers.get('if-none-match', ''), etag):
+            API_REQUESTS.inc(1, endpoint, 'not_modified')
+            return Response(status_code=304, headers=headers)
+
+        body = _results.get(key)
+        if body is None:
+            try:
+                body = _dumps(await compute())
+            except Exception as e:
+                print(f"Warning: API {endpoint} failed: {e}", file=sys.stderr)
+                API_REQUESTS.inc(1, endpoint, 'error')
+                return JSONResponse({'error': 'Ошибка вычисления'}, status_code=500)
+            _remember_result(key, body)
+            API_REQUESTS.inc(1, endpoint, 'ok')
+        else:
+            API_REQUESTS.inc(1, endpoint, 'cached')
+        return Response(content=body, media_type='application/json', headers=headers)
+
+    @app.get(f'{API_PREFIX}/stats')
+    async def api_stats(request: Request, channel: str = '', start_date: str = '', end_date: str = '',
+                        compare: bool = False):
+        """Метрики периода; compare=true — сравнение с предыдущим периодом той же длины"""
+        async def prepare():
+            period = _parse_period(channel, start_date, end_date)
+            return await _stats(api_id, api_hash, *period, compare)
+        return await respond(request, 'stats', prepare)
+
+    @app.get(f'{API_PREFIX}/top_posts')
+    async def api_top_posts(request: Request, channel: str = '', start_date: str = '', end_date: str = '',
+                            metrics: str = ','.join(TOP_METRICS), k: int = 5):
+        """Топ-k постов по каждой из метрик (er, views, likes, comments, reposts)"""
+        async def prepare():
+            period = _parse_period(channel, start_date, end_date)
+            modes = tuple(dict.fromkeys(m.strip() for m in metrics.split(',') if m.strip()))
+            unknown = [m for m in modes if m not in TOP_METRICS]
+            if not modes or unknown:
+                raise ApiError(f"metrics: допустимы {', '.join(TOP_METRICS)}")
+            if not 1 <= k <= API_MAX_TOP:
+                raise ApiError(f"k: от 1 до {API_MAX_TOP}")
+            posts, version, fresh_for = await _period_posts(api_id, api_hash, *period)
+            username = extract_channel_username(period[0])
+
+            async def compute():
+                return {
+                    'channel': username, 'start_date': period[1], 'end_date': period[2], 'k': k,
+                    'top': await run_compute(_top_posts_all, posts, modes, k, username),
+                }
+            return _period_key(*period) + (modes, k), [version], fresh_for, compute
+        return await respond(request, 'top_posts', prepare)
+
+    @app.get(f'{API_PREFIX}/aggregates')
+    async def api_aggregates(request: Request, channel: str = '', start_date: str = '', end_date: str = '',
+                             period: str = 'week'):
+        """Суммы метрик, число постов и ER по неделям, месяцам, кварталам или дням"""
+        async def prepare():
+            channel_period = _parse_period(channel, start_date, end_date)
+            if period not in AGG_PERIODS:
+                raise ApiError(f"period: допустимы {', '.join(AGG_PERIODS)}")
+            posts, version, fresh_for = await _period_posts(api_id, api_hash, *channel_period)
+
+            async def compute():
+                return {
+                    'channel': extract_channel_username(channel_period[0]),
+                    'start_date': channel_period[1], 'end_date': channel_period[2], 'period': period,
+                    'aggregates': await run_compute(_aggregates, posts, period),
+                }
+            return _period_key(*channel_period) + (period,), [version], fresh_for, compute
+        return await respond(request, 'aggregates', prepare)
+
+    @app.get(f'{API_PREFIX}/insights')
+    async def api_insights(request: Request, channel: str = '', start_date: str = '', end_date: str = ''):
+        """Рекомендации по времени публикаций (analyze_posting_times)"""
+        async def prepare():
+            period = _parse_period(channel, start_date, end_date)
+            posts, version, fresh_for = await _period_posts(api_id, api_hash, *period)
+
+            async def compute():
+                return {
+                    'channel': extract_channel_username(period[0]), 'start_date': period[1], 'end_date': period[2],
+                    'insights': await run_compute(analyze_posting_times, posts),
+                }
+            return _period_key(*period), [version], fresh_for, compute
+        return await respond(request, 'insights', prepare)
+
+    _api_routes_registered = True
@@ -0,0 +1,152 @@
+"""
+Пакетный анализ каналов без интерфейса
+
+Каналы загружаются одновременно (не больше concurrency загрузок на весь запуск)
+через тот же путь, что и в интерфейсе: кеш постов, очередь загрузок, Telegram.
+Для каждого канала считаются метрики, сравнение с предыдущим периодом и
+рекомендации по времени публикаций; результаты отдаются по мере готовности.
+"""
+import time
+import asyncio
+import datetime
+from typing import AsyncIterator, Optional
+
+from core.admission import FETCH_ADMISSION
+from core.analytics import calculate_metrics, calculate_previous_period, compare_periods
+from core.compute import run_compute
+from core.post_cache import POST_CACHE_TTL, fetch_posts_cached
+from core.posting_insights import analyze_posting_times
+from core.services import extract_channel_username
+
+
+# Число сообщений, просматриваемых при загрузке канала (как в интерфейсе)
+BATCH_FETCH_LIMIT = 1500
+# Период по умолчанию — последние DEFAULT_PERIOD_DAYS дней
+DEFAULT_PERIOD_DAYS = 30
+
+
+class BatchJob:
+    """Канал и период для анализа"""
+
+    def __init__(self, channel: str, start_date: str, end_date: str):
+        self.channel = channel
+        self.start_date = start_date
+        self.end_date = end_date
+
+
+def default_period() -> tuple[str, str]:
+    today = datetime.date.today()
+    start = today - datetime.timedelta(days=DEFAULT_PERIOD_DAYS - 1)
+    return start.strftime("%Y-%m-%d"), today.strftime("%Y-%m-%d")
+
+
+def _check_date(value: str) -> str:
+    datetime.datetime.strptime(value, "%Y-%m-%d")
+    return value
+
+
+def parse_job(line: str, start_date: str, end_date: str) -> Optional[BatchJob]:
+    """
+    Разбирает строку списка каналов: «канал [дата_от дата_до]» через пробелы
+    или запятые; пустые строки и комментарии (#) пропускаются.
+
+    Raises:
+        ValueError: Неверное число полей или формат даты
+    """
+    line = line.split('#', 1)[0].replace(',', ' ').strip()
+    if not line:
+        return None
+    fields = line.split()
+    if len(fields) == 1:
+        fields += [start_date, end_date]
+    if len(fields) != 3:
+        raise ValueError(f"ожидается «канал [дата_от дата_до]»: {line}")
+    channel, start, end = fields[0], _check_date(fields[1]), _check_date(fields[2])
+    if start > end:
+        raise ValueError(f"дата 'от' позже даты 'до': {line}")
+    return BatchJob(channel, start, end)
+
+
+async def analyze_channel(
+    api_id,
+    api_hash,
+    job: BatchJob,
+    compare: bool = False,
+    limit: int = BATCH_FETCH_LIMIT,
+    max_age: float = POST_CACHE_TTL
+) -> dict:
+    """
+    Загружает посты периода канала (и предыдущего периода при compare) и считает
+    то же, что показывает интерфейс. Ошибка загрузки не прерывает пакет: она
+    попадает в результат со статусом 'error'.
+
+    Returns:
+        dict: Результат, сериализуемый в JSON
+    """
+    started = time.perf_counter()
+    result = {
+        'channel': extract_channel_username(job.channel),
+        'start_date': job.start_date,
+        'end_date': job.end_date,
+    }
+    try:
+        posts = await fetch_posts_cached(
+            api_id, api_hash, job.channel, job.start_date, job.end_date, limit=limit,
+            max_age=max_age, client_key='batch'
+        )
+        result['posts'] = len(posts)
+        if compare:
+            prev_start, prev_end = calculate_previous_period(job.start_date, job.end_date)
+            previous = await fetch_posts_cached(
+                api_id, api_hash, job.channel, prev_start, prev_end, limit=limit,
+                max_age=max_age, client_key='batch'
+            )
+            result['previous_period'] = {'start_date': prev_start, 'end_date': prev_end, 'posts': len(previous)}
+            result['comparison'] = await run_compute(compare_periods, posts, previous)
+            result['metrics'] = result['comparison']['current']
+        else:
+            result['metrics'] = await run_compute(calculate_metrics, posts)
+        result['posting_insights'] = await run_compute(analyze_posting_times, posts)
+        result['status'] = 'ok'
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['duration'] = round(time.perf_counter() - started, 3)
+    return result
+
+
+async def run_batch(
+    api_id,
+    api_hash,
+    jobs: list,
+    concurrency: int = 4,
+    compare: bool = False,
+    limit: int = BATCH_FETCH_LIMIT,
+    max_age: float = POST_CACHE_TTL
+) -> AsyncIterator[dict]:
+    """
+    Анализирует каналы одновременно и отдает результаты в порядке готовности.
+
+    Args:
+        concurrency: Сколько каналов обрабатывается и сколько загрузок из Telegram
+            идет одновременно на весь запуск (прежний предел загрузок процесса
+            восстанавливается после запуска)
+    """
+    concurrency = max(1, concurrency)
+    previous_limit = FETCH_ADMISSION.max_concurrent
+    FETCH_ADMISSION.max_concurrent = concurrency
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker(job):
+        async with semaphore:
+            return await analyze_channel(api_id, api_hash, job, compare, limit, max_age)
+
+    tasks = [asyncio.create_task(worker(job)) for job in jobs]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        FETCH_ADMISSION.max_concurrent = previous_limit
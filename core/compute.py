@@ -0,0 +1,195 @@
+"""
+Вычислительный слой: выполнение CPU-тяжёлой аналитики вне event loop
+и мониторинг задержек event loop
+"""
+import os
+import sys
+import time
+import asyncio
+import functools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from core import metrics, tracing
+
+
+# Тип исполнителя: 'thread' (по умолчанию) или 'process'
+COMPUTE_EXECUTOR = os.getenv('COMPUTE_EXECUTOR', 'thread').strip().lower()
+COMPUTE_WORKERS = int(os.getenv('COMPUTE_WORKERS', '4'))
+
+# Порог, начиная с которого задержка event loop считается зависанием (секунды)
+LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', '0.1'))
+LOOP_LAG_INTERVAL = 0.05
+
+PROJECT_ROOT = str(Path(__file__).parent.parent)
+
+_executor = None
+
+
+def get_executor():
+    """Возвращает (и при первом вызове создает) исполнитель для вычислений"""
+    global _executor
+    if _executor is None:
+        if COMPUTE_EXECUTOR == 'process':
+            _executor = ProcessPoolExecutor(max_workers=COMPUTE_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=COMPUTE_WORKERS, thread_name_prefix='compute')
+    return _executor
+
+
+def shutdown_executor():
+    """Останавливает исполнитель (вызывается при остановке приложения)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def run_compute(func, *args, **kwargs):
+    """
+    Выполняет функцию в исполнителе и ожидает результат, не блокируя event loop.
+
+    В режиме 'process' функция и аргументы должны сериализоваться pickle,
+    а изменения аргументов внутри функции (например, кеш '_er' в постах)
+    не возвращаются в основной процесс.
+
+    Args:
+        func: Функция для выполнения
+        *args, **kwargs: Аргументы функции
+
+    Returns:
+        Результат функции
+    """
+    loop = asyncio.get_running_loop()
+    name = getattr(func, '__name__', 'unknown')
+    started = time.perf_counter()
+    try:
+        with tracing.span(f"compute:{name}"):
+            return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+    finally:
+        metrics.COMPUTE_DURATION.observe(time.perf_counter() - started, name)
+
+
+def _describe_frame(frame) -> str:
+    """
+    Формирует имя функции, которая выполнялась в event loop во время зависания.
+    Предпочитает самый глубокий кадр из кода проекта, иначе берет самый глубокий кадр.
+    """
+    # Поток event loop находится в select(): сам loop свободен, но не может
+    # получить GIL, пока его удерживают потоки-исполнители
+    if frame.f_code.co_name == 'select' and os.path.basename(frame.f_code.co_filename) == 'selectors.py':
+        return 'selectors.py:select (GIL contention with executor threads)'
+    innermost = None
+    current = frame
+    while current is not None:
+        code = current.f_code
+        location = f"{os.path.basename(code.co_filename)}:{code.co_name}:{current.f_lineno}"
+        if innermost is None:
+            innermost = location
+        if code.co_filename.startswith(PROJECT_ROOT) and os.sep + 'site-packages' + os.sep not in code.co_filename:
+            return location
+        current = current.f_back
+    return innermost or 'unknown'
+
+
+class LoopLagMonitor:
+    """
+    Монитор задержек event loop.
+
+    Корутина-«пульс» засыпает на фиксированный интервал и измеряет, насколько позже
+    она проснулась. Отдельный поток-наблюдатель замечает, что пульс не обновлялся
+    дольше порога, и снимает стек потока event loop, чтобы назвать функцию,
+    которая его блокирует.
+    """
+
+    def __init__(self, threshold: float = LOOP_LAG_THRESHOLD, interval: float = LOOP_LAG_INTERVAL, history: int = 200):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = deque(maxlen=history)
+        self.stalls_total = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._last_beat = time.monotonic()
+        self._culprit: Optional[str] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task = None
+        self._watchdog = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Запускает монитор в текущем event loop"""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name='loop-lag-watchdog', daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        """Останавливает монитор"""
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self):
+        """Периодически отмечается и измеряет опоздание пробуждения"""
+        while True:
+            before = time.monotonic()
+            self._last_beat = before
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - before - self.interval)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            metrics.LOOP_LAG.observe(lag)
+            culprit, self._culprit = self._culprit, None
+            if lag >= self.threshold:
+                self.stalls_total += 1
+                culprit = culprit or 'unknown'
+                self.stalls.append({
+                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    'duration': lag,
+                    'function': culprit,
+                })
+                print(f"Warning: event loop blocked for {lag * 1000:.0f} ms by {culprit}", file=sys.stderr)
+
+    def _watch(self):
+        """Поток-наблюдатель: снимает стек event loop во время зависания"""
+        while not self._stop.wait(self.interval / 2):
+            stalled_for = time.monotonic() - self._last_beat - self.interval
+            if stalled_for < self.threshold / 2 or self._culprit is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self._culprit = _describe_frame(frame)
+
+    def summary(self) -> dict:
+        """Возвращает сводку по задержкам event loop"""
+        return {
+            'threshold': self.threshold,
+            'last_lag': self.last_lag,
+            'max_lag': self.max_lag,
+            'stalls_count': len(self.stalls),
+            'stalls': list(self.stalls),
+        }
+
+
+# Глобальный экземпляр монитора
+LAG_MONITOR = LoopLagMonitor()
+
+
+def start_lag_monitor():
+    """Запускает монитор задержек (обработчик app.on_startup)"""
+    LAG_MONITOR.start()
+
+
+def stop_compute():
+    """Останавливает монитор и исполнитель (обработчик app.on_shutdown)"""
+    LAG_MONITOR.stop()
+    shutdown_executor()
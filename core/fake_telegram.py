@@ -0,0 +1,385 @@
+"""
+Локальная замена Telegram для нагрузочных тестов пути загрузки
+
+FakeTelegramClient повторяет ту часть интерфейса TelegramClient, которой пользуется
+fetch_posts_async (connect, is_user_authorized, get_input_entity, iter_messages,
+disconnect, а также запросы GetHistoryRequest и channels.GetMessagesRequest через
+client(request)), и отдает
+историю канала страницами с настраиваемой задержкой.
+История берется из кассеты (записанные ответы настоящего Telegram), иначе
+генерируется core.synthetic по имени канала. Можно внедрять FloodWait (короткие
+клиент пережидает сам, как Telethon, длинные выбрасываются FloodWaitError)
+и обрывы соединения.
+
+Включение без изменения кода: TELEGRAM_BACKEND=fake (см. core/services.py),
+запись кассет с настоящего Telegram: TELEGRAM_BACKEND=record.
+"""
+import os
+import sys
+import json
+import zlib
+import bisect
+import random
+import asyncio
+import logging
+import datetime
+from collections import Counter
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional
+
+from core.synthetic import generate_posts
+
+
+CASSETTE_DIR = Path(os.getenv('TELEGRAM_CASSETTE_DIR', str(Path(__file__).parent.parent / 'cache' / 'cassettes')))
+
+# Счетчики обращений ко всем поддельным клиентам процесса
+FAKE_STATS = Counter()
+
+_log = logging.getLogger('telethon.client.users')
+
+
+class FakeTelegramConfig:
+    """Параметры поддельного Telegram (по умолчанию — из переменных окружения FAKE_TG_*)"""
+
+    def __init__(
+        self,
+        page_size: int = int(os.getenv('FAKE_TG_PAGE_SIZE', '100')),
+        page_latency: float = float(os.getenv('FAKE_TG_PAGE_LATENCY', '0.15')),
+        latency_jitter: float = float(os.getenv('FAKE_TG_LATENCY_JITTER', '0.3')),
+        connect_latency: float = float(os.getenv('FAKE_TG_CONNECT_LATENCY', '0.3')),
+        channel_posts: int = int(os.getenv('FAKE_TG_POSTS', '1500')),
+        channel_days: int = int(os.getenv('FAKE_TG_DAYS', '730')),
+        flood_rate: float = float(os.getenv('FAKE_TG_FLOOD_RATE', '0')),
+        flood_seconds: int = int(os.getenv('FAKE_TG_FLOOD_SECONDS', '5')),
+        flood_sleep_threshold: int = 60,
+        disconnect_rate: float = float(os.getenv('FAKE_TG_DISCONNECT_RATE', '0')),
+        service_share: float = 0.01,
+        cassette_dir: Path = CASSETTE_DIR,
+        seed: Optional[int] = None,
+    ):
+        """
+        Args:
+            page_size: Сообщений в одной странице ответа (у Telegram — до 100)
+            page_latency: Средняя задержка страницы (секунды)
+            latency_jitter: Разброс задержки (доля от средней)
+            connect_latency: Задержка подключения (секунды)
+            channel_posts: Постов в синтетическом канале
+            channel_days: За сколько последних дней распределены посты синтетического канала
+            flood_rate: Вероятность FloodWait на странице
+            flood_seconds: Сколько секунд просит FloodWait
+            flood_sleep_threshold: FloodWait не длиннее порога пережидается без ошибки (как в Telethon)
+            disconnect_rate: Вероятность обрыва соединения на странице
+            service_share: Доля служебных сообщений в синтетической истории
+            cassette_dir: Каталог кассет с записанными историями
+            seed: Зерно для задержек и сбоев (None — случайное)
+        """
+        self.page_size = page_size
+        self.page_latency = page_latency
+        self.latency_jitter = latency_jitter
+        self.connect_latency = connect_latency
+        self.channel_posts = channel_posts
+        self.channel_days = channel_days
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.flood_sleep_threshold = flood_sleep_threshold
+        self.disconnect_rate = disconnect_rate
+        self.service_share = service_share
+        self.cassette_dir = Path(cassette_dir)
+        self.rng = random.Random(seed)
+
+    def latency(self, mean: float) -> float:
+        if mean <= 0:
+            return 0.0
+        return max(0.0, mean * self.rng.uniform(1 - self.latency_jitter, 1 + self.latency_jitter))
+
+
+# ------------------ Сообщения ----------------------
+
+def _service_message(message_id: int, date: datetime.datetime):
+    from telethon.tl.types import MessageService, PeerChannel, MessageActionPinMessage
+    return MessageService(id=message_id, peer_id=PeerChannel(1), date=date, action=MessageActionPinMessage())
+
+
+def _message(record: dict):
+    """Сообщение с теми атрибутами, которые читает core.services._message_to_post"""
+    date = datetime.datetime.fromisoformat(record['date'])
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    if record.get('service'):
+        return _service_message(record['id'], date)
+    likes = record.get('likes', 0)
+    return SimpleNamespace(
+        id=record['id'],
+        date=date,
+        text=record.get('text', ''),
+        reactions=SimpleNamespace(results=[SimpleNamespace(count=likes)]) if likes else None,
+        replies=SimpleNamespace(replies=record.get('comments', 0)),
+        forwards=record.get('reposts', 0),
+        views=record.get('views', 0),
+    )
+
+
+def _raw_message(record: dict):
+    """Сырое сообщение TL, как в ответе messages.getHistory"""
+    from telethon.tl import types
+    date = datetime.datetime.fromisoformat(record['date'])
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    if record.get('service'):
+        return _service_message(record['id'], date)
+    likes = record.get('likes', 0)
+    return types.Message(
+        id=record['id'],
+        peer_id=types.PeerChannel(1),
+        date=date,
+        message=record.get('text', ''),
+        post=True,
+        views=record.get('views', 0),
+        forwards=record.get('reposts', 0),
+        replies=types.MessageReplies(replies=record.get('comments', 0), replies_pts=0),
+        reactions=types.MessageReactions(results=[
+            types.ReactionCount(reaction=types.ReactionEmoji(emoticon='👍'), count=likes)
+        ]) if likes else None,
+    )
+
+
+def message_record(message) -> dict:
+    """Запись кассеты по сообщению Telethon (только поля, нужные приложению)"""
+    from telethon.tl.types import MessageService
+    date = message.date.isoformat() if message.date else None
+    if isinstance(message, MessageService):
+        return {'id': message.id, 'date': date, 'service': True}
+    reactions = getattr(message, 'reactions', None)
+    replies = getattr(message, 'replies', None)
+    return {
+        'id': message.id,
+        'date': date,
+        'text': (message.text or '')[:70],
+        'likes': sum(r.count for r in reactions.results) if reactions else 0,
+        'comments': replies.replies if replies and replies.replies is not None else 0,
+        'reposts': getattr(message, 'forwards', 0) or 0,
+        'views': getattr(message, 'views', 0) or 0,
+    }
+
+
+# ------------------ Истории каналов ----------------------
+
+def cassette_path(channel: str, cassette_dir: Path = CASSETTE_DIR) -> Path:
+    return Path(cassette_dir) / f"{channel.lower()}.json"
+
+
+def load_cassette(channel: str, cassette_dir: Path = CASSETTE_DIR) -> Optional[list]:
+    """Записанная история канала (записи по возрастанию id) или None"""
+    path = cassette_path(channel, cassette_dir)
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)['messages']
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Warning: cassette {path.name} ignored: {e}", file=sys.stderr)
+        return None
+
+
+def save_cassette(channel: str, records: list, cassette_dir: Path = CASSETTE_DIR):
+    """Дописывает записи в кассету канала (совпадающие id заменяются)"""
+    path = cassette_path(channel, cassette_dir)
+    merged = {r['id']: r for r in (load_cassette(channel, cassette_dir) or [])}
+    merged.update((r['id'], r) for r in records)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({
+            'channel': channel,
+            'recorded_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'messages': [merged[i] for i in sorted(merged)],
+        }, f, ensure_ascii=False)
+    tmp.replace(path)
+
+
+def synthetic_history(channel: str, config: FakeTelegramConfig) -> list:
+    """Синтетическая история канала: одинаковая для одного и того же имени"""
+    seed = zlib.crc32(channel.lower().encode())
+    today = datetime.date.today()
+    start = today - datetime.timedelta(days=config.channel_days)
+    posts = generate_posts(
+        config.channel_posts, start.strftime('%Y-%m-%d'), today.strftime('%Y-%m-%d'), seed=seed
+    )
+    rng = random.Random(seed)
+    records = []
+    for post in posts:
+        if rng.random() < config.service_share:
+            records.append({'id': len(records) + 1, 'date': post['datetime'].isoformat(), 'service': True})
+        records.append({
+            'id': len(records) + 1,
+            'date': post['datetime'].isoformat(),
+            'text': '' if post['title'] == '(без текста)' else post['title'],
+            'likes': post['likes'],
+            'comments': post['comments'],
+            'reposts': post['reposts'],
+            'views': post['views'],
+        })
+    return records
+
+
+_histories = {}
+
+
+def channel_history(channel: str, config: FakeTelegramConfig) -> list:
+    """История канала для поддельного клиента (кассета или синтетическая), с кешем"""
+    key = (channel.lower(), str(config.cassette_dir), config.channel_posts, config.channel_days, config.service_share)
+    history = _histories.get(key)
+    if history is None:
+        history = load_cassette(channel, config.cassette_dir) or synthetic_history(channel, config)
+        _histories[key] = history
+    return history
+
+
+# ------------------ Клиенты ----------------------
+
+class FakeTelegramClient:
+    """Поддельный TelegramClient для пути загрузки (core.services.fetch_posts_async)"""
+
+    def __init__(self, config: Optional[FakeTelegramConfig] = None):
+        self.config = config or FakeTelegramConfig()
+        self.connected = False
+
+    async def connect(self):
+        FAKE_STATS['connects'] += 1
+        await asyncio.sleep(self.config.latency(self.config.connect_latency))
+        self.connected = True
+
+    async def is_user_authorized(self) -> bool:
+        return True
+
+    async def disconnect(self):
+        self.connected = False
+
+    async def get_input_entity(self, channel: str):
+        FAKE_STATS['resolves'] += 1
+        await asyncio.sleep(self.config.latency(self.config.page_latency))
+        return channel
+
+    async def _page_pause(self, request_name: str = 'GetHistoryRequest'):
+        """Задержка страницы, внедренные FloodWait и обрывы"""
+        config = self.config
+        FAKE_STATS['pages'] += 1
+        if config.flood_rate and config.rng.random() < config.flood_rate:
+            FAKE_STATS['flood_waits'] += 1
+            if config.flood_seconds > config.flood_sleep_threshold:
+                from telethon.errors import FloodWaitError
+                raise FloodWaitError(request=None, capture=config.flood_seconds)
+            # Тот же журнал, что у Telethon, когда он пережидает FloodWait сам
+            _log.info('Sleeping%s for %ds (%s) on %s flood wait', '', config.flood_seconds,
+                      datetime.timedelta(seconds=config.flood_seconds), request_name)
+            await asyncio.sleep(config.flood_seconds)
+        if config.disconnect_rate and config.rng.random() < config.disconnect_rate:
+            FAKE_STATS['disconnects'] += 1
+            self.connected = False
+            raise ConnectionError('Connection to Telegram failed (simulated)')
+        await asyncio.sleep(config.latency(config.page_latency))
+
+    async def iter_messages(self, entity, limit=None, reverse=False, min_id=0, max_id=0):
+        """Сообщения канала страницами по page_size (reverse=True — от старых к новым)"""
+        if not self.connected:
+            raise ConnectionError('Cannot send requests while disconnected')
+        FAKE_STATS['requests'] += 1
+        history = channel_history(str(entity), self.config)
+        selected = [r for r in history if r['id'] > min_id and (not max_id or r['id'] < max_id)]
+        if not reverse:
+            selected.reverse()
+        if limit is not None:
+            selected = selected[:limit]
+        page_size = max(1, self.config.page_size)
+        for offset in range(0, len(selected), page_size):
+            await self._page_pause()
+            for record in selected[offset:offset + page_size]:
+                FAKE_STATS['messages'] += 1
+                yield _message(record)
+
+
+    async def __call__(self, request):
+        """
+        Сырой запрос; поддерживаются GetHistoryRequest (страница истории)
+        и channels.GetMessagesRequest (сообщения по id)
+        """
+        from telethon.tl import types
+        from telethon.tl.functions.messages import GetHistoryRequest
+        from telethon.tl.functions.channels import GetMessagesRequest
+        if not isinstance(request, (GetHistoryRequest, GetMessagesRequest)):
+            raise NotImplementedError(f"{type(request).__name__} is not supported by FakeTelegramClient")
+        if not self.connected:
+            raise ConnectionError('Cannot send requests while disconnected')
+        FAKE_STATS['requests'] += 1
+        if isinstance(request, GetMessagesRequest):
+            await self._page_pause('GetMessagesRequest')
+            history = channel_history(str(request.channel), self.config)
+            by_id = {r['id']: r for r in history}
+            # Удаленные и несуществующие сообщения Telegram возвращает как MessageEmpty
+            messages = [
+                _raw_message(by_id[i.id]) if i.id in by_id
+                else types.MessageEmpty(id=i.id, peer_id=types.PeerChannel(1))
+                for i in request.id
+            ]
+            FAKE_STATS['messages'] += len(messages)
+            return types.messages.ChannelMessages(
+                pts=0, count=len(messages), messages=messages, topics=[], chats=[], users=[]
+            )
+        await self._page_pause()
+        history = channel_history(str(request.peer), self.config)
+        # Как у Telegram: история от новых к старым, страница начинается с первого
+        # сообщения с id < offset_id, сдвинутого на add_offset; размер страницы
+        # задает limit запроса (page_size здесь не действует)
+        older = bisect.bisect_left(history, request.offset_id, key=lambda r: r['id']) if request.offset_id else len(history)
+        start = max(0, older - request.add_offset - request.limit)
+        end = min(len(history), max(0, older - request.add_offset))
+        page = history[start:end][::-1]
+        FAKE_STATS['messages'] += len(page)
+        return types.messages.ChannelMessages(
+            pts=0, count=len(history), messages=[_raw_message(r) for r in page],
+            topics=[], chats=[], users=[]
+        )
+
+
+class RecordingClient:
+    """
+    Обертка настоящего TelegramClient: ответы iter_messages записываются в кассеты
+    (при disconnect), чтобы потом воспроизводить их FakeTelegramClient
+    """
+
+    def __init__(self, client, cassette_dir: Path = CASSETTE_DIR):
+        self._client = client
+        self._cassette_dir = Path(cassette_dir)
+        self._recorded = {}
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    async def get_input_entity(self, channel: str):
+        entity = await self._client.get_input_entity(channel)
+        self._recorded.setdefault(id(entity), (channel, []))
+        return entity
+
+    async def iter_messages(self, entity, *args, **kwargs):
+        channel, records = self._recorded.setdefault(id(entity), (str(entity), []))
+        async for message in self._client.iter_messages(entity, *args, **kwargs):
+            records.append(message_record(message))
+            yield message
+
+    async def disconnect(self):
+        try:
+            for channel, records in self._recorded.values():
+                if records:
+                    await asyncio.to_thread(save_cassette, channel, records, self._cassette_dir)
+        except Exception as e:
+            print(f"Warning: failed to save cassette: {e}", file=sys.stderr)
+        finally:
+            self._recorded.clear()
+            await self._client.disconnect()
+
+
+def fake_client_factory(config: Optional[FakeTelegramConfig] = None):
+    """Фабрика клиентов для core.services.set_client_factory"""
+    config = config or FakeTelegramConfig()
+    return lambda api_id, api_hash: FakeTelegramClient(config)
@@ -0,0 +1,367 @@
+"""
+Процессы загрузки постов из Telegram
+
+При FETCH_WORKERS > 0 загрузки (fetch_posts_async) выполняются в отдельных
+процессах: разбор сообщений Telethon и построение постов не занимают event loop
+веб-процесса, а медленная или упавшая загрузка не влияет на интерфейс. Процессы
+запускаются как `python -m core.fetch_workers`, обмениваются с веб-процессом
+сообщениями multiprocessing.connection через свою пару локальных сокетов и сами
+создают клиентов Telegram из той же сессии (core.services.create_client).
+
+Посты возвращаются пачками кортежей полей по мере просмотра и записываются
+в FetchCheckpoint веб-процесса, поэтому отмененная загрузка продолжается так же,
+как загрузка в процессе. Клиент, подмененный set_client_factory, действует
+только в текущем процессе. FloodWait, учтенные процессом загрузки, пересылаются
+в метрики веб-процесса сообщениями 'flood_waits'.
+
+В собранном PyInstaller приложении (TGBotStat.spec, sys.frozen) интерпретатора для
+`-m core.fetch_workers` нет, поэтому процессы загрузки там не поддерживаются:
+FETCH_WORKERS > 0 отклоняется с ошибкой при запуске (check_fetch_workers).
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import datetime
+import threading
+import itertools
+import subprocess
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Optional
+
+from core import metrics
+from core.services import FetchCheckpoint, _observe_fetch, fetch_posts_async
+
+
+# Число процессов загрузки (0 — загрузка в веб-процессе, как раньше)
+FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', '0'))
+# Как часто процесс отправляет просмотренные посты (секунды)
+FETCH_BATCH_INTERVAL = 0.2
+# Как часто проверять, что процесс, выполняющий загрузку, жив (секунды)
+WORKER_POLL_INTERVAL = 1.0
+
+# Поля поста в порядке значений в пачке
+POST_FIELDS = ('id', 'date', 'datetime', 'title', 'likes', 'comments', 'reposts', 'views')
+
+PROJECT_ROOT = str(Path(__file__).parent.parent)
+
+
+def _portable_error(error: BaseException) -> BaseException:
+    """Исключение, которое можно передать между процессами"""
+    import pickle
+    try:
+        return pickle.loads(pickle.dumps(error))
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+class _Worker:
+    """Процесс загрузки со стороны веб-процесса"""
+
+    def __init__(self, index: int, process: subprocess.Popen, connection):
+        self.index = index
+        self.process = process
+        self.connection = connection
+        self.jobs = 0
+        self.send_lock = threading.Lock()
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def send(self, message):
+        with self.send_lock:
+            self.connection.send(message)
+
+
+class FetchWorkerPool:
+    """Процессы загрузки и распределение загрузок между ними (по числу выполняемых)"""
+
+    def __init__(self, workers: int):
+        self._workers = []
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        for index in range(workers):
+            self._workers.append(self._spawn(index))
+
+    def _spawn(self, index: int) -> _Worker:
+        own, other = socket.socketpair()
+        try:
+            process = subprocess.Popen(
+                [sys.executable, '-m', 'core.fetch_workers', str(other.fileno())],
+                cwd=PROJECT_ROOT, stdin=subprocess.DEVNULL, pass_fds=(other.fileno(),),
+            )
+        finally:
+            other.close()
+        worker = _Worker(index, process, Connection(own.detach()))
+        threading.Thread(target=self._read, args=(worker,), daemon=True, name=f'fetch-worker-{index}').start()
+        return worker
+
+    def _read(self, worker: _Worker):
+        """Передает сообщения процесса ожидающим загрузкам (в их event loop)"""
+        while True:
+            try:
+                message = worker.connection.recv()
+            except (EOFError, OSError):
+                return
+            job = self._jobs.get(message[1])
+            if job is not None:
+                loop, queue = job
+                loop.call_soon_threadsafe(queue.put_nowait, message)
+
+    async def _replace(self, worker: _Worker):
+        """Заменяет упавший процесс новым"""
+        if self._workers[worker.index] is not worker:
+            return
+        worker.connection.close()
+        self._workers[worker.index] = await asyncio.to_thread(self._spawn, worker.index)
+
+    async def fetch(self, api_id, api_hash, channel_link, start_date, end_date, limit=1000,
+                    progress_callback=None, checkpoint=None) -> list:
+        """То же, что fetch_posts_async, но сообщения просматривает процесс загрузки"""
+        if checkpoint is None or not checkpoint.matches(channel_link, limit):
+            checkpoint = FetchCheckpoint(channel_link, limit)
+        start = datetime.datetime.strptime(start_date, "%Y-%m-%d")
+        end = datetime.datetime.strptime(end_date, "%Y-%m-%d")
+
+        def in_range(posts):
+            return [p for p in posts if start <= p['datetime'] <= end]
+
+        if checkpoint.scanned >= limit:
+            return in_range(checkpoint.posts)
+
+        worker = min(self._workers, key=lambda w: w.jobs)
+        job_id = next(self._ids)
+        queue = asyncio.Queue()
+        self._jobs[job_id] = (asyncio.get_running_loop(), queue)
+        worker.jobs += 1
+        total = len(in_range(checkpoint.posts))
+        reported = total // 20
+        fetch_started = time.perf_counter()
+        scanned_before = checkpoint.scanned
+        outcome = 'error'
+        try:
+            try:
+                worker.send(('fetch', job_id, {
+                    'api_id': api_id, 'api_hash': api_hash, 'channel': channel_link,
+                    'start_date': start_date, 'end_date': end_date, 'limit': limit,
+                    'scanned': checkpoint.scanned, 'last_id': checkpoint.last_id,
+                }))
+            except OSError:
+                await self._replace(worker)
+                raise ConnectionError("Процесс загрузки недоступен")
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), WORKER_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    if not worker.alive():
+                        await self._replace(worker)
+                        raise ConnectionError("Процесс загрузки завершился во время загрузки")
+                    continue
+                kind = message[0]
+                if kind == 'batch':
+                    _, _, scanned, last_id, batch = message
+                    for values in batch:
+                        post = dict(zip(POST_FIELDS, values))
+                        checkpoint.posts.append(post)
+                        if start <= post['datetime'] <= end:
+                            total += 1
+                    checkpoint.scanned = scanned
+                    checkpoint.last_id = last_id
+                    checkpoint.updated_at = time.time()
+                    if progress_callback and total // 20 > reported:
+                        reported = total // 20
+                        await progress_callback(f'Загружено сообщений: {reported * 20}')
+                elif kind == 'done':
+                    outcome = 'ok'
+                    break
+                elif kind == 'flood_waits':
+                    # FloodWait, учтенные процессом (пережитые Telethon и пришедшие исключением)
+                    metrics.FLOOD_WAITS.inc(message[2])
+                    metrics.FLOOD_WAIT_SECONDS.inc(message[3])
+                elif kind == 'error':
+                    raise message[2]
+        except asyncio.CancelledError:
+            outcome = 'cancelled'
+            try:
+                worker.send(('cancel', job_id))
+            except OSError:
+                pass
+            raise
+        finally:
+            self._jobs.pop(job_id, None)
+            worker.jobs -= 1
+            _observe_fetch(outcome, checkpoint.scanned - scanned_before, time.perf_counter() - fetch_started)
+        return in_range(checkpoint.posts)
+
+    def close(self):
+        """Останавливает процессы загрузки"""
+        for worker in self._workers:
+            try:
+                worker.send(None)
+            except OSError:
+                pass
+        for worker in self._workers:
+            try:
+                worker.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                worker.process.kill()
+            worker.connection.close()
+
+
+_pool: Optional[FetchWorkerPool] = None
+
+
+def check_fetch_workers():
+    """
+    Проверяет, что процессы загрузки можно запустить (вызывается до запуска сервера)
+
+    Raises:
+        RuntimeError: FETCH_WORKERS > 0 в собранном PyInstaller приложении
+    """
+    if FETCH_WORKERS > 0 and getattr(sys, 'frozen', False):
+        raise RuntimeError(
+            f"FETCH_WORKERS={FETCH_WORKERS} is not supported in the packaged application: "
+            "fetch workers run as 'python -m core.fetch_workers'; unset FETCH_WORKERS"
+        )
+
+
+def start_fetch_workers():
+    """Запускает процессы загрузки, если FETCH_WORKERS > 0 (обработчик app.on_startup)"""
+    global _pool
+    if FETCH_WORKERS > 0 and _pool is None:
+        check_fetch_workers()
+        _pool = FetchWorkerPool(FETCH_WORKERS)
+
+
+def stop_fetch_workers():
+    """Останавливает процессы загрузки (обработчик app.on_shutdown)"""
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+async def fetch_posts(api_id, api_hash, channel_link, start_date, end_date, limit=1000,
+                      progress_callback=None, checkpoint=None) -> list:
+    """
+    Загружает посты (как fetch_posts_async) в процессе загрузки, если они включены,
+    иначе в текущем процессе. Процессы запускаются при первой загрузке.
+    """
+    if FETCH_WORKERS > 0 and _pool is None:
+        await asyncio.to_thread(start_fetch_workers)
+    if _pool is None:
+        return await fetch_posts_async(
+            api_id, api_hash, channel_link, start_date, end_date, limit=limit,
+            progress_callback=progress_callback, checkpoint=checkpoint
+        )
+    return await _pool.fetch(
+        api_id, api_hash, channel_link, start_date, end_date, limit=limit,
+        progress_callback=progress_callback, checkpoint=checkpoint
+    )
+
+
+# ------------------ Процесс загрузки ------------------
+
+# Сколько FloodWait процесса уже сообщено веб-процессу: (число, секунды)
+_flood_waits_reported = (0, 0.0)
+
+
+def _flood_waits_delta() -> tuple:
+    """FloodWait, учтенные метриками процесса после прошлого сообщения веб-процессу"""
+    global _flood_waits_reported
+    count, seconds = metrics.FLOOD_WAITS.value(), metrics.FLOOD_WAIT_SECONDS.value()
+    delta = (count - _flood_waits_reported[0], seconds - _flood_waits_reported[1])
+    _flood_waits_reported = (count, seconds)
+    return delta
+
+
+async def _run_job(job_id: int, job: dict, send):
+    """Выполняет загрузку и отправляет просмотренные посты пачками"""
+    checkpoint = FetchCheckpoint(job['channel'], job['limit'])
+    checkpoint.scanned = job['scanned']
+    checkpoint.last_id = job['last_id']
+    sent_scanned = checkpoint.scanned
+
+    def flush():
+        nonlocal sent_scanned
+        if checkpoint.scanned == sent_scanned:
+            return
+        # Отправленные посты процессу больше не нужны
+        batch, checkpoint.posts = checkpoint.posts, []
+        sent_scanned = checkpoint.scanned
+        send(('batch', job_id, checkpoint.scanned, checkpoint.last_id,
+              [tuple(post[field] for field in POST_FIELDS) for post in batch]))
+
+    def report_flood_waits():
+        # Метрики процесса загрузки не видны /metrics веб-процесса — счет пересылается
+        count, seconds = _flood_waits_delta()
+        if count:
+            send(('flood_waits', job_id, count, seconds))
+
+    fetch = asyncio.create_task(fetch_posts_async(
+        job['api_id'], job['api_hash'], job['channel'], job['start_date'], job['end_date'],
+        limit=job['limit'], checkpoint=checkpoint
+    ))
+    try:
+        while not fetch.done():
+            await asyncio.wait([fetch], timeout=FETCH_BATCH_INTERVAL)
+            flush()
+            report_flood_waits()
+        fetch.result()
+        send(('done', job_id))
+    except asyncio.CancelledError:
+        fetch.cancel()
+        await asyncio.wait([fetch])
+    except Exception as e:
+        flush()
+        report_flood_waits()
+        send(('error', job_id, _portable_error(e)))
+
+
+async def _serve(connection):
+    loop = asyncio.get_running_loop()
+    incoming = asyncio.Queue()
+    jobs = {}
+
+    def read():
+        while True:
+            try:
+                message = connection.recv()
+            except (EOFError, OSError):
+                message = None
+            loop.call_soon_threadsafe(incoming.put_nowait, message)
+            if message is None:
+                return
+
+    threading.Thread(target=read, daemon=True, name='fetch-requests').start()
+    while True:
+        message = await incoming.get()
+        if message is None:
+            break
+        kind, job_id = message[0], message[1]
+        if kind == 'fetch':
+            task = asyncio.create_task(_run_job(job_id, message[2], connection.send))
+            jobs[job_id] = task
+            task.add_done_callback(lambda _, job_id=job_id: jobs.pop(job_id, None))
+        elif kind == 'cancel' and job_id in jobs:
+            jobs[job_id].cancel()
+    for task in list(jobs.values()):
+        task.cancel()
+    await asyncio.gather(*jobs.values(), return_exceptions=True)
+
+
+def main(argv=None):
+    """Точка входа процесса загрузки: python -m core.fetch_workers <дескриптор сокета>"""
+    args = sys.argv[1:] if argv is None else argv
+    connection = Connection(int(args[0]))
+    metrics.install_flood_wait_counter()
+    try:
+        asyncio.run(_serve(connection))
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
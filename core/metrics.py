@@ -0,0 +1,336 @@
+"""
+Метрики приложения в текстовом формате Prometheus (маршрут /metrics)
+
+Счетчики и гистограммы обновляются на горячем пути одной операцией сложения
+(без блокировок: обновления выполняются в event loop и в потоках вычислений,
+а редкая потеря одного наблюдения для метрик допустима). Значения, которые дешевле
+посчитать при запросе (кеш, сессии, память состояния, задержки event loop),
+собираются только при обращении к /metrics.
+"""
+import os
+import sys
+import bisect
+import logging
+from typing import Callable, Optional
+
+
+METRICS_PATH = '/metrics'
+# Если задан, /metrics требует заголовок Authorization: Bearer <токен>
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '').strip()
+
+# Границы корзин по числу просмотренных сообщений для задержки загрузки
+FETCH_SIZE_BUCKETS = (100, 500, 1000, 1500)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+FETCH_DURATION_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+THROUGHPUT_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    parts = [f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _collected(metric, values: dict, collect: Optional[Callable[[], dict]]) -> dict:
+    """Значения метрики вместе с вычисленными при сборе (collect() -> {метки: значение})"""
+    values = dict(values)
+    if collect is not None:
+        try:
+            values.update(collect())
+        except Exception as e:
+            print(f"Warning: metric {metric.name} collection failed: {e}", file=sys.stderr)
+    return values
+
+
+class Counter:
+    """Монотонный счетчик с метками: увеличивается inc или читается из счетчика приложения при сборе"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), collect: Optional[Callable[[], dict]] = None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        # collect() возвращает {кортеж значений меток: значение}; значения не должны убывать
+        self._collect = collect
+
+    def inc(self, amount: float = 1, *label_values):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        """Текущее значение (без вычисляемых при сборе)"""
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        for label_values, value in sorted(_collected(self, self._values, self._collect).items()):
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Gauge:
+    """Текущее значение: задается явно или вычисляется функцией при сборе"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), collect: Optional[Callable[[], dict]] = None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        # collect() возвращает {кортеж значений меток: значение}
+        self._collect = collect
+
+    def set(self, value: float, *label_values):
+        self._values[label_values] = value
+
+    def samples(self):
+        for label_values, value in sorted(_collected(self, self._values, self._collect).items()):
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и метками"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, buckets: tuple, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # Метки -> [счетчики корзин (последняя — +Inf), сумма]
+        self._series = {}
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self):
+        for label_values, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", _format_labels(self.labels, label_values, f'le="{_format_value(bound)}"'), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labels, label_values), total
+            yield f"{self.name}_count", _format_labels(self.labels, label_values), cumulative
+
+
+class Registry:
+    """Набор метрик и вывод в текстовом формате"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def fetch_size_bucket(messages: int) -> str:
+    """Корзина размера загрузки по числу просмотренных сообщений"""
+    for bound in FETCH_SIZE_BUCKETS:
+        if messages <= bound:
+            return f"le_{bound}"
+    return f"gt_{FETCH_SIZE_BUCKETS[-1]}"
+
+
+# ------------------ Загрузка из Telegram ----------------------
+
+FETCH_DURATION = REGISTRY.register(Histogram(
+    'analtg_fetch_duration_seconds', 'Fetch duration by number of scanned messages',
+    FETCH_DURATION_BUCKETS, ('size',)))
+FETCH_THROUGHPUT = REGISTRY.register(Histogram(
+    'analtg_fetch_messages_per_second', 'Scanned messages per second per fetch', THROUGHPUT_BUCKETS))
+FETCH_MESSAGES = REGISTRY.register(Counter(
+    'analtg_fetch_messages_total', 'Messages scanned from Telegram'))
+FETCHES = REGISTRY.register(Counter(
+    'analtg_fetches_total', 'Fetches from Telegram by outcome', ('outcome',)))
+FETCH_RETRIES = REGISTRY.register(Counter(
+    'analtg_fetch_retries_total', 'Fetches resumed after a transient error, by error type', ('error',)))
+FLOOD_WAITS = REGISTRY.register(Counter(
+    'analtg_flood_waits_total', 'FloodWait responses from Telegram'))
+FLOOD_WAIT_SECONDS = REGISTRY.register(Counter(
+    'analtg_flood_wait_seconds_total', 'Seconds requested by FloodWait responses'))
+
+# ------------------ Вычисления и отображение ----------------------
+
+COMPUTE_DURATION = REGISTRY.register(Histogram(
+    'analtg_compute_duration_seconds', 'Duration of analytics functions run in the compute executor',
+    DURATION_BUCKETS, ('function',)))
+CARD_RENDER_DURATION = REGISTRY.register(Histogram(
+    'analtg_card_render_duration_seconds', 'Time to compute and show a dashboard card',
+    DURATION_BUCKETS, ('card',)))
+LOOP_LAG = REGISTRY.register(Histogram(
+    'analtg_event_loop_lag_seconds', 'Event loop wake-up delay', LAG_BUCKETS))
+
+# ------------------ JSON API ----------------------
+
+API_REQUESTS = REGISTRY.register(Counter(
+    'analtg_api_requests_total', 'JSON API requests by endpoint and outcome', ('endpoint', 'outcome')))
+
+
+def _collect_cache() -> dict:
+    from core.post_cache import CACHE_STATS
+    return {(result,): CACHE_STATS.get(result, 0) for result in ('hit', 'miss', 'partial_reuse', 'extend', 'stale', 'revalidated', 'speculative', 'preempted')}
+
+
+def _collect_sessions() -> dict:
+    from nicegui import Client
+    clients = list(Client.instances.values())
+    return {
+        ('connected',): sum(1 for c in clients if c.has_socket_connection),
+        ('total',): len(clients),
+    }
+
+
+def _collect_fetch_queue() -> dict:
+    from core.admission import FETCH_ADMISSION
+    summary = FETCH_ADMISSION.summary()
+    return {('active',): summary['active'], ('queued',): summary['queued'], ('queued_background',): summary['queued_background']}
+
+
+def _estimate_posts_bytes(posts: list, sample: int = 50) -> int:
+    """Оценка памяти списка постов по выборке (полный обход был бы дорогим)"""
+    if not posts:
+        return sys.getsizeof(posts)
+    step = max(1, len(posts) // sample)
+    picked = posts[::step]
+    per_post = sum(
+        sys.getsizeof(p) + sum(sys.getsizeof(v) for v in p.values()) for p in picked
+    ) / len(picked)
+    return int(sys.getsizeof(posts) + per_post * len(posts))
+
+
+def _collect_state_memory() -> dict:
+    from core.state import STATE
+    return {
+        ('posts',): _estimate_posts_bytes(STATE.posts),
+        ('previous_posts',): _estimate_posts_bytes(STATE.previous_posts),
+    }
+
+
+def _collect_loop_lag() -> dict:
+    from core.compute import LAG_MONITOR
+    return {('last',): LAG_MONITOR.last_lag, ('max',): LAG_MONITOR.max_lag}
+
+
+def _collect_loop_stalls() -> dict:
+    from core.compute import LAG_MONITOR
+    return {(): LAG_MONITOR.stalls_total}
+
+
+REGISTRY.register(Counter(
+    'analtg_post_cache_requests_total', 'Post cache lookups by result', ('result',), collect=_collect_cache))
+REGISTRY.register(Gauge(
+    'analtg_sessions', 'NiceGUI client sessions', ('state',), collect=_collect_sessions))
+REGISTRY.register(Gauge(
+    'analtg_fetch_slots', 'Fetch admission slots and queue', ('state',), collect=_collect_fetch_queue))
+REGISTRY.register(Gauge(
+    'analtg_state_memory_bytes', 'Estimated memory held by the application state', ('field',), collect=_collect_state_memory))
+REGISTRY.register(Gauge(
+    'analtg_event_loop_lag_current_seconds', 'Last and maximum event loop lag', ('stat',), collect=_collect_loop_lag))
+REGISTRY.register(Counter(
+    'analtg_event_loop_stalls_total', 'Event loop stalls above the threshold', collect=_collect_loop_stalls))
+
+
+# Журнал, в который Telethon пишет о пережидаемых FloodWait (уровень INFO)
+FLOOD_WAIT_LOGGER = 'telethon.client.users'
+
+
+class _FloodWaitLogFilter(logging.Filter):
+    """
+    Считает FloodWait, которые Telethon переждал сам (короче flood_sleep_threshold)
+    и о которых сообщил только в журнале. Записи ниже прежнего уровня журнала после
+    подсчета отбрасываются, поэтому включенный для подсчета INFO не попадает в вывод.
+    """
+
+    def __init__(self, passthrough_level: int):
+        super().__init__()
+        self.passthrough_level = passthrough_level
+
+    def filter(self, record) -> bool:
+        try:
+            message = record.getMessage()
+        except Exception:
+            message = ''
+        if 'flood wait' in message.lower():
+            FLOOD_WAITS.inc()
+            # Аргументы записи Telethon: (' early' или '', секунды, timedelta, имя запроса)
+            args = record.args if isinstance(record.args, tuple) else ()
+            seconds = next((a for a in args if isinstance(a, (int, float))), None)
+            if seconds is not None:
+                FLOOD_WAIT_SECONDS.inc(seconds)
+        return record.levelno >= self.passthrough_level
+
+
+_flood_filter_installed = False
+
+
+def install_flood_wait_counter():
+    """
+    Подключает подсчет FloodWait из журнала Telethon (один раз на процесс; процессы
+    загрузки core.fetch_workers подключают его у себя и пересылают счет веб-процессу)
+    """
+    global _flood_filter_installed
+    if _flood_filter_installed:
+        return
+    logger = logging.getLogger(FLOOD_WAIT_LOGGER)
+    level = logger.getEffectiveLevel()
+    logger.addFilter(_FloodWaitLogFilter(level))
+    if level > logging.INFO:
+        logger.setLevel(logging.INFO)
+    _flood_filter_installed = True
+
+
+def record_flood_wait(error: Exception):
+    """Учитывает FloodWait, пришедший исключением"""
+    FLOOD_WAITS.inc()
+    FLOOD_WAIT_SECONDS.inc(float(getattr(error, 'seconds', 0) or 0))
+
+
+# Флаг регистрации маршрута /metrics
+_metrics_route_registered = False
+
+
+def register_metrics_route():
+    """Регистрирует маршрут /metrics (один раз на процесс)"""
+    global _metrics_route_registered
+    if _metrics_route_registered:
+        return
+
+    from nicegui import app
+    from fastapi import Request
+    from fastapi.responses import PlainTextResponse, Response
+
+    @app.get(METRICS_PATH, include_in_schema=False)
+    def metrics(request: Request):
+        if METRICS_TOKEN and request.headers.get('authorization') != f"Bearer {METRICS_TOKEN}":
+            return Response(status_code=401)
+        return PlainTextResponse(REGISTRY.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+    install_flood_wait_counter()
+    _metrics_route_registered = True
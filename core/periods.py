@@ -0,0 +1,221 @@
+"""
+Сравнение нескольких периодов по одному набору постов
+
+Периоды задаются списком определений: 'previous' — предыдущий период той же длины,
+'year_ago' — тот же период год назад, 'weeks:N' — последние N недель (каждая
+сравнивается с предыдущей). Посты всех периодов загружаются одним запросом
+на охватывающий диапазон (запроса нет, если уже загруженные посты покрывают все периоды),
+а метрики всех периодов считаются за один проход по постам.
+"""
+import datetime
+from typing import Optional
+
+from core.analytics import calculate_er, calculate_previous_period
+from core.post_cache import POST_CACHE_TTL, fetch_posts_cached
+
+
+PERIOD_SPECS = {
+    'previous': 'Предыдущий период',
+    'year_ago': 'Тот же период год назад',
+    'weeks:4': 'Последние 4 недели',
+}
+METRIC_KEYS = ('posts', 'views', 'likes', 'comments', 'reposts', 'avg_er')
+MAX_WEEKS = 26
+
+
+class Period:
+    """Период сравнения; base — ключ периода, с которым считаются дельты"""
+
+    def __init__(self, key: str, label: str, start_date: str, end_date: str, base: Optional[str] = None):
+        self.key = key
+        self.label = label
+        self.start_date = start_date
+        self.end_date = end_date
+        self.base = base
+
+
+def _date(value: str) -> datetime.date:
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def _moment(value: str) -> datetime.datetime:
+    return datetime.datetime.strptime(value, "%Y-%m-%d")
+
+
+def _str(value: datetime.date) -> str:
+    return value.strftime("%Y-%m-%d")
+
+
+def _year_ago(value: datetime.date) -> datetime.date:
+    try:
+        return value.replace(year=value.year - 1)
+    except ValueError:
+        # 29 февраля -> 28 февраля
+        return value.replace(year=value.year - 1, day=28)
+
+
+def resolve_periods(start_date: str, end_date: str, specs: list) -> list:
+    """
+    Превращает определения периодов в список Period (текущий период первым).
+
+    Raises:
+        ValueError: Неизвестное определение периода
+    """
+    start, end = _date(start_date), _date(end_date)
+    periods = {'current': Period('current', 'Текущий период', start_date, end_date)}
+    for spec in specs:
+        if spec == 'previous':
+            prev_start, prev_end = calculate_previous_period(start_date, end_date)
+            periods['previous'] = Period('previous', PERIOD_SPECS['previous'], prev_start, prev_end, 'current')
+        elif spec == 'year_ago':
+            periods['year_ago'] = Period(
+                'year_ago', PERIOD_SPECS['year_ago'], _str(_year_ago(start)), _str(_year_ago(end)), 'current'
+            )
+        elif spec.startswith('weeks:'):
+            try:
+                weeks = int(spec.split(':', 1)[1])
+            except ValueError:
+                raise ValueError(f"Неизвестный период: {spec}")
+            weeks = max(1, min(weeks, MAX_WEEKS))
+            for k in range(weeks):
+                week_end = end - datetime.timedelta(days=7 * k)
+                week_start = week_end - datetime.timedelta(days=6)
+                periods[f'week-{k}'] = Period(
+                    f'week-{k}', f"Неделя {week_start:%d.%m}–{week_end:%d.%m}", _str(week_start), _str(week_end),
+                    f'week-{k + 1}' if k + 1 < weeks else None
+                )
+        else:
+            raise ValueError(f"Неизвестный период: {spec}")
+    return list(periods.values())
+
+
+def merge_ranges(ranges: list) -> list:
+    """Объединяет пересекающиеся и соседние диапазоны дат [(start, end), ...]"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and _date(start) <= _date(merged[-1][1]) + datetime.timedelta(days=1):
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_ranges(ranges: list, covered: list) -> list:
+    """Части диапазонов ranges, не покрытые диапазонами covered"""
+    missing = []
+    covered = merge_ranges(covered)
+    for start, end in merge_ranges(ranges):
+        cursor = _date(start)
+        stop = _date(end)
+        for c_start, c_end in covered:
+            c_start, c_end = _date(c_start), _date(c_end)
+            if c_end < cursor or c_start > stop:
+                continue
+            if c_start > cursor:
+                missing.append((_str(cursor), _str(c_start - datetime.timedelta(days=1))))
+            cursor = max(cursor, c_end + datetime.timedelta(days=1))
+            if cursor > stop:
+                break
+        if cursor <= stop:
+            missing.append((_str(cursor), _str(stop)))
+    return missing
+
+
+async def fetch_periods(
+    api_id,
+    api_hash,
+    channel: str,
+    periods: list,
+    known_posts: Optional[list] = None,
+    known_ranges: Optional[list] = None,
+    limit: int = 1500,
+    max_age: float = POST_CACHE_TTL,
+    client_key=None
+) -> list:
+    """
+    Посты для всех периодов: уже загруженные (known_posts за диапазоны known_ranges),
+    если они покрывают все периоды, иначе одна загрузка охватывающего диапазона.
+
+    Returns:
+        list: Посты без повторов (по id)
+    """
+    known_posts = known_posts or []
+    ranges = merge_ranges([(p.start_date, p.end_date) for p in periods])
+    if not subtract_ranges(ranges, known_ranges or []):
+        return list(known_posts)
+    # Число просматриваемых сообщений не зависит от дат, поэтому загружается весь
+    # охватывающий диапазон: окно кеша постов канала остается надмножеством текущего периода
+    fetched = await fetch_posts_cached(
+        api_id, api_hash, channel, ranges[0][0], max(end for _, end in ranges), limit=limit,
+        max_age=max_age, client_key=client_key
+    )
+    seen = {p['id'] for p in known_posts}
+    return list(known_posts) + [p for p in fetched if p['id'] not in seen]
+
+
+def _deltas(current: dict, base: dict) -> dict:
+    """Дельты как в compare_periods"""
+    deltas = {}
+    for metric in METRIC_KEYS:
+        delta = current[metric] - base[metric]
+        deltas[metric] = {
+            'absolute': delta,
+            'percent': (delta / base[metric]) * 100 if base[metric] != 0 else None,
+        }
+    return deltas
+
+
+def compare_many(posts: list, periods: list) -> list:
+    """
+    Метрики всех периодов за один проход по постам и дельты к базовым периодам.
+    Посты отбираются по тем же границам, что и при загрузке (posts_in_range), поэтому
+    результат не зависит от того, какой загрузкой получен пост; метрики совпадают
+    с calculate_metrics для постов периода.
+
+    Returns:
+        list: [{'key', 'label', 'start_date', 'end_date', 'base', 'metrics', 'deltas'}]
+            в порядке periods; deltas — None у периодов без базы
+    """
+    bounds = [(_moment(p.start_date), _moment(p.end_date)) for p in periods]
+    totals = [[0, 0, 0, 0, 0, 0.0, 0] for _ in periods]
+    for post in posts:
+        moment = post['datetime']
+        views = post.get('views', 0)
+        likes = post.get('likes', 0)
+        comments = post.get('comments', 0)
+        reposts = post.get('reposts', 0)
+        er = calculate_er(likes, comments, reposts, views) if views > 0 else None
+        for (start, end), acc in zip(bounds, totals):
+            if start <= moment <= end:
+                acc[0] += 1
+                acc[1] += views
+                acc[2] += likes
+                acc[3] += comments
+                acc[4] += reposts
+                if er is not None:
+                    acc[5] += er
+                    acc[6] += 1
+
+    metrics = {}
+    for period, acc in zip(periods, totals):
+        metrics[period.key] = {
+            'posts': acc[0],
+            'views': acc[1],
+            'likes': acc[2],
+            'comments': acc[3],
+            'reposts': acc[4],
+            'avg_er': acc[5] / acc[6] if acc[6] else 0.0,
+        }
+    return [
+        {
+            'key': period.key,
+            'label': period.label,
+            'start_date': period.start_date,
+            'end_date': period.end_date,
+            'base': period.base,
+            'metrics': metrics[period.key],
+            'deltas': _deltas(metrics[period.key], metrics[period.base]) if period.base in metrics else None,
+        }
+        for period in periods
+    ]
@@ -0,0 +1,135 @@
+"""
+Сравнение нескольких каналов за один период (портфель)
+
+Каналы загружаются одновременно (не больше PORTFOLIO_CONCURRENCY загрузок на
+сравнение, общий предел — очередь core.admission), затем метрики и сетки времени
+публикаций всех каналов считаются одним проходом pandas по общей таблице постов.
+"""
+import os
+import re
+import asyncio
+from typing import Callable, Optional
+
+from core.post_cache import POST_CACHE_TTL, fetch_posts_cached
+from core.services import extract_channel_username
+
+
+PORTFOLIO_MAX_CHANNELS = int(os.getenv('PORTFOLIO_MAX_CHANNELS', '10'))
+PORTFOLIO_CONCURRENCY = int(os.getenv('PORTFOLIO_CONCURRENCY', '3'))
+# Число сообщений, просматриваемых в канале (как при обычной загрузке)
+PORTFOLIO_FETCH_LIMIT = 1500
+# Ширина столбца сетки времени публикаций в часах
+GRID_HOURS = 3
+GRID_BLOCKS = 24 // GRID_HOURS
+
+SUMMARY_FIELDS = ('posts', 'views', 'avg_views', 'likes', 'comments', 'reposts', 'avg_er')
+
+
+def parse_channels(text: str) -> list:
+    """Каналы из текста (через перевод строки, запятую или пробел) без повторов"""
+    channels = {}
+    for item in re.split(r'[\s,;]+', text or ''):
+        if item:
+            channels.setdefault(extract_channel_username(item).lower(), item)
+    return list(channels.values())
+
+
+async def fetch_portfolio(
+    api_id,
+    api_hash,
+    channels: list,
+    start_date: str,
+    end_date: str,
+    concurrency: int = PORTFOLIO_CONCURRENCY,
+    max_age: float = POST_CACHE_TTL,
+    client_key=None,
+    on_progress: Optional[Callable] = None
+) -> tuple[dict, dict]:
+    """
+    Загружает посты периода для всех каналов одновременно.
+
+    Args:
+        on_progress: Вызывается с (готово, всего) после каждого канала
+
+    Returns:
+        tuple: (канал -> посты, канал -> текст ошибки) в порядке channels
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    done = 0
+
+    async def load(channel):
+        nonlocal done
+        async with semaphore:
+            try:
+                return await fetch_posts_cached(
+                    api_id, api_hash, channel, start_date, end_date, limit=PORTFOLIO_FETCH_LIMIT,
+                    max_age=max_age, client_key=client_key
+                )
+            except Exception as e:
+                return e
+            finally:
+                done += 1
+                if on_progress:
+                    on_progress(done, len(channels))
+
+    results = await asyncio.gather(*(load(channel) for channel in channels))
+    posts_by_channel, errors = {}, {}
+    for channel, result in zip(channels, results):
+        if isinstance(result, Exception):
+            errors[channel] = str(result)
+        else:
+            posts_by_channel[channel] = result
+    return posts_by_channel, errors
+
+
+def portfolio_stats(posts_by_channel: dict) -> dict:
+    """
+    Метрики и сетки времени публикаций всех каналов одним проходом pandas.
+
+    Средний ER — как в calculate_metrics (среднее ER постов с просмотрами).
+    Сетка: день недели (0 — понедельник) x блок часов по GRID_HOURS.
+
+    Returns:
+        dict: {'summary': {канал: {поле SUMMARY_FIELDS: значение}},
+               'grids': {канал: {(день, блок): {'posts', 'avg_views', 'avg_er'}}}}
+    """
+    import pandas as pd
+    channels = list(posts_by_channel)
+    summary = {channel: dict.fromkeys(SUMMARY_FIELDS, 0) for channel in channels}
+    grids = {channel: {} for channel in channels}
+    df = pd.DataFrame(
+        [
+            (channel, p['datetime'], p.get('views', 0), p.get('likes', 0), p.get('comments', 0), p.get('reposts', 0))
+            for channel, posts in posts_by_channel.items() for p in posts
+        ],
+        columns=['channel', 'datetime', 'views', 'likes', 'comments', 'reposts'],
+    )
+    if df.empty:
+        return {'summary': summary, 'grids': grids}
+
+    engagement = df['likes'] + df['comments'] + df['reposts']
+    df['er'] = (engagement / df['views'] * 100).where(df['views'] > 0)
+    moments = pd.to_datetime(df['datetime'])
+    df['day'] = moments.dt.weekday
+    df['block'] = moments.dt.hour // GRID_HOURS
+
+    totals = df.groupby('channel', sort=False).agg(
+        posts=('views', 'size'), views=('views', 'sum'), likes=('likes', 'sum'),
+        comments=('comments', 'sum'), reposts=('reposts', 'sum'), avg_er=('er', 'mean'),
+    )
+    totals['avg_views'] = totals['views'] / totals['posts']
+    totals['avg_er'] = totals['avg_er'].fillna(0.0)
+    for channel, row in totals.to_dict('index').items():
+        summary[channel] = {
+            field: float(row[field]) if field.startswith('avg_') else int(row[field]) for field in SUMMARY_FIELDS
+        }
+
+    cells = df.groupby(['channel', 'day', 'block'], sort=False).agg(
+        posts=('views', 'size'), avg_views=('views', 'mean'), avg_er=('er', 'mean'),
+    )
+    cells['avg_er'] = cells['avg_er'].fillna(0.0)
+    for (channel, day, block), row in cells.to_dict('index').items():
+        grids[channel][(int(day), int(block))] = {
+            'posts': int(row['posts']), 'avg_views': float(row['avg_views']), 'avg_er': float(row['avg_er']),
+        }
+    return {'summary': summary, 'grids': grids}
@@ -0,0 +1,457 @@
+"""
+Кеш загруженных постов на диске
+
+Для каждого канала хранятся все сообщения, просмотренные последней загрузкой
+(cache/posts/<канал>.pkl), и интервал дат, который они покрывают. Просмотр
+не зависит от периода (см. FetchCheckpoint), поэтому любой период внутри
+интервала отвечается фильтрацией постов без обращения к Telegram: fetch_posts_async
+отбирает посты по тем же границам, и результат совпадает. Если просмотр дошел
+до последнего сообщения канала, а период заканчивается позже интервала,
+загружаются только сообщения после последнего просмотренного.
+"""
+import os
+import re
+import sys
+import time
+import pickle
+import asyncio
+import datetime
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from core import metrics
+from core.services import FetchCheckpoint, extract_channel_username, refresh_posts
+from core.fetch_workers import fetch_posts
+from core.rate_limit import TELEGRAM_BUDGET
+from core.admission import FETCH_ADMISSION, FetchPreempted
+from core.tracing import span
+
+
+CACHE_DIR = Path(os.getenv('POST_CACHE_DIR', str(Path(__file__).parent.parent / 'cache' / 'posts')))
+# Сколько секунд закешированные посты считаются свежими для запросов пользователей
+POST_CACHE_TTL = float(os.getenv('POST_CACHE_TTL', '900'))
+# До какого возраста устаревшие посты показываются сразу, пока в фоне загружаются свежие (секунды)
+POST_CACHE_STALE_TTL = float(os.getenv('POST_CACHE_STALE_TTL', '86400'))
+# Сколько записей держать в памяти (остальные читаются с диска)
+POST_CACHE_MEMORY_ITEMS = 16
+
+# Сколько секунд хранить прогресс прерванной загрузки для продолжения (секунды)
+FETCH_PARTIAL_TTL = float(os.getenv('FETCH_PARTIAL_TTL', '600'))
+
+# Сколько раз подряд повторять загрузку после обрыва связи или FloodWait, если она не продвинулась
+FETCH_RETRIES = int(os.getenv('FETCH_RETRIES', '3'))
+# Пауза перед первым повтором (секунды), дальше она удваивается
+FETCH_RETRY_DELAY = float(os.getenv('FETCH_RETRY_DELAY', '1'))
+# Более долгий FloodWait не пережидается: ошибка возвращается, прогресс остается для повтора (секунды)
+FETCH_RETRY_MAX_WAIT = float(os.getenv('FETCH_RETRY_MAX_WAIT', '120'))
+
+# Границы интервала, не ограниченного с этой стороны
+FIRST_DATE = '0001-01-01'
+LAST_DATE = '9999-12-31'
+
+# Счетчики попаданий и промахов
+CACHE_STATS = Counter()
+
+_memory = OrderedDict()
+# Прогресс прерванных загрузок: (канал, limit) -> FetchCheckpoint
+_partials = {}
+# Фоновые обновления записей: (канал, limit) -> asyncio.Task
+_revalidations = {}
+
+
+def _channel_key(channel: str) -> str:
+    username = extract_channel_username(channel.strip()).lower()
+    return re.sub(r'[^0-9a-z_+-]', '_', username) or '_'
+
+
+def _cache_path(channel: str) -> Path:
+    return CACHE_DIR / f"{_channel_key(channel)}.pkl"
+
+
+def _read_entry(path: Path) -> Optional[dict]:
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Warning: post cache entry {path.name} ignored: {e}", file=sys.stderr)
+        return None
+
+
+def _write_entry(path: Path, entry: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'wb') as f:
+        pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp.replace(path)
+
+
+def _remember(key: str, entry: dict):
+    _memory[key] = entry
+    _memory.move_to_end(key)
+    while len(_memory) > POST_CACHE_MEMORY_ITEMS:
+        _memory.popitem(last=False)
+
+
+async def load_entry(channel: str) -> Optional[dict]:
+    """
+    Возвращает запись кеша канала: {'channel', 'start_date', 'end_date', 'limit', 'fetched_at', 'posts',
+    'scanned', 'last_id'}; start_date и end_date — покрытый интервал, scanned и last_id — None,
+    если запись сохранена не из просмотра (продолжить его нельзя)
+    """
+    key = _channel_key(channel)
+    entry = _memory.get(key)
+    if entry is not None:
+        _memory.move_to_end(key)
+        return entry
+    entry = await asyncio.to_thread(_read_entry, _cache_path(channel))
+    if entry is not None:
+        _remember(key, entry)
+    return entry
+
+
+async def store_entry(
+    channel: str,
+    start_date: str,
+    end_date: str,
+    limit: int,
+    posts: list,
+    scanned: Optional[int] = None,
+    last_id: Optional[int] = None,
+    fetched_at: Optional[float] = None
+) -> dict:
+    """Сохраняет посты канала, покрывающие интервал [start_date, end_date]"""
+    entry = {
+        'channel': _channel_key(channel),
+        'start_date': start_date,
+        'end_date': end_date,
+        'limit': limit,
+        'fetched_at': fetched_at or time.time(),
+        'posts': posts,
+        'scanned': scanned,
+        'last_id': last_id,
+    }
+    _remember(entry['channel'], entry)
+    try:
+        await asyncio.to_thread(_write_entry, _cache_path(channel), entry)
+    except Exception as e:
+        print(f"Warning: failed to write post cache for {channel}: {e}", file=sys.stderr)
+    return entry
+
+
+def scan_coverage(checkpoint: FetchCheckpoint) -> tuple[str, str]:
+    """
+    Интервал дат, для которых просмотренные сообщения дают тот же результат, что новая загрузка.
+
+    Просмотр идет от самых старых сообщений, поэтому начало не ограничено. Если просмотрено
+    limit сообщений, новая загрузка просмотрит те же сообщения для любого периода; иначе
+    просмотр дошел до последнего сообщения канала и покрывает даты до сегодняшней (UTC,
+    как даты сообщений).
+    """
+    if checkpoint.scanned >= checkpoint.limit:
+        return FIRST_DATE, LAST_DATE
+    return FIRST_DATE, datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+async def store_scan(channel: str, checkpoint: FetchCheckpoint, fetched_at: Optional[float] = None) -> dict:
+    """Сохраняет все просмотренные загрузкой сообщения канала"""
+    start_date, end_date = scan_coverage(checkpoint)
+    return await store_entry(
+        channel, start_date, end_date, checkpoint.limit, [dict(p) for p in checkpoint.posts],
+        scanned=checkpoint.scanned, last_id=checkpoint.last_id, fetched_at=fetched_at
+    )
+
+
+def _entry_checkpoint(channel: str, entry: Optional[dict], limit: int) -> Optional[FetchCheckpoint]:
+    """Прогресс просмотра, сохраненного в записи кеша (None — запись не из просмотра)"""
+    if entry is None or entry.get('limit') != limit or entry.get('last_id') is None:
+        return None
+    checkpoint = FetchCheckpoint(channel, limit)
+    checkpoint.scanned = entry['scanned']
+    checkpoint.last_id = entry['last_id']
+    checkpoint.posts = [dict(p) for p in entry['posts']]
+    return checkpoint
+
+
+def resume_scan(channel: str, entry: Optional[dict], limit: int) -> Optional[FetchCheckpoint]:
+    """Прогресс, продолжающий просмотр записи кеша после ее последнего сообщения (None — нельзя)"""
+    if entry is None or entry.get('scanned') is None or entry['scanned'] >= limit:
+        return None
+    return _entry_checkpoint(channel, entry, limit)
+
+
+def take_partial(channel: str, limit: int) -> Optional[FetchCheckpoint]:
+    """Забирает сохраненный прогресс прерванной загрузки канала (если он не устарел)"""
+    now = time.time()
+    for key in [k for k, cp in _partials.items() if now - cp.updated_at > FETCH_PARTIAL_TTL]:
+        del _partials[key]
+    return _partials.pop((_channel_key(channel), limit), None)
+
+
+def keep_partial(channel: str, checkpoint: FetchCheckpoint):
+    """Сохраняет прогресс прерванной загрузки для следующего запроса (если он не меньше сохраненного)"""
+    key = (_channel_key(channel), checkpoint.limit)
+    kept = _partials.get(key)
+    if checkpoint.scanned and (kept is None or kept.scanned <= checkpoint.scanned):
+        _partials[key] = checkpoint
+
+
+def partial_progress(channel: str, limit: int) -> int:
+    """Сколько сообщений просмотрено прерванной загрузкой канала, которую продолжит повтор"""
+    checkpoint = _partials.get((_channel_key(channel), limit))
+    if checkpoint is None or time.time() - checkpoint.updated_at > FETCH_PARTIAL_TTL:
+        return 0
+    return checkpoint.scanned
+
+
+def retry_delay(error: Exception, failures: int) -> Optional[float]:
+    """Через сколько секунд повторить загрузку после ошибки (None — ошибка не временная)"""
+    from telethon.errors import FloodWaitError, ServerError
+    if isinstance(error, FloodWaitError):
+        return float(error.seconds) if error.seconds <= FETCH_RETRY_MAX_WAIT else None
+    # Обрыв соединения Telethon, таймаут, упавший процесс загрузки, сбой на стороне Telegram
+    if isinstance(error, (ConnectionError, TimeoutError, ServerError)):
+        return FETCH_RETRY_DELAY * 2 ** (failures - 1)
+    return None
+
+
+async def fetch_with_retries(api_id, api_hash, channel_link, start_date, end_date, checkpoint: FetchCheckpoint,
+                             progress_callback=None, background: bool = False) -> list:
+    """
+    Загружает посты (fetch_posts) с повторами после временных ошибок. Каждый повтор
+    продолжает просмотр с checkpoint, поэтому уже просмотренные сообщения не читаются
+    заново; счет неудач сбрасывается, если загрузка продвинулась. Фоновая загрузка
+    (background) ждет токенов своей доли бюджета запросов, загрузка пользователя не ждет.
+    """
+    failures = 0
+    while True:
+        scanned = checkpoint.scanned
+        if background:
+            await TELEGRAM_BUDGET.acquire_background()
+        else:
+            TELEGRAM_BUDGET.spend_foreground()
+        try:
+            return await fetch_posts(
+                api_id, api_hash, channel_link, start_date, end_date, limit=checkpoint.limit,
+                progress_callback=progress_callback, checkpoint=checkpoint
+            )
+        except Exception as e:
+            failures = 1 if checkpoint.scanned > scanned else failures + 1
+            delay = retry_delay(e, failures)
+            if delay is None or failures > FETCH_RETRIES:
+                raise
+            metrics.FETCH_RETRIES.inc(1, type(e).__name__)
+            print(f"Warning: fetch of {channel_link} interrupted after {checkpoint.scanned} messages, "
+                  f"retry in {delay:.0f} s: {e}", file=sys.stderr)
+            if progress_callback:
+                reason = "Telegram просит подождать" if hasattr(e, 'seconds') else "Загрузка прервалась"
+                await progress_callback(
+                    f"⚠ {reason}, продолжение через {delay:.0f} с (просмотрено сообщений: {checkpoint.scanned})"
+                )
+            with span('fetch_retry', attempt=failures, error=type(e).__name__, delay=delay):
+                await asyncio.sleep(delay)
+
+
+def covers(entry: Optional[dict], start_date: str, end_date: str, limit: int) -> bool:
+    """Проверяет, что запись кеша содержит период [start_date, end_date]"""
+    return (
+        entry is not None
+        and entry.get('limit') == limit
+        and entry['start_date'] <= start_date
+        and end_date <= entry['end_date']
+    )
+
+
+def posts_in_range(posts: list, start_date: str, end_date: str) -> list:
+    """Отбирает посты по тем же границам, что и fetch_posts_async"""
+    start = datetime.datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.datetime.strptime(end_date, "%Y-%m-%d")
+    return [p for p in posts if start <= p['datetime'] <= end]
+
+
+async def fetch_posts_cached(
+    api_id,
+    api_hash,
+    channel_link,
+    start_date,
+    end_date,
+    limit=1000,
+    progress_callback=None,
+    max_age: float = POST_CACHE_TTL,
+    client_key=None,
+    queue_callback=None,
+    background: bool = False
+):
+    """
+    Загружает посты периода из кеша, если он свежий и содержит период,
+    иначе из Telegram (просмотренные сообщения сохраняются в кеш). Если свежая
+    запись заканчивается раньше периода, загружаются только более новые сообщения.
+
+    Args:
+        api_id, api_hash, channel_link, start_date, end_date, limit, progress_callback:
+            как у fetch_posts_async
+        max_age: Максимальный возраст записи кеша в секундах (0 — не использовать кеш)
+        client_key: Идентификатор клиента для очереди загрузок (core.admission)
+        queue_callback: Вызывается с (позиция, оценка ожидания), пока загрузка в очереди
+        background: Загрузка уступает очередь и слот загрузкам пользователей
+            и расходует фоновую долю бюджета запросов
+
+    Returns:
+        list: Список постов
+
+    Raises:
+        FetchPreempted: Фоновая загрузка уступила слот (прогресс сохранен для продолжения)
+    """
+    with span('cache_lookup') as lookup:
+        entry = await load_entry(channel_link)
+        fresh = entry is not None and time.time() - entry['fetched_at'] <= max_age
+        lookup['hit'] = fresh and covers(entry, start_date, end_date, limit)
+        if lookup['hit']:
+            CACHE_STATS['hit'] += 1
+            # Посты копируются: UI дописывает в них вычисленные поля
+            return [dict(p) for p in posts_in_range(entry['posts'], start_date, end_date)]
+
+    CACHE_STATS['miss'] += 1
+    # Прерванная ранее загрузка канала (отмена, закрытая вкладка, ошибка) продолжается
+    checkpoint = take_partial(channel_link, limit)
+    # Свежая запись продолжается: просматриваются только сообщения после нее,
+    # а возраст данных остается возрастом записи
+    fetched_at = None
+    if checkpoint is None and fresh:
+        checkpoint = resume_scan(channel_link, entry, limit)
+        if checkpoint is not None:
+            CACHE_STATS['extend'] += 1
+            fetched_at = entry['fetched_at']
+    checkpoint = checkpoint or FetchCheckpoint(channel_link, limit)
+    if checkpoint.scanned and fetched_at is None:
+        CACHE_STATS['partial_reuse'] += 1
+    try:
+        async with FETCH_ADMISSION.slot(client_key, queue_callback, background=background):
+            with span('telegram_fetch', resumed=checkpoint.scanned):
+                posts = await fetch_with_retries(
+                    api_id, api_hash, channel_link, start_date, end_date, checkpoint,
+                    progress_callback=progress_callback, background=background
+                )
+    except BaseException:
+        # Повтор запроса (пользователем или следующим вызовом) продолжит просмотр отсюда
+        keep_partial(channel_link, checkpoint)
+        raise
+    # Просмотр покрывает все даты, которые покрывала прежняя запись того же limit
+    await store_scan(channel_link, checkpoint, fetched_at=fetched_at)
+    return posts
+
+
+async def speculate_posts(api_id, api_hash, channel_link, start_date, end_date, limit=1000, client_key=None) -> bool:
+    """
+    Предзагружает в кеш период, который, вероятно, будет запрошен следующим.
+    Загрузка уступает очередь и слот загрузкам пользователей; при отмене или
+    вытеснении просмотренные сообщения сохраняются, и запрос пользователя
+    продолжает просмотр с них.
+
+    Returns:
+        bool: Загружен ли период (False — он уже в свежем кеше или загрузка вытеснена)
+    """
+    entry = await load_entry(channel_link)
+    if covers(entry, start_date, end_date, limit) and time.time() - entry['fetched_at'] <= POST_CACHE_TTL:
+        return False
+    CACHE_STATS['speculative'] += 1
+    with span('speculative_fetch', start_date=start_date, end_date=end_date):
+        try:
+            await fetch_posts_cached(
+                api_id, api_hash, channel_link, start_date, end_date, limit=limit, client_key=client_key, background=True
+            )
+        except FetchPreempted:
+            CACHE_STATS['preempted'] += 1
+            return False
+    return True
+
+
+async def fetch_posts_swr(
+    api_id,
+    api_hash,
+    channel_link,
+    start_date,
+    end_date,
+    limit=1000,
+    stale_age: float = POST_CACHE_STALE_TTL,
+    **kwargs
+) -> tuple[list, bool]:
+    """
+    Как fetch_posts_cached, но устаревшая (старше POST_CACHE_TTL, не старше stale_age)
+    запись, содержащая период, возвращается сразу; обновить ее можно через revalidate.
+
+    Args:
+        kwargs: остальные аргументы fetch_posts_cached
+
+    Returns:
+        tuple: (посты, устарели ли они)
+    """
+    entry = await load_entry(channel_link)
+    if covers(entry, start_date, end_date, limit) and POST_CACHE_TTL < time.time() - entry['fetched_at'] <= stale_age:
+        CACHE_STATS['stale'] += 1
+        return [dict(p) for p in posts_in_range(entry['posts'], start_date, end_date)], True
+    return await fetch_posts_cached(api_id, api_hash, channel_link, start_date, end_date, limit=limit, **kwargs), False
+
+
+async def _in_background_slot(client_key, fetch):
+    """
+    Выполняет fetch() в фоновом слоте загрузки. Вытесненная пользователем загрузка
+    снова встает в очередь за ним; fetch должен продолжать работу с сохраненного места.
+    """
+    while True:
+        try:
+            async with FETCH_ADMISSION.slot(client_key, background=True):
+                return await fetch()
+        except FetchPreempted:
+            CACHE_STATS['preempted'] += 1
+
+
+async def _revalidate(api_id, api_hash, channel_link, limit, client_key) -> dict:
+    # Просмотр записи продолжается: из истории читаются только сообщения после last_id,
+    # а уже просмотренные посты перечитываются по id; запись не из просмотра читается заново
+    checkpoint = _entry_checkpoint(channel_link, await load_entry(channel_link), limit)
+    cached = len(checkpoint.posts) if checkpoint is not None else 0
+    checkpoint = checkpoint or FetchCheckpoint(channel_link, limit)
+    with span('revalidate', resumed=checkpoint.scanned, cached=cached):
+        # Слот уступается ожидающим пользователям: устаревшие данные уже показаны.
+        # Вытесненный просмотр продолжается с checkpoint
+        if checkpoint.scanned < limit:
+            await _in_background_slot(client_key, lambda: fetch_with_retries(
+                api_id, api_hash, channel_link, FIRST_DATE, LAST_DATE, checkpoint, background=True
+            ))
+        if cached:
+            # Токен ждется до слота, чтобы не занимать слот ожиданием
+            await TELEGRAM_BUDGET.acquire_background()
+            checkpoint.posts[:cached] = await _in_background_slot(client_key, lambda: refresh_posts(
+                api_id, api_hash, channel_link, checkpoint.posts[:cached]
+            ))
+    CACHE_STATS['revalidated'] += 1
+    return await store_scan(channel_link, checkpoint)
+
+
+async def revalidate(api_id, api_hash, channel_link, limit=1000, client_key=None) -> dict:
+    """
+    Обновляет запись кеша канала: загружает сообщения после последнего просмотренного
+    и перечитывает по id уже закешированные посты (их счетчики меняются). Запросы
+    расходуют фоновую долю бюджета; одновременные запросы одного канала ждут одно
+    обновление, которое не прерывается, если ожидающий запрос отменен.
+
+    Returns:
+        dict: Новая запись кеша
+    """
+    key = (_channel_key(channel_link), limit)
+    task = _revalidations.get(key)
+    if task is None or task.done():
+        task = asyncio.create_task(_revalidate(api_id, api_hash, channel_link, limit, client_key))
+        _revalidations[key] = task
+
+        def forget(done):
+            if _revalidations.get(key) is done:
+                del _revalidations[key]
+            if not done.cancelled() and done.exception() is not None:
+                print(f"Warning: revalidation of {channel_link} failed: {done.exception()}", file=sys.stderr)
+
+        task.add_done_callback(forget)
+    return await asyncio.shield(task)
@@ -0,0 +1,173 @@
+"""
+Фоновая предзагрузка популярных каналов в кеш постов
+
+Планировщик работает в event loop приложения: периодически (со случайным сдвигом)
+выбирает самые запрашиваемые каналы по логу запросов (core.usage_analytics)
+и загружает для них окно последних дней в кеш (core.post_cache), если запись
+кеша устарела: устаревшая запись обновляется post_cache.revalidate, остальные
+загружаются фоновой загрузкой post_cache.fetch_posts_cached. Фоновые загрузки
+расходуют только свою долю бюджета запросов к Telegram (core.rate_limit), а после
+ошибок канал откладывается с растущей паузой.
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import datetime
+from typing import Optional
+
+from core import post_cache
+from core.admission import FetchPreempted
+from core.usage_analytics import get_usage_index
+
+
+# Предзагрузка идет от аккаунта, который обслуживает пользователей, поэтому включается явно
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', '0').strip().lower() not in ('0', 'false', 'no', '')
+# Период планировщика и случайный сдвиг (секунды)
+PREFETCH_INTERVAL = float(os.getenv('PREFETCH_INTERVAL', '600'))
+PREFETCH_JITTER = float(os.getenv('PREFETCH_JITTER', '0.2'))
+PREFETCH_TOP_CHANNELS = int(os.getenv('PREFETCH_TOP_CHANNELS', '5'))
+PREFETCH_LOOKBACK_DAYS = int(os.getenv('PREFETCH_LOOKBACK_DAYS', '7'))
+# Окно предзагрузки: период по умолчанию в UI (год) и предыдущий период для сравнения
+PREFETCH_WINDOW_DAYS = int(os.getenv('PREFETCH_WINDOW_DAYS', '730'))
+# Запись кеша моложе этого возраста не перезагружается (секунды)
+PREFETCH_REFRESH_AGE = float(os.getenv('PREFETCH_REFRESH_AGE', str(post_cache.POST_CACHE_TTL * 0.8)))
+PREFETCH_LIMIT = 1500
+# Пауза после ошибки: BASE * 2^(n-1), не больше MAX (секунды)
+PREFETCH_BACKOFF_BASE = 60.0
+PREFETCH_BACKOFF_MAX = 6 * 3600.0
+
+
+def _jittered(seconds: float, jitter: float = PREFETCH_JITTER) -> float:
+    return seconds * random.uniform(1 - jitter, 1 + jitter)
+
+
+class PrefetchScheduler:
+    """Планировщик предзагрузки популярных каналов"""
+
+    def __init__(self, api_id, api_hash):
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self._task = None
+        # Канал -> (число ошибок подряд, время, до которого канал отложен)
+        self._backoff = {}
+        self.last_run: Optional[float] = None
+        self.prefetched = 0
+        self.errors = 0
+
+    def start(self):
+        """Запускает планировщик в текущем event loop"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    def stop(self):
+        """Останавливает планировщик"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self):
+        # Первый проход — после небольшой паузы, чтобы не конкурировать с запуском
+        await asyncio.sleep(_jittered(30.0))
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Warning: prefetch pass failed: {e}", file=sys.stderr)
+            await asyncio.sleep(_jittered(PREFETCH_INTERVAL))
+
+    def window(self) -> tuple[str, str]:
+        """Окно дат предзагрузки (до сегодняшнего дня включительно)"""
+        today = datetime.date.today()
+        start = today - datetime.timedelta(days=PREFETCH_WINDOW_DAYS)
+        return start.strftime('%Y-%m-%d'), today.strftime('%Y-%m-%d')
+
+    async def popular_channels(self) -> list:
+        """Самые запрашиваемые каналы за последние PREFETCH_LOOKBACK_DAYS дней"""
+        index = get_usage_index()
+        # Чтение лога — дисковая операция, выполняется вне event loop
+        if await asyncio.to_thread(index.refresh):
+            # Сохраненный индекс избавляет следующий запуск от повторного чтения всего лога
+            try:
+                await asyncio.to_thread(index.save)
+            except OSError as e:
+                print(f"Warning: failed to save usage index: {e}", file=sys.stderr)
+        return [channel for channel, _ in index.top_channels(PREFETCH_TOP_CHANNELS, PREFETCH_LOOKBACK_DAYS) if channel]
+
+    async def run_once(self) -> int:
+        """
+        Один проход: обновляет устаревшие записи кеша популярных каналов.
+
+        Returns:
+            int: Число загруженных каналов
+        """
+        self.last_run = time.time()
+        start_date, end_date = self.window()
+        fetched = 0
+        for channel in await self.popular_channels():
+            failures, not_before = self._backoff.get(channel, (0, 0.0))
+            if time.monotonic() < not_before:
+                continue
+            entry = await post_cache.load_entry(channel)
+            if (post_cache.covers(entry, start_date, end_date, PREFETCH_LIMIT)
+                    and time.time() - entry['fetched_at'] < PREFETCH_REFRESH_AGE):
+                continue
+
+            try:
+                # Загрузка идет через кеш постов: фоновая доля бюджета, повторы после временных
+                # ошибок, продолжение прерванных загрузок; слот уступается пользователям
+                if entry is not None and entry.get('limit') == PREFETCH_LIMIT:
+                    # Запись канала продолжается новыми сообщениями, ее посты перечитываются по id
+                    await post_cache.revalidate(self.api_id, self.api_hash, channel, limit=PREFETCH_LIMIT,
+                                                client_key='prefetch')
+                else:
+                    await post_cache.fetch_posts_cached(
+                        self.api_id, self.api_hash, channel, start_date, end_date, limit=PREFETCH_LIMIT,
+                        client_key='prefetch', background=True
+                    )
+            except asyncio.CancelledError:
+                raise
+            except FetchPreempted:
+                # Слот отдан пользователю, просмотр сохранен в кеше постов для продолжения
+                continue
+            except Exception as e:
+                failures += 1
+                # FloodWait от Telegram сообщает, сколько ждать
+                delay = max(
+                    float(getattr(e, 'seconds', 0) or 0),
+                    min(PREFETCH_BACKOFF_MAX, PREFETCH_BACKOFF_BASE * 2 ** (failures - 1)),
+                )
+                self._backoff[channel] = (failures, time.monotonic() + _jittered(delay))
+                self.errors += 1
+                print(f"Warning: prefetch of {channel} failed, retry in {delay:.0f} s: {e}", file=sys.stderr)
+                continue
+
+            self._backoff.pop(channel, None)
+            fetched += 1
+            self.prefetched += 1
+            # Разносим загрузки каналов во времени
+            await asyncio.sleep(_jittered(2.0, 0.5))
+        return fetched
+
+
+_scheduler: Optional[PrefetchScheduler] = None
+
+
+def start_prefetch(api_id, api_hash):
+    """Запускает предзагрузку (обработчик app.on_startup)"""
+    global _scheduler
+    if not PREFETCH_ENABLED or not api_id or not api_hash or _scheduler is not None:
+        return
+    _scheduler = PrefetchScheduler(api_id, api_hash)
+    _scheduler.start()
+
+
+def stop_prefetch():
+    """Останавливает предзагрузку (обработчик app.on_shutdown)"""
+    global _scheduler
+    if _scheduler is not None:
+        _scheduler.stop()
+        _scheduler = None
@@ -0,0 +1,91 @@
+"""
+Бюджет запросов к Telegram
+
+Загрузки пользователей расходуют общий бюджет без ожидания. Фоновые загрузки
+(предзагрузка популярных каналов, загрузка предыдущего периода заранее, обновление
+устаревших записей кеша) берут токены из своей доли бюджета и только если общий
+бюджет не исчерпан пользователями.
+"""
+import os
+import time
+import asyncio
+
+
+# Загрузок канала (вызовов fetch_posts_async) в минуту на весь процесс
+TELEGRAM_FETCHES_PER_MINUTE = float(os.getenv('TELEGRAM_FETCHES_PER_MINUTE', '20'))
+# Доля бюджета, которую могут занимать фоновые загрузки
+PREFETCH_RATE_SHARE = float(os.getenv('PREFETCH_RATE_SHARE', '0.2'))
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self) -> float:
+        """Текущее число токенов (может быть отрицательным после принудительного расхода)"""
+        self._refill()
+        return self.tokens
+
+    def spend(self, tokens: float = 1.0):
+        """Расходует токены без проверки (долг восполняется со временем)"""
+        self._refill()
+        self.tokens -= tokens
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Берет токены, если они есть"""
+        self._refill()
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        """Сколько секунд ждать, пока накопится tokens токенов"""
+        self._refill()
+        if self.tokens >= tokens or self.rate <= 0:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+
+class RateBudget:
+    """Общий бюджет загрузок и выделенная доля для фоновых загрузок"""
+
+    def __init__(self, per_minute: float = TELEGRAM_FETCHES_PER_MINUTE, background_share: float = PREFETCH_RATE_SHARE):
+        rate = per_minute / 60.0
+        self.total = TokenBucket(rate, max(1.0, per_minute / 4))
+        self.background = TokenBucket(rate * background_share, 1.0)
+
+    def spend_foreground(self, tokens: float = 1.0):
+        """Учитывает загрузку пользователя (никогда не задерживает ее)"""
+        self.total.spend(tokens)
+
+    def try_background(self, tokens: float = 1.0) -> bool:
+        """Разрешает фоновую загрузку, если есть токены и в доле, и в общем бюджете"""
+        if self.total.available() < tokens or self.background.available() < tokens:
+            return False
+        self.total.spend(tokens)
+        self.background.spend(tokens)
+        return True
+
+    def background_wait(self, tokens: float = 1.0) -> float:
+        """Сколько секунд ждать до следующей возможной фоновой загрузки"""
+        return max(self.total.wait_time(tokens), self.background.wait_time(tokens))
+
+    async def acquire_background(self, tokens: float = 1.0):
+        """Ждет, пока фоновой загрузке достанутся токены (try_background)"""
+        while not self.try_background(tokens):
+            await asyncio.sleep(max(1.0, self.background_wait(tokens)))
+
+
+# Глобальный бюджет запросов к Telegram
+TELEGRAM_BUDGET = RateBudget()
@@ -1,10 +1,30 @@
 """
 Модуль для логирования пользовательских запросов статистики
+
+Записи не пишутся на диск в event loop: log_statistics_request только кладет запись
+в очередь, а фоновый поток пишет накопленные записи пачками, периодически делает fsync,
+ротирует файл по размеру и по смене дня (старые файлы сжимаются gzip) и дописывает
+очередь при остановке приложения.
+
+Форматы (переменная окружения REQUEST_LOG_FORMAT):
+- 'jsonl' (по умолчанию) — logs/stat_requests.log, одна JSON-строка на запрос;
+- 'binary' — logs/stat_requests.bin, компактные записи с длиной и CRC32,
+  которые можно дописывать и быстро просматривать (см. iter_records).
 """
 import os
+import sys
 import json
-from datetime import datetime, timezone, timedelta
+import gzip
+import time
+import queue
+import atexit
+import shutil
+import struct
+import zlib
+import threading
+from datetime import datetime, timezone, timedelta, date
 from pathlib import Path
+from typing import Iterator
 
 
 def get_moscow_timestamp() -> str:
@@ -47,17 +67,323 @@ def get_user_login() -> str:
     return "web_user"
 
 
-def log_statistics_request(start_date: str, end_date: str, login: str = None):
+# ------------------ Настройки ----------------------
+
+LOGS_DIR = Path(__file__).parent.parent / "logs"
+REQUEST_LOG_FORMAT = os.getenv('REQUEST_LOG_FORMAT', 'jsonl').strip().lower()
+REQUEST_LOG_MAX_BYTES = int(os.getenv('REQUEST_LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+REQUEST_LOG_BACKUPS = int(os.getenv('REQUEST_LOG_BACKUPS', '30'))
+# Сколько записей писать за раз и как часто сбрасывать буфер и делать fsync (секунды)
+REQUEST_LOG_BATCH_SIZE = 256
+REQUEST_LOG_FLUSH_INTERVAL = float(os.getenv('REQUEST_LOG_FLUSH_INTERVAL', '1.0'))
+REQUEST_LOG_FSYNC_INTERVAL = float(os.getenv('REQUEST_LOG_FSYNC_INTERVAL', '5.0'))
+
+MOSCOW_TZ = timezone(timedelta(hours=3))
+
+
+def log_file_path(log_format: str = REQUEST_LOG_FORMAT) -> Path:
+    """Возвращает путь к текущему файлу лога запросов"""
+    return LOGS_DIR / ("stat_requests.bin" if log_format == 'binary' else "stat_requests.log")
+
+
+# ------------------ Бинарный формат ----------------------
+#
+# Запись: заголовок (длина тела uint16, CRC32 тела uint32) и тело:
+# версия uint8, время unix uint32, start_date и end_date — дни от 1970-01-01 uint16,
+# затем строки login, event, source и extra (JSON прочих полей или пусто),
+# каждая — длина uint16 и UTF-8 (в записях версии 1 — длина uint8).
+
+RECORD_HEADER = struct.Struct('<HI')
+RECORD_FIXED = struct.Struct('<BIHH')
+RECORD_VERSION = 2
+_STR_LENGTH = {1: struct.Struct('<B'), 2: struct.Struct('<H')}
+# Предел строк login, event, source (байты UTF-8) и значений extra (символы):
+# extra обрезается по значениям, чтобы JSON оставался целым
+MAX_STRING_BYTES = 1024
+MAX_EXTRA_VALUE_CHARS = 1024
+_EPOCH = date(1970, 1, 1)
+_BASE_FIELDS = ('timestamp_msk', 'login', 'start_date', 'end_date', 'event', 'source')
+
+
+def _pack_str(value: str, limit: int = 0xFFFF) -> bytes:
+    data = value.encode('utf-8')
+    if len(data) > limit:
+        # Обрезаем по границе символа, а не посреди последовательности UTF-8
+        data = data[:limit].decode('utf-8', errors='ignore').encode('utf-8')
+    return _STR_LENGTH[RECORD_VERSION].pack(len(data)) + data
+
+
+def _short_value(value):
+    if isinstance(value, str) and len(value) > MAX_EXTRA_VALUE_CHARS:
+        return value[:MAX_EXTRA_VALUE_CHARS]
+    return value
+
+
+def _day_number(value: str) -> int:
+    try:
+        return (datetime.strptime(value, '%Y-%m-%d').date() - _EPOCH).days
+    except (TypeError, ValueError):
+        return 0
+
+
+def encode_record(entry: dict) -> bytes:
+    """Кодирует запись лога в бинарный формат"""
+    moment = datetime.strptime(entry['timestamp_msk'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=MOSCOW_TZ)
+    extra = {k: _short_value(v) for k, v in entry.items() if k not in _BASE_FIELDS}
+    body = RECORD_FIXED.pack(
+        RECORD_VERSION,
+        int(moment.timestamp()),
+        _day_number(entry.get('start_date')),
+        _day_number(entry.get('end_date')),
+    ) + b''.join(_pack_str(str(entry.get(k) or ''), MAX_STRING_BYTES) for k in ('login', 'event', 'source'))
+    extra_json = json.dumps(extra, ensure_ascii=False, separators=(',', ':')) if extra else ''
+    if len(body) + len(extra_json.encode('utf-8')) + 2 > 0xFFFF:
+        # Не помещается в запись даже после обрезки значений — прочие поля не пишутся
+        print(f"Warning: request log extra fields dropped ({len(extra)} fields too long)", file=sys.stderr)
+        extra_json = ''
+    body += _pack_str(extra_json)
+    return RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def decode_record(body: bytes) -> dict:
+    """Декодирует тело бинарной записи в словарь того же вида, что и JSON-строка"""
+    version, ts, start_day, end_day = RECORD_FIXED.unpack_from(body)
+    length_format = _STR_LENGTH.get(version)
+    if length_format is None:
+        raise ValueError(f"unknown record version {version}")
+    pos = RECORD_FIXED.size
+    strings = []
+    for _ in range(4):
+        (length,) = length_format.unpack_from(body, pos)
+        pos += length_format.size
+        strings.append(body[pos:pos + length].decode('utf-8', errors='replace'))
+        pos += length
+    login, event, source, extra = strings
+    entry = {
+        "timestamp_msk": datetime.fromtimestamp(ts, MOSCOW_TZ).strftime('%Y-%m-%d %H:%M:%S'),
+        "login": login,
+        "start_date": (_EPOCH + timedelta(days=start_day)).isoformat() if start_day else '',
+        "end_date": (_EPOCH + timedelta(days=end_day)).isoformat() if end_day else '',
+        "event": event,
+        "source": source,
+    }
+    if extra:
+        try:
+            entry.update(json.loads(extra))
+        except ValueError:
+            # В записях версии 1 длинный extra мог быть обрезан посреди JSON —
+            # запись остается с основными полями
+            pass
+    return entry
+
+
+def _open_log(path: Path):
+    return gzip.open(path, 'rb') if path.suffix == '.gz' else open(path, 'rb')
+
+
+def iter_records(path, offset: int = 0) -> Iterator[tuple]:
+    """
+    Читает записи лога (JSON-строки или бинарные, в том числе сжатые .gz).
+    Недописанная последняя запись и поврежденные записи пропускаются.
+
+    Args:
+        path: Путь к файлу лога
+        offset: Смещение (в несжатых данных), с которого начинать чтение
+
+    Yields:
+        tuple: (смещение после записи, dict записи)
+    """
+    path = Path(path)
+    binary = '.bin' in path.suffixes
+    with _open_log(path) as f:
+        if offset:
+            f.seek(offset)
+        pos = offset
+        if not binary:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                pos += len(line)
+                try:
+                    yield pos, json.loads(line)
+                except ValueError:
+                    continue
+            return
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            length, crc = RECORD_HEADER.unpack(header)
+            body = f.read(length)
+            if len(body) < length:
+                break
+            pos += RECORD_HEADER.size + length
+            if zlib.crc32(body) != crc:
+                continue
+            try:
+                yield pos, decode_record(body)
+            except (ValueError, IndexError, struct.error):
+                continue
+
+
+# ------------------ Фоновая запись ----------------------
+
+class RequestLogWriter:
+    """
+    Фоновый писатель лога: очередь записей, запись пачками, периодический fsync,
+    ротация по размеру и по смене дня (МСК) со сжатием gzip
+    """
+
+    _STOP = object()
+
+    def __init__(self, log_format: str = REQUEST_LOG_FORMAT):
+        self.log_format = log_format
+        self.path = log_file_path(log_format)
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._file = None
+        self._day = None
+        self._last_fsync = 0.0
+        self.dropped = 0
+
+    def start(self):
+        """Запускает поток записи (при первой записи)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='request-log-writer', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def write(self, entry: dict):
+        """Кладет запись в очередь (не блокирует вызывающий поток)"""
+        if self._thread is None:
+            self.start()
+        self._queue.put(entry)
+
+    def stop(self, timeout: float = 10.0):
+        """Дописывает очередь, делает fsync и останавливает поток"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(self._STOP)
+        thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                item = self._queue.get(timeout=REQUEST_LOG_FLUSH_INTERVAL)
+            except queue.Empty:
+                item = None
+            while item is not None:
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= REQUEST_LOG_BATCH_SIZE:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+            try:
+                if batch:
+                    self._write_batch(batch)
+                if self._file is not None and (stopping or time.monotonic() - self._last_fsync >= REQUEST_LOG_FSYNC_INTERVAL):
+                    self._fsync()
+            except Exception as e:
+                self.dropped += len(batch)
+                print(f"Warning: Failed to log statistics request: {e}", file=sys.stderr)
+                self._close()
+        self._close()
+
+    def _write_batch(self, batch: list):
+        today = datetime.now(MOSCOW_TZ).date()
+        if self._file is None:
+            self._open(today)
+        elif today != self._day or self._file.tell() >= REQUEST_LOG_MAX_BYTES:
+            self._rotate()
+            self._open(today)
+        if self.log_format == 'binary':
+            data = b''.join(encode_record(entry) for entry in batch)
+        else:
+            data = ''.join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in batch).encode('utf-8')
+        self._file.write(data)
+        self._file.flush()
+
+    def _open(self, today: date):
+        LOGS_DIR.mkdir(exist_ok=True)
+        # Файл, оставшийся с прошлого дня или переросший лимит, ротируем до записи
+        if self.path.exists():
+            stat = self.path.stat()
+            modified = datetime.fromtimestamp(stat.st_mtime, MOSCOW_TZ).date()
+            if stat.st_size and (modified != today or stat.st_size >= REQUEST_LOG_MAX_BYTES):
+                self._rotate()
+        self._file = open(self.path, 'ab')
+        self._day = today
+        self._last_fsync = time.monotonic()
+
+    def _fsync(self):
+        os.fsync(self._file.fileno())
+        self._last_fsync = time.monotonic()
+
+    def _close(self):
+        if self._file is None:
+            return
+        try:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        except Exception as e:
+            print(f"Warning: Failed to close request log: {e}", file=sys.stderr)
+        self._file = None
+
+    def _rotate(self):
+        """Переименовывает текущий файл, сжимает его и удаляет лишние архивы"""
+        self._close()
+        if not self.path.exists():
+            return
+        stamp = datetime.now(MOSCOW_TZ).strftime('%Y%m%d-%H%M%S')
+        rotated = self.path.with_name(f"{self.path.name}.{stamp}")
+        # Несколько ротаций в одну секунду не должны перезаписывать архивы
+        suffix = 1
+        while rotated.exists() or Path(f"{rotated}.gz").exists():
+            rotated = self.path.with_name(f"{self.path.name}.{stamp}-{suffix}")
+            suffix += 1
+        self.path.rename(rotated)
+        with open(rotated, 'rb') as src, gzip.open(f"{rotated}.gz", 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        rotated.unlink()
+        archives = sorted(self.path.parent.glob(f"{self.path.name}.*.gz"), key=lambda p: p.stat().st_mtime)
+        for old in archives[:-REQUEST_LOG_BACKUPS] if REQUEST_LOG_BACKUPS > 0 else []:
+            old.unlink()
+
+
+# Глобальный писатель лога запросов
+LOG_WRITER = RequestLogWriter()
+
+
+def stop_request_logger():
+    """Дописывает очередь лога на диск (обработчик app.on_shutdown)"""
+    LOG_WRITER.stop()
+
+
+def log_statistics_request(start_date: str, end_date: str, login: str = None, request_id: str = None):
     """
     Логирует запрос на получение статистики.
+    Запись кладется в очередь и пишется на диск фоновым потоком.
     
     Args:
         start_date: Дата начала периода (YYYY-MM-DD)
         end_date: Дата окончания периода (YYYY-MM-DD)
         login: Логин пользователя (если None, будет получен автоматически)
+        request_id: Идентификатор запроса (core.tracing) для поиска его трассы
     
     Returns:
-        bool: True если логирование успешно, False в противном случае
+        bool: True если запись поставлена в очередь, False в противном случае
     """
     try:
         # Получаем логин, если не передан
@@ -73,25 +399,13 @@ def log_statistics_request(start_date: str, end_date: str, login: str = None):
             "event": "fetch_statistics",
             "source": "web_ui"
         }
+        if request_id:
+            log_entry["request_id"] = request_id
         
-        # Определяем путь к файлу лога
-        project_root = Path(__file__).parent.parent
-        logs_dir = project_root / "logs"
-        log_file = logs_dir / "stat_requests.log"
-        
-        # Создаем директорию, если не существует
-        logs_dir.mkdir(exist_ok=True)
-        
-        # Записываем в файл (append mode)
-        with open(log_file, "a", encoding="utf-8") as f:
-            json_line = json.dumps(log_entry, ensure_ascii=False)
-            f.write(json_line + "\n")
-        
+        LOG_WRITER.write(log_entry)
         return True
     
     except Exception as e:
         # В случае ошибки логируем в stderr, но не падаем
-        import sys
         print(f"Warning: Failed to log statistics request: {e}", file=sys.stderr)
         return False
-
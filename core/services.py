@@ -2,11 +2,13 @@
 Сервисы для работы с Telegram API
 """
 import os
+import time
+import asyncio
 import datetime
 from dotenv import load_dotenv
-from telethon import TelegramClient
-from telethon.sessions import StringSession
-from telethon.tl.types import MessageService
+
+from core import metrics
+from core.tracing import span
 
 
 def get_env_path():
@@ -29,32 +31,158 @@ def extract_channel_username(link: str) -> str:
         return link
 
 
-async def fetch_posts_async(
-    api_id,
-    api_hash,
-    channel_link,
-    start_date,
-    end_date,
-    limit=1000,
-    progress_callback=None
-):
+class FetchCheckpoint:
     """
-    Асинхронно загружает посты из Telegram канала
-    
+    Прогресс просмотра истории канала.
+
+    Просмотр не зависит от периода: сообщения читаются от самых старых, а limit
+    ограничивает число просмотренных сообщений. Поэтому незавершенный просмотр
+    можно продолжить с последнего сообщения для любого периода того же канала,
+    а посты отбираются по датам в конце.
+    """
+
+    def __init__(self, channel: str, limit: int):
+        self.channel = extract_channel_username(channel)
+        self.limit = limit
+        # Сколько сообщений просмотрено и id последнего из них
+        self.scanned = 0
+        self.last_id = 0
+        # Все просмотренные посты (без отбора по датам)
+        self.posts = []
+        self.updated_at = time.time()
+
+    def matches(self, channel: str, limit: int) -> bool:
+        """Подходит ли прогресс для загрузки channel с тем же limit"""
+        return self.channel == extract_channel_username(channel) and self.limit == limit
+
+
+def _message_to_post(message, msg_date, text=None) -> dict:
+    if text is None:
+        text = message.text
+    return {
+        "id": message.id,
+        "date": msg_date.strftime("%Y-%m-%d"),
+        "datetime": msg_date,  # Полная дата и время для анализа времени публикации
+        "title": (text[:70] if text else "(без текста)"),
+        "likes": getattr(message, 'reactions', None) and sum([r.count for r in message.reactions.results]) or 0,
+        "comments": message.replies.replies if message.replies and message.replies.replies is not None else 0,
+        "reposts": getattr(message, "forwards", 0),
+        "views": getattr(message, "views", 0) if hasattr(message, "views") and message.views is not None else 0
+    }
+
+
+def _raw_message_text(message, parse_mode):
+    """Текст сырого сообщения TL так же, как Message.text Telethon (с разметкой клиента)"""
+    if parse_mode and message.entities and message.message:
+        return parse_mode.unparse(message.message, message.entities)
+    return message.message
+
+
+# Сообщений в одном запросе истории (больше Telegram не отдает)
+HISTORY_CHUNK_SIZE = 100
+
+# Просмотр истории сырыми запросами GetHistoryRequest (0 — через client.iter_messages)
+TELEGRAM_RAW_HISTORY = os.getenv('TELEGRAM_RAW_HISTORY', '1').strip() != '0'
+
+
+async def iter_history_raw(client, entity, limit: int, min_id: int = 0):
+    """
+    Сообщения канала от старых к новым, как client.iter_messages(entity, limit,
+    reverse=True, min_id=min_id), но без объектов Message Telethon.
+
+    Страницы запрашиваются напрямую (messages.getHistory), а сообщения отдаются
+    такими, какими пришли в ответе (сырые объекты TL): не вызывается _finish_init,
+    не строятся словари пользователей и чатов ответа и буфер итератора.
+    Смещения страниц и условия остановки — как в итераторе Telethon.
+
     Args:
-        api_id: API ID Telegram
-        api_hash: API Hash Telegram
-        channel_link: Ссылка на канал
-        start_date: Начало периода (YYYY-MM-DD)
-        end_date: Конец периода (YYYY-MM-DD)
-        limit: Максимальное количество постов
-        progress_callback: Функция для обновления прогресса
-    
-    Returns:
-        list: Список постов
+        client: Клиент, которому можно отправлять запросы (client(request))
+        entity: InputPeer канала (client.get_input_entity)
+        limit: Сколько сообщений просмотреть
+        min_id: Просматривать сообщения после этого id
     """
-    channel_username = extract_channel_username(channel_link)
-    
+    from telethon.tl import types
+    from telethon.tl.functions.messages import GetHistoryRequest
+
+    request = GetHistoryRequest(
+        peer=entity, offset_id=min_id + 1 if min_id else 1, offset_date=None,
+        add_offset=0, limit=0, max_id=0, min_id=0, hash=0
+    )
+    # Telethon делает паузу между страницами длинного просмотра, чтобы не получить FloodWait
+    wait_time = 1 if limit > 3000 else 0
+    left = limit
+    last_id = 0
+    last_load = None
+    while left > 0:
+        if wait_time and last_load is not None:
+            await asyncio.sleep(max(0.0, wait_time - (time.time() - last_load)))
+        last_load = time.time()
+        # При просмотре от старых к новым нужен отрицательный add_offset (-limit)
+        request.limit = min(left, HISTORY_CHUNK_SIZE)
+        request.add_offset = -request.limit
+        response = await client(request)
+
+        last = None
+        for message in reversed(response.messages):
+            if isinstance(message, types.MessageEmpty):
+                continue
+            # Повторы id на плохом соединении завершают просмотр (как в Telethon)
+            if message.id <= last_id:
+                return
+            last_id = message.id
+            last = message
+            yield message
+            left -= 1
+            if left <= 0:
+                return
+
+        # Не срез истории — больше страниц нет; пустая или неполная страница — конец истории
+        if isinstance(response, types.messages.Messages) or not response.messages or last is None:
+            return
+        if len(response.messages) < request.limit:
+            return
+        request.offset_id = last.id + 1
+        request.offset_date = last.date
+
+
+def _iter_messages(client, entity, limit: int, min_id: int = 0):
+    """Те же сообщения, что iter_history_raw, через client.iter_messages"""
+    return client.iter_messages(entity, limit=limit, reverse=True, min_id=min_id)
+
+
+# Источник клиентов: 'telegram' (по умолчанию), 'fake' — локальная замена
+# (core/fake_telegram.py), 'record' — Telegram с записью ответов в кассеты
+TELEGRAM_BACKEND = os.getenv('TELEGRAM_BACKEND', 'telegram').strip().lower()
+
+# Фабрика клиентов, заданная программно (см. set_client_factory)
+_client_factory = None
+
+
+def set_client_factory(factory):
+    """
+    Подменяет создание клиента Telegram в fetch_posts_async.
+
+    Args:
+        factory: Функция factory(api_id, api_hash), возвращающая объект с интерфейсом
+            TelegramClient (connect, is_user_authorized, get_input_entity,
+            iter_messages, disconnect; если объект вызываем — client(request),
+            история читается сырыми запросами); None — вернуть поведение по умолчанию
+    """
+    global _client_factory
+    _client_factory = factory
+
+
+def create_client(api_id, api_hash):
+    """Создает клиента Telegram для одной загрузки"""
+    if _client_factory is not None:
+        return _client_factory(api_id, api_hash)
+    if TELEGRAM_BACKEND == 'fake':
+        from core.fake_telegram import FakeTelegramClient
+        return FakeTelegramClient()
+
+    from telethon import TelegramClient
+    from telethon.sessions import StringSession
+
     # Загружаем переменные окружения перед использованием
     env_path = get_env_path()
     load_dotenv(env_path, override=True)  # Используем override=True для гарантированной загрузки
@@ -89,45 +217,185 @@ async def fetch_posts_async(
     
     session = StringSession(tg_session)
     client = TelegramClient(session, int(api_id), api_hash)
+    if TELEGRAM_BACKEND == 'record':
+        from core.fake_telegram import RecordingClient
+        client = RecordingClient(client)
+    return client
+
+
+def _observe_fetch(outcome: str, scanned: int, duration: float):
+    """Учитывает загрузку в метриках (core.metrics)"""
+    metrics.FETCHES.inc(1, outcome)
+    metrics.FETCH_MESSAGES.inc(scanned)
+    metrics.FETCH_DURATION.observe(duration, metrics.fetch_size_bucket(scanned))
+    if outcome == 'ok' and duration > 0:
+        metrics.FETCH_THROUGHPUT.observe(scanned / duration)
+
+
+async def fetch_posts_async(
+    api_id,
+    api_hash,
+    channel_link,
+    start_date,
+    end_date,
+    limit=1000,
+    progress_callback=None,
+    checkpoint=None
+):
+    """
+    Асинхронно загружает посты из Telegram канала
+    
+    Args:
+        api_id: API ID Telegram
+        api_hash: API Hash Telegram
+        channel_link: Ссылка на канал
+        start_date: Начало периода (YYYY-MM-DD)
+        end_date: Конец периода (YYYY-MM-DD)
+        limit: Максимальное количество постов
+        progress_callback: Функция для обновления прогресса
+        checkpoint: FetchCheckpoint для того же канала и limit — просмотр продолжается
+            с сохраненного места, а прогресс записывается в него по мере загрузки
+            (при отмене в нем остаются уже просмотренные посты)
+    
+    Returns:
+        list: Список постов
+    """
+    if checkpoint is None or not checkpoint.matches(channel_link, limit):
+        checkpoint = FetchCheckpoint(channel_link, limit)
+    start = datetime.datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.datetime.strptime(end_date, "%Y-%m-%d")
     
+    def in_range(posts):
+        return [p for p in posts if start <= p['datetime'] <= end]
+    
+    if checkpoint.scanned >= limit:
+        return in_range(checkpoint.posts)
+    
+    # Telethon импортируется при первой загрузке (см. core/startup.py)
+    from telethon.tl.types import MessageService
+    from telethon.errors import FloodWaitError
+    
+    channel_username = extract_channel_username(channel_link)
+    client = create_client(api_id, api_hash)
+    
+    fetch_started = time.perf_counter()
+    scanned_before = checkpoint.scanned
+    outcome = 'error'
+    try:
+        with span('connect'):
+            # Подключаемся к Telegram (неинтерактивный режим для веб-приложения)
+            await client.connect()
+            
+            # Проверяем, авторизован ли клиент
+            if not await client.is_user_authorized():
+                raise ValueError(
+                    "Клиент не авторизован. "
+                    "Проверьте TG_SESSION в idandhash.env или запустите generate_session.py заново."
+                )
+        with span('resolve_channel', channel=channel_username):
+            entity = await client.get_input_entity(channel_username)
+        total = len(in_range(checkpoint.posts))
+
+        # Сырые страницы истории, если клиент принимает запросы напрямую (TelegramClient,
+        # FakeTelegramClient); иначе (например, RecordingClient) — объекты Message Telethon
+        raw = TELEGRAM_RAW_HISTORY and callable(client)
+        parse_mode = getattr(client, 'parse_mode', None) if raw else None
+        history = iter_history_raw if raw else _iter_messages
+
+        # Продолжаем просмотр после последнего просмотренного сообщения
+        with span('iter_messages', resumed_from=checkpoint.scanned, raw=raw) as paging:
+            paging_started = time.perf_counter()
+            async for message in history(client, entity, limit - checkpoint.scanned, checkpoint.last_id):
+                if 'first_page' not in paging:
+                    paging['first_page'] = round(time.perf_counter() - paging_started, 4)
+                checkpoint.scanned += 1
+                checkpoint.last_id = message.id
+                checkpoint.updated_at = time.time()
+                if isinstance(message, MessageService):
+                    continue
+                if not message.date:
+                    continue
+                msg_date = message.date.replace(tzinfo=None)
+                text = _raw_message_text(message, parse_mode) if raw else None
+                checkpoint.posts.append(_message_to_post(message, msg_date, text))
+                if msg_date < start or msg_date > end:
+                    continue
+                total += 1
+                if progress_callback and total % 20 == 0:
+                    await progress_callback(f'Загружено сообщений: {total}')
+            paging['messages'] = checkpoint.scanned - scanned_before
+        outcome = 'ok'
+    except FloodWaitError as e:
+        metrics.record_flood_wait(e)
+        raise
+    except asyncio.CancelledError:
+        outcome = 'cancelled'
+        raise
+    finally:
+        # Гарантируем закрытие клиента даже при ошибках
+        await client.disconnect()
+        _observe_fetch(outcome, checkpoint.scanned - scanned_before, time.perf_counter() - fetch_started)
+    
+    return in_range(checkpoint.posts)
+
+
+async def refresh_posts(api_id, api_hash, channel_link, posts: list) -> list:
+    """
+    Перечитывает уже загруженные посты по id (channels.getMessages, по HISTORY_CHUNK_SIZE
+    за запрос), не просматривая историю заново: обновляются счетчики и текст.
+
+    Args:
+        api_id, api_hash, channel_link: как у fetch_posts_async
+        posts: Посты канала (с ключом 'id')
+
+    Returns:
+        list: Посты в том же порядке; удаленные из канала сообщения убираются
+    """
+    if not posts:
+        return []
+    from telethon.tl import types
+    from telethon.errors import FloodWaitError
+
+    channel_username = extract_channel_username(channel_link)
+    client = create_client(api_id, api_hash)
+    raw = TELEGRAM_RAW_HISTORY and callable(client)
+    parse_mode = getattr(client, 'parse_mode', None) if raw else None
+    messages = {}
     try:
-        # Подключаемся к Telegram (неинтерактивный режим для веб-приложения)
         await client.connect()
-        
-        # Проверяем, авторизован ли клиент
         if not await client.is_user_authorized():
             raise ValueError(
                 "Клиент не авторизован. "
                 "Проверьте TG_SESSION в idandhash.env или запустите generate_session.py заново."
             )
-        posts, total = [], 0
-        start = datetime.datetime.strptime(start_date, "%Y-%m-%d")
-        end = datetime.datetime.strptime(end_date, "%Y-%m-%d")
-
-        async for message in client.iter_messages(channel_username, limit=limit, reverse=True):
-            if isinstance(message, MessageService):
-                continue
-            if not message.date:
-                continue
-            msg_date = message.date.replace(tzinfo=None)
-            if msg_date < start or msg_date > end:
-                continue
-            posts.append({
-                "id": message.id,
-                "date": msg_date.strftime("%Y-%m-%d"),
-                "datetime": msg_date,  # Полная дата и время для анализа времени публикации
-                "title": (message.text[:70] if message.text else "(без текста)"),
-                "likes": getattr(message, 'reactions', None) and sum([r.count for r in message.reactions.results]) or 0,
-                "comments": message.replies.replies if message.replies and message.replies.replies is not None else 0,
-                "reposts": getattr(message, "forwards", 0),
-                "views": getattr(message, "views", 0) if hasattr(message, "views") and message.views is not None else 0
-            })
-            total += 1
-            if progress_callback and total % 20 == 0:
-                await progress_callback(f'Загружено сообщений: {total}')
+        entity = await client.get_input_entity(channel_username)
+        ids = [p['id'] for p in posts]
+        with span('refresh_posts', posts=len(ids), raw=raw):
+            for offset in range(0, len(ids), HISTORY_CHUNK_SIZE):
+                chunk = ids[offset:offset + HISTORY_CHUNK_SIZE]
+                if raw:
+                    from telethon.tl.functions.channels import GetMessagesRequest
+                    response = await client(GetMessagesRequest(
+                        channel=entity, id=[types.InputMessageID(i) for i in chunk]
+                    ))
+                    found = response.messages
+                else:
+                    found = await client.get_messages(entity, ids=chunk)
+                for message in found:
+                    # Удаленные сообщения приходят как MessageEmpty (или None у get_messages)
+                    if message is not None and not isinstance(message, types.MessageEmpty) and message.date:
+                        messages[message.id] = message
+    except FloodWaitError as e:
+        metrics.record_flood_wait(e)
+        raise
     finally:
-        # Гарантируем закрытие клиента даже при ошибках
         await client.disconnect()
-    
-    return posts
 
+    refreshed = []
+    for post in posts:
+        message = messages.get(post['id'])
+        if message is None:
+            continue
+        text = _raw_message_text(message, parse_mode) if raw else None
+        refreshed.append(_message_to_post(message, message.date.replace(tzinfo=None), text))
+    return refreshed
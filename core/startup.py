@@ -0,0 +1,140 @@
+"""
+Запуск приложения: отложенные тяжелые импорты, прогрев и отчет о времени старта
+
+Режимы (переменная окружения STARTUP_MODE):
+- 'lazy' — pandas, matplotlib и Telethon импортируются при первом использовании;
+  порт открывается быстрее всего, первый запрос платит за импорт;
+- 'warm' (по умолчанию) — импорты так же отложены, но сразу после открытия порта
+  фоновый поток импортирует библиотеки, загружает кеш шрифтов и строит первый график.
+"""
+import os
+import sys
+import time
+import threading
+
+
+STARTUP_MODE = os.getenv('STARTUP_MODE', 'warm').strip().lower()
+
+# Момент импорта модуля — main.py импортирует его первым
+_T0 = time.perf_counter()
+
+
+class StartupTimer:
+    """Замеры фаз запуска и прогрева"""
+
+    def __init__(self, mode: str = STARTUP_MODE):
+        self.mode = mode
+        self.phases = []
+        self.warmup = []
+        self.serving_after = None
+        self.warmup_total = None
+        self._last = _T0
+
+    def checkpoint(self, name: str):
+        """
+        Завершает фазу запуска name, начавшуюся с предыдущей отметки.
+        В скриптовом режиме NiceGUI main.py выполняется заново для каждого клиента —
+        после открытия порта отметки не записываются.
+        """
+        if self.serving_after is not None:
+            return
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def mark_serving(self):
+        """Отмечает открытие порта (обработчик app.on_startup) и печатает отчет о запуске"""
+        if self.serving_after is not None:
+            return
+        # Время от последней отметки main.py до открытия порта — запуск сервера
+        self.checkpoint('server_start')
+        self.serving_after = self._last - _T0
+        print(self.format_report(), file=sys.stderr)
+
+    def format_report(self) -> str:
+        """Возвращает текстовый отчет о времени запуска по фазам"""
+        lines = [f"Startup ({self.mode}): serving after {self.serving_after or 0:.3f} s"]
+        lines += [f"  {name:<24}{duration:8.3f} s" for name, duration in self.phases]
+        if self.warmup:
+            lines.append(f"Warm-up: {self.warmup_total or 0:.3f} s")
+            lines += [f"  {name:<24}{duration:8.3f} s" for name, duration in self.warmup]
+        return '\n'.join(lines)
+
+    def report(self) -> dict:
+        """Возвращает отчет о времени запуска"""
+        return {
+            'mode': self.mode,
+            'serving_after': self.serving_after,
+            'phases': dict(self.phases),
+            'warmup_total': self.warmup_total,
+            'warmup': dict(self.warmup),
+        }
+
+
+# Глобальный экземпляр замеров запуска
+STARTUP = StartupTimer()
+
+
+def _warm_pandas():
+    import pandas as pd
+    # Первая группировка подгружает ленивые части pandas
+    pd.DataFrame({'period': [1, 1], 'views': [1, 2]}).groupby('period').agg({'views': 'sum'})
+
+
+def _warm_matplotlib_fonts():
+    from matplotlib import font_manager
+    # Загружает (или при первом запуске строит) кеш шрифтов
+    font_manager.findfont(font_manager.FontProperties())
+
+
+def _warm_first_figure():
+    import io
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(2, 1))
+    ax = fig.subplots()
+    ax.plot(['a', 'b'], [1, 2], marker='o')
+    ax.set_title('Прогрев')
+    fig.savefig(io.BytesIO(), format='png', dpi=50)
+
+
+def _warm_telethon():
+    from telethon import TelegramClient  # noqa: F401
+    from telethon.sessions import StringSession  # noqa: F401
+    from telethon.tl.types import MessageService  # noqa: F401
+
+
+WARMUP_STEPS = [
+    ('pandas', _warm_pandas),
+    ('matplotlib_fonts', _warm_matplotlib_fonts),
+    ('first_figure', _warm_first_figure),
+    ('telethon', _warm_telethon),
+]
+
+
+def _run_warmup():
+    started = time.perf_counter()
+    for name, step in WARMUP_STEPS:
+        step_started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            print(f"Warning: warm-up step {name} failed: {e}", file=sys.stderr)
+            continue
+        STARTUP.warmup.append((name, time.perf_counter() - step_started))
+    STARTUP.warmup_total = time.perf_counter() - started
+    print(STARTUP.format_report(), file=sys.stderr)
+
+
+_warmup_thread = None
+
+
+def on_startup():
+    """
+    Обработчик app.on_startup: фиксирует открытие порта и в режиме 'warm'
+    запускает прогрев в фоновом потоке
+    """
+    global _warmup_thread
+    STARTUP.mark_serving()
+    if STARTUP_MODE == 'warm' and _warmup_thread is None:
+        _warmup_thread = threading.Thread(target=_run_warmup, name='startup-warmup', daemon=True)
+        _warmup_thread.start()
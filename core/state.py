@@ -14,11 +14,15 @@ class AppState:
     
     last_fetch_params: dict = field(default_factory=dict)
     last_channel: str = ''
+    # Номер загрузки данных: отличает повторную загрузку тех же параметров (не сбрасывается)
+    data_version: int = 0
 
     def reset(self):
         """Сброс данных"""
-        self.posts.clear()
-        self.previous_posts.clear()
+        # Списки заменяются, а не очищаются: загруженные ранее посты могут быть
+        # еще показаны другими клиентами (CardLoader.data)
+        self.posts = []
+        self.previous_posts = []
         self.last_fetch_params.clear()
         self.last_channel = ''
 
@@ -0,0 +1,126 @@
+"""
+Генератор синтетических постов канала для бенчмарков и нагрузочных тестов
+
+Посты имеют ту же форму, что возвращает fetch_posts_async (id, date, datetime,
+title, likes, comments, reposts, views), и упорядочены так же — от старых к новым.
+Распределения приближены к реальным каналам:
+- просмотры по степенному закону (Парето): большинство постов около медианы,
+  редкие посты «выстреливают» в десятки раз;
+- реакции, комментарии и репосты пропорциональны просмотрам с разбросом
+  (логнормальные доли), у части постов комментарии отключены;
+- время публикации следует суточному ритму (утро и вечер чаще ночи),
+  по выходным постов меньше.
+"""
+import random
+import datetime
+from typing import Optional
+
+
+# Относительная частота публикаций по часам суток (0..23)
+HOURLY_WEIGHTS = (
+    1, 0.5, 0.3, 0.2, 0.2, 0.4, 1.5, 3.5, 6, 8, 8, 7,
+    6.5, 6, 5.5, 5.5, 6, 7, 8, 8.5, 7.5, 6, 4, 2,
+)
+# Относительная частота по дням недели (пн..вс)
+WEEKDAY_WEIGHTS = (1.0, 1.05, 1.05, 1.0, 0.95, 0.6, 0.5)
+
+VIEWS_MEDIAN = 3000
+VIEWS_PARETO_ALPHA = 1.6
+LIKES_RATE = 0.02
+COMMENTS_RATE = 0.002
+REPOSTS_RATE = 0.004
+# Доля постов без текста (только медиа) и без комментариев
+NO_TEXT_SHARE = 0.08
+NO_COMMENTS_SHARE = 0.15
+
+_WORDS = (
+    'новости', 'обзор', 'итоги', 'недели', 'рынок', 'прогноз', 'данные', 'канал',
+    'запуск', 'релиз', 'подборка', 'разбор', 'анонс', 'интервью', 'опрос', 'важно',
+    'сегодня', 'график', 'рост', 'снижение', 'причины', 'как', 'почему', 'что',
+)
+
+
+# Заголовки выбираются из заранее собранного набора (генерация 1M постов не тратит время на текст)
+TITLE_POOL_SIZE = 512
+
+
+def _titles(rng: random.Random) -> list:
+    titles = []
+    for _ in range(TITLE_POOL_SIZE):
+        words = rng.choices(_WORDS, k=rng.randint(3, 14))
+        titles.append(' '.join(words).capitalize()[:70])
+    return titles
+
+
+def _post_offsets(rng: random.Random, n: int, days: int, weekday_shift: int) -> list:
+    """n моментов публикации (секунды от начала периода) с суточным и недельным ритмом"""
+    day_weights = [WEEKDAY_WEIGHTS[(d + weekday_shift) % 7] for d in range(days)]
+    day_offsets = rng.choices(range(days), weights=day_weights, k=n)
+    hours = rng.choices(range(24), weights=HOURLY_WEIGHTS, k=n)
+    offsets = [d * 86400 + h * 3600 + rng.randrange(3600) for d, h in zip(day_offsets, hours)]
+    offsets.sort()
+    return offsets
+
+
+def generate_posts(
+    n: int,
+    start_date: str = '2024-01-01',
+    end_date: Optional[str] = None,
+    seed: int = 0,
+    views_median: float = VIEWS_MEDIAN,
+) -> list:
+    """
+    Генерирует n постов канала.
+
+    Args:
+        n: Число постов
+        start_date: Начало периода (YYYY-MM-DD)
+        end_date: Конец периода (YYYY-MM-DD, не включительно); по умолчанию —
+            столько дней, чтобы выходило около 8 постов в день (от года до десяти лет)
+        seed: Зерно генератора (одинаковое зерно — одинаковые посты)
+        views_median: Медиана просмотров
+
+    Returns:
+        list: Посты в форме fetch_posts_async, от старых к новым
+    """
+    rng = random.Random(seed)
+    start = datetime.datetime.strptime(start_date, "%Y-%m-%d")
+    if end_date:
+        end = datetime.datetime.strptime(end_date, "%Y-%m-%d")
+    else:
+        end = start + datetime.timedelta(days=min(max(365, n // 8), 3650))
+
+    days = max(1, (end - start).days)
+    # Недельный ритм отсчитывается от дня недели начала периода
+    weekday_shift = start.weekday()
+    day_names = [(start + datetime.timedelta(days=d)).strftime("%Y-%m-%d") for d in range(days)]
+    titles = _titles(rng)
+
+    # Медиана распределения Парето с xm = 1 равна 2^(1/alpha)
+    views_scale = views_median / 2 ** (1 / VIEWS_PARETO_ALPHA)
+    posts = []
+    for i, offset in enumerate(_post_offsets(rng, n, days, weekday_shift), start=1):
+        views = int(views_scale * rng.paretovariate(VIEWS_PARETO_ALPHA))
+        likes = int(views * LIKES_RATE * rng.lognormvariate(0, 0.6))
+        comments = 0 if rng.random() < NO_COMMENTS_SHARE else int(views * COMMENTS_RATE * rng.lognormvariate(0, 0.9))
+        reposts = int(views * REPOSTS_RATE * rng.lognormvariate(0, 1.0))
+        posts.append({
+            "id": i,
+            "date": day_names[offset // 86400],
+            "datetime": start + datetime.timedelta(seconds=offset),
+            "title": "(без текста)" if rng.random() < NO_TEXT_SHARE else rng.choice(titles),
+            "likes": likes,
+            "comments": comments,
+            "reposts": reposts,
+            "views": views,
+        })
+    return posts
+
+
+def period_of(posts: list) -> tuple[str, str]:
+    """Период (YYYY-MM-DD, YYYY-MM-DD), целиком покрывающий посты"""
+    if not posts:
+        today = datetime.date.today().strftime("%Y-%m-%d")
+        return today, today
+    last = posts[-1]['datetime'] + datetime.timedelta(days=1)
+    return posts[0]['date'], last.strftime("%Y-%m-%d")
@@ -0,0 +1,334 @@
+"""
+Трассировка запросов и профилирование по запросу администратора
+
+Запрос (загрузка статистики, построение графиков, вычисление карточки) выполняется
+внутри start_trace: у него есть request_id (он же пишется в лог запросов),
+а этапы отмечаются span(...). Текущая трасса передается через contextvars,
+поэтому этапы во вложенных вызовах (core.post_cache, core.services, run_compute)
+попадают в нее без передачи параметров, а без трассы span ничего не делает.
+
+Последние трассы хранятся в памяти, медленные (дольше TRACE_SLOW_THRESHOLD)
+дописываются в logs/slow_traces.jsonl. Администратор может «взвести» профилирование
+(arm_profile): следующий запрос выполнится под cProfile или сэмплирующим
+профилировщиком, а результат сохранится в logs/profiles/ (см. core/admin.py).
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import threading
+import contextvars
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+
+from core.request_logger import LOGS_DIR
+
+
+# Запросы дольше порога сохраняются в журнал медленных трасс (секунды)
+TRACE_SLOW_THRESHOLD = float(os.getenv('TRACE_SLOW_THRESHOLD', '5'))
+TRACE_HISTORY = 200
+SLOW_TRACES_PATH = LOGS_DIR / 'slow_traces.jsonl'
+SLOW_TRACES_MAX_BYTES = 10 * 1024 * 1024
+PROFILES_DIR = LOGS_DIR / 'profiles'
+PROFILES_KEEP = 20
+PROFILE_MODES = ('cprofile', 'sampling')
+# Интервал сэмплирующего профилировщика (секунды)
+SAMPLING_INTERVAL = 0.005
+
+_current_trace = contextvars.ContextVar('analtg_trace', default=None)
+_current_span = contextvars.ContextVar('analtg_span', default=None)
+
+# Последние завершенные трассы (новые в конце)
+RECENT_TRACES = deque(maxlen=TRACE_HISTORY)
+
+# Режим профилирования, взведенный для следующего запроса
+_armed_profile: Optional[str] = None
+_profile_lock = threading.Lock()
+
+
+def new_request_id() -> str:
+    """Короткий идентификатор запроса"""
+    return uuid.uuid4().hex[:12]
+
+
+class Trace:
+    """Трасса одного запроса: этапы с временем начала и длительностью"""
+
+    def __init__(self, name: str, request_id: Optional[str] = None, **meta):
+        self.name = name
+        self.request_id = request_id or new_request_id()
+        self.meta = meta
+        self.started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._t0 = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.status = 'running'
+        self.spans = []
+        self.profile: Optional[str] = None
+        self._ids = iter(range(1, 1 << 30))
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Отмечает этап; в словарь attrs можно дописывать подробности внутри блока"""
+        record = {
+            'id': next(self._ids),
+            'parent': _current_span.get(),
+            'name': name,
+            'start': time.perf_counter() - self._t0,
+            'duration': None,
+            'attrs': attrs,
+        }
+        self.spans.append(record)
+        token = _current_span.set(record['id'])
+        started = time.perf_counter()
+        try:
+            yield attrs
+        except asyncio.CancelledError:
+            attrs['cancelled'] = True
+            raise
+        except Exception as e:
+            attrs['error'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record['duration'] = time.perf_counter() - started
+            _current_span.reset(token)
+
+    def finish(self, status: str = 'ok'):
+        self.duration = time.perf_counter() - self._t0
+        self.status = status
+
+    def to_dict(self) -> dict:
+        return {
+            'request_id': self.request_id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration': self.duration,
+            'status': self.status,
+            'meta': self.meta,
+            'profile': self.profile,
+            'spans': [
+                {**s, 'start': round(s['start'], 6),
+                 'duration': None if s['duration'] is None else round(s['duration'], 6)}
+                for s in self.spans
+            ],
+        }
+
+    def format_summary(self) -> str:
+        """Однострочная сводка: этапы верхнего уровня и их длительность"""
+        stages = ', '.join(
+            f"{s['name']} {s['duration'] * 1000:.0f} ms"
+            for s in self.spans if s['parent'] is None and s['duration'] is not None
+        )
+        return f"{self.name} {self.request_id} {self.status} {(self.duration or 0) * 1000:.0f} ms: {stages}"
+
+
+def current_trace() -> Optional[Trace]:
+    """Трасса текущего запроса (или None)"""
+    return _current_trace.get()
+
+
+def current_request_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.request_id if trace is not None else None
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Этап текущей трассы; вне трассы ничего не записывает"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield attrs
+        return
+    with trace.span(name, **attrs) as a:
+        yield a
+
+
+@contextmanager
+def start_trace(name: str, request_id: Optional[str] = None, **meta):
+    """
+    Выполняет блок как отдельный запрос с трассой.
+    Внутри незавершенной трассы блок становится ее этапом; задача, запущенная
+    из уже завершенного запроса, получает свою трассу с тем же request_id.
+    """
+    parent = _current_trace.get()
+    if parent is not None and parent.duration is None:
+        with parent.span(name, **meta):
+            yield parent
+        return
+    if parent is not None and request_id is None:
+        request_id = parent.request_id
+
+    trace = Trace(name, request_id, **meta)
+    profiler = _start_armed_profile(trace)
+    token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    status = 'error'
+    try:
+        yield trace
+        status = 'ok'
+    except asyncio.CancelledError:
+        status = 'cancelled'
+        raise
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(token)
+        trace.finish(status)
+        if profiler is not None:
+            trace.profile = profiler.stop()
+        _record(trace)
+
+
+def _record(trace: Trace):
+    RECENT_TRACES.append(trace)
+    if trace.duration < TRACE_SLOW_THRESHOLD and trace.profile is None:
+        return
+    print(f"Warning: slow request {trace.format_summary()}", file=sys.stderr)
+    line = json.dumps(trace.to_dict(), ensure_ascii=False, default=str)
+    try:
+        asyncio.get_running_loop().run_in_executor(None, _append_slow_trace, line)
+    except RuntimeError:
+        _append_slow_trace(line)
+
+
+def _append_slow_trace(line: str):
+    try:
+        SLOW_TRACES_PATH.parent.mkdir(parents=True, exist_ok=True)
+        if SLOW_TRACES_PATH.exists() and SLOW_TRACES_PATH.stat().st_size > SLOW_TRACES_MAX_BYTES:
+            SLOW_TRACES_PATH.replace(SLOW_TRACES_PATH.with_suffix('.jsonl.1'))
+        with open(SLOW_TRACES_PATH, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+    except Exception as e:
+        print(f"Warning: failed to write slow trace: {e}", file=sys.stderr)
+
+
+def find_traces(request_id: str) -> list:
+    """Трассы запроса: из памяти, иначе из журнала медленных трасс"""
+    found = [t.to_dict() for t in RECENT_TRACES if t.request_id == request_id]
+    if found:
+        return found
+    for path in (SLOW_TRACES_PATH.with_suffix('.jsonl.1'), SLOW_TRACES_PATH):
+        if not path.exists():
+            continue
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if request_id in line:
+                    entry = json.loads(line)
+                    if entry.get('request_id') == request_id:
+                        found.append(entry)
+    return found
+
+
+# ------------------ Профилирование ----------------------
+
+def arm_profile(mode: str):
+    """Взводит профилирование следующего запроса ('cprofile' или 'sampling')"""
+    global _armed_profile
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"unknown profile mode: {mode}")
+    with _profile_lock:
+        _armed_profile = mode
+
+
+def armed_profile() -> Optional[str]:
+    return _armed_profile
+
+
+class _CProfileSession:
+    """
+    cProfile потока event loop на время запроса.
+    В профиль попадает и работа других клиентов в том же event loop.
+    """
+
+    def __init__(self, trace: Trace):
+        import cProfile
+        self.trace = trace
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self) -> Optional[str]:
+        self.profile.disable()
+        path = PROFILES_DIR / f"{self.trace.request_id}.prof"
+        try:
+            PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+            self.profile.dump_stats(str(path))
+        except Exception as e:
+            print(f"Warning: failed to save profile: {e}", file=sys.stderr)
+            return None
+        _prune_profiles()
+        return path.name
+
+
+class _SamplingSession:
+    """
+    Сэмплирующий профилировщик: поток раз в SAMPLING_INTERVAL снимает стеки потока
+    event loop и потоков вычислений. Результат — свернутые стеки (формат flamegraph.pl
+    и speedscope): «поток;функция;...;функция число_сэмплов».
+    """
+
+    def __init__(self, trace: Trace):
+        self.trace = trace
+        self.loop_thread = threading.get_ident()
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(SAMPLING_INTERVAL):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if ident not in names:
+                    thread = next((t for t in threading.enumerate() if t.ident == ident), None)
+                    names[ident] = 'event_loop' if ident == self.loop_thread else (thread.name if thread else str(ident))
+                name = names[ident]
+                if ident != self.loop_thread and not name.startswith('compute'):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.samples[';'.join([name] + stack[::-1])] += 1
+
+    def stop(self) -> Optional[str]:
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+        path = PROFILES_DIR / f"{self.trace.request_id}.folded"
+        try:
+            PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in self.samples.most_common():
+                    f.write(f"{stack} {count}\n")
+        except Exception as e:
+            print(f"Warning: failed to save profile: {e}", file=sys.stderr)
+            return None
+        _prune_profiles()
+        return path.name
+
+
+def _start_armed_profile(trace: Trace):
+    global _armed_profile
+    with _profile_lock:
+        mode, _armed_profile = _armed_profile, None
+    if mode is None:
+        return None
+    try:
+        return _CProfileSession(trace) if mode == 'cprofile' else _SamplingSession(trace)
+    except Exception as e:
+        print(f"Warning: failed to start {mode} profile: {e}", file=sys.stderr)
+        return None
+
+
+def _prune_profiles():
+    profiles = sorted(PROFILES_DIR.iterdir(), key=lambda p: p.stat().st_mtime)
+    for path in profiles[:-PROFILES_KEEP]:
+        try:
+            path.unlink()
+        except OSError:
+            pass
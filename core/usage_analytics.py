@@ -0,0 +1,287 @@
+"""
+Аналитика использования по логу запросов статистики
+
+Индекс инкрементально читает logs/stat_requests.log (или .bin) и его архивы,
+запоминая смещение для каждого файла, и хранит небольшие агрегаты по дням:
+число запросов по каналам, по длине периода и по парам (канал, период).
+Запросы «топ-N» и «временной ряд» суммируют агрегаты нужных дней.
+
+Использование как библиотеки:
+    index = get_usage_index()
+    index.refresh()
+    index.top_channels(10, days=7)
+
+Использование из командной строки:
+    python -m core.usage_analytics top-channels --days 7 -n 10
+    python -m core.usage_analytics top-ranges --channel tech_igor
+    python -m core.usage_analytics lengths --days 30
+    python -m core.usage_analytics series --channel tech_igor --days 30
+"""
+import sys
+import gzip
+import json
+import hashlib
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from core.request_logger import LOGS_DIR, MOSCOW_TZ, iter_records
+
+
+STATE_FILE_NAME = 'usage_index.json'
+STATE_VERSION = 1
+# Сколько первых байт файла лога его идентифицируют
+SIGNATURE_BYTES = 4096
+
+
+def _read_prefix(path: Path, size: int = SIGNATURE_BYTES) -> bytes:
+    """Читает первые size байт несжатых данных файла лога"""
+    opener = gzip.open if path.suffix == '.gz' else open
+    with opener(path, 'rb') as f:
+        return f.read(size)
+
+
+def _match_file(prefix: bytes, offsets: dict) -> Optional[str]:
+    """
+    Находит сохраненное смещение для файла по началу его содержимого: после ротации
+    и сжатия архив начинается с тех же байт, поэтому смещение остается верным.
+    Начало короткого (растущего) файла сравнивается на сохраненной длине.
+    """
+    for key, known in offsets.items():
+        length = known['prefix_len']
+        if len(prefix) >= length and hashlib.sha1(prefix[:length]).hexdigest() == known['prefix_sha1']:
+            return key
+    return None
+
+
+def _range_length(start_date: str, end_date: str) -> Optional[int]:
+    try:
+        start = datetime.strptime(start_date, '%Y-%m-%d').date()
+        end = datetime.strptime(end_date, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+    return (end - start).days + 1
+
+
+class UsageIndex:
+    """Инкрементальный индекс запросов по дням"""
+
+    def __init__(self, logs_dir: Path = LOGS_DIR, state_path: Optional[Path] = None):
+        self.logs_dir = Path(logs_dir)
+        self.state_path = Path(state_path) if state_path else self.logs_dir / STATE_FILE_NAME
+        # Смещения прочитанных файлов: хеш начала файла при первом чтении -> {'name', 'offset', 'prefix_len', 'prefix_sha1'}
+        self.offsets = {}
+        # Агрегаты по дням: 'YYYY-MM-DD' -> {'total', 'channels', 'lengths', 'ranges'}
+        self.days = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    # ------------------ Загрузка ----------------------
+
+    def _load(self):
+        if not self.state_path.exists():
+            return
+        try:
+            state = json.loads(self.state_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError) as e:
+            print(f"Warning: usage index state ignored: {e}", file=sys.stderr)
+            return
+        if state.get('version') != STATE_VERSION:
+            return
+        self.offsets = state.get('offsets', {})
+        self.days = {
+            day: {
+                'total': data['total'],
+                'channels': Counter(data['channels']),
+                'lengths': Counter({int(k): v for k, v in data['lengths'].items()}),
+                'ranges': Counter(data['ranges']),
+            }
+            for day, data in state.get('days', {}).items()
+        }
+
+    def save(self):
+        """Сохраняет смещения и агрегаты, чтобы следующий запуск читал только новые записи"""
+        with self._lock:
+            state = {'version': STATE_VERSION, 'offsets': self.offsets, 'days': self.days}
+            self.logs_dir.mkdir(exist_ok=True)
+            tmp = self.state_path.with_suffix('.tmp')
+            tmp.write_text(json.dumps(state, ensure_ascii=False), encoding='utf-8')
+            tmp.replace(self.state_path)
+
+    def _log_files(self) -> list:
+        if not self.logs_dir.exists():
+            return []
+        files = [p for p in self.logs_dir.glob('stat_requests.*') if p.is_file()]
+        return sorted(files, key=lambda p: p.stat().st_mtime)
+
+    def refresh(self) -> int:
+        """
+        Дочитывает новые записи из всех файлов лога.
+
+        Returns:
+            int: Число добавленных записей
+        """
+        added = 0
+        with self._lock:
+            for path in self._log_files():
+                try:
+                    prefix = _read_prefix(path)
+                except (OSError, EOFError) as e:
+                    print(f"Warning: failed to read {path.name}: {e}", file=sys.stderr)
+                    continue
+                if not prefix:
+                    continue
+                key = _match_file(prefix, self.offsets) or hashlib.sha1(prefix).hexdigest()
+                known = self.offsets.get(key)
+                offset = known['offset'] if known else 0
+                try:
+                    for offset, entry in iter_records(path, offset):
+                        self._add(entry)
+                        added += 1
+                except (OSError, EOFError) as e:
+                    print(f"Warning: failed to read {path.name}: {e}", file=sys.stderr)
+                self.offsets[key] = {
+                    'name': path.name,
+                    'offset': offset,
+                    'prefix_len': len(prefix),
+                    'prefix_sha1': hashlib.sha1(prefix).hexdigest(),
+                }
+        return added
+
+    def _add(self, entry: dict):
+        day = (entry.get('timestamp_msk') or '')[:10]
+        if not day:
+            return
+        channel = entry.get('login') or ''
+        start_date, end_date = entry.get('start_date', ''), entry.get('end_date', '')
+        data = self.days.get(day)
+        if data is None:
+            data = self.days[day] = {'total': 0, 'channels': Counter(), 'lengths': Counter(), 'ranges': Counter()}
+        data['total'] += 1
+        data['channels'][channel] += 1
+        length = _range_length(start_date, end_date)
+        if length is not None:
+            data['lengths'][length] += 1
+        data['ranges'][f"{channel}|{start_date}|{end_date}"] += 1
+
+    # ------------------ Запросы ----------------------
+
+    def _window(self, days: int, until: Optional[str] = None) -> list:
+        """Возвращает агрегаты дней окна [until - days + 1, until] (по умолчанию до сегодня, МСК)"""
+        end = datetime.strptime(until, '%Y-%m-%d').date() if until else datetime.now(MOSCOW_TZ).date()
+        result = []
+        for i in range(days - 1, -1, -1):
+            day = (end - timedelta(days=i)).isoformat()
+            result.append((day, self.days.get(day)))
+        return result
+
+    def top_channels(self, n: int = 10, days: int = 7, until: Optional[str] = None) -> list:
+        """
+        Самые запрашиваемые каналы за последние days дней.
+
+        Returns:
+            list: [(канал, число запросов), ...]
+        """
+        total = Counter()
+        with self._lock:
+            for _, data in self._window(days, until):
+                if data:
+                    total.update(data['channels'])
+        return total.most_common(n)
+
+    def top_ranges(self, n: int = 10, days: int = 7, channel: Optional[str] = None, until: Optional[str] = None) -> list:
+        """
+        Самые запрашиваемые пары (канал, период) за последние days дней.
+
+        Returns:
+            list: [((канал, start_date, end_date), число запросов), ...]
+        """
+        total = Counter()
+        with self._lock:
+            for _, data in self._window(days, until):
+                if data:
+                    total.update(data['ranges'])
+        if channel is not None:
+            prefix = f"{channel}|"
+            total = Counter({k: v for k, v in total.items() if k.startswith(prefix)})
+        return [(tuple(key.split('|', 2)), count) for key, count in total.most_common(n)]
+
+    def range_lengths(self, n: int = 10, days: int = 7, until: Optional[str] = None) -> list:
+        """
+        Самые частые длины периода (в днях) за последние days дней.
+
+        Returns:
+            list: [(длина периода, число запросов), ...]
+        """
+        total = Counter()
+        with self._lock:
+            for _, data in self._window(days, until):
+                if data:
+                    total.update(data['lengths'])
+        return total.most_common(n)
+
+    def time_series(self, days: int = 30, channel: Optional[str] = None, until: Optional[str] = None) -> list:
+        """
+        Число запросов по дням (всего или для одного канала), включая дни без запросов.
+
+        Returns:
+            list: [('YYYY-MM-DD', число запросов), ...]
+        """
+        with self._lock:
+            return [
+                (day, (data['channels'].get(channel, 0) if channel is not None else data['total']) if data else 0)
+                for day, data in self._window(days, until)
+            ]
+
+
+_usage_index = None
+
+
+def get_usage_index() -> UsageIndex:
+    """Возвращает общий индекс использования (создается при первом вызове)"""
+    global _usage_index
+    if _usage_index is None:
+        _usage_index = UsageIndex()
+    return _usage_index
+
+
+def main(argv=None):
+    """Командная строка: python -m core.usage_analytics <запрос> [параметры]"""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m core.usage_analytics', description='Аналитика по логу запросов статистики')
+    parser.add_argument('query', choices=['top-channels', 'top-ranges', 'lengths', 'series'])
+    parser.add_argument('-n', type=int, default=10, help='размер топа')
+    parser.add_argument('--days', type=int, default=7, help='окно в днях (до --until включительно)')
+    parser.add_argument('--until', help='последний день окна, YYYY-MM-DD (по умолчанию сегодня, МСК)')
+    parser.add_argument('--channel', help='канал (для top-ranges и series)')
+    parser.add_argument('--logs-dir', default=str(LOGS_DIR), help='каталог логов')
+    parser.add_argument('--json', action='store_true', help='вывод в JSON')
+    parser.add_argument('--no-save', action='store_true', help='не сохранять смещения и агрегаты')
+    args = parser.parse_args(argv)
+
+    index = UsageIndex(Path(args.logs_dir))
+    index.refresh()
+    if not args.no_save:
+        index.save()
+
+    if args.query == 'top-channels':
+        rows = index.top_channels(args.n, args.days, args.until)
+    elif args.query == 'top-ranges':
+        rows = [(' '.join(key), count) for key, count in index.top_ranges(args.n, args.days, args.channel, args.until)]
+    elif args.query == 'lengths':
+        rows = index.range_lengths(args.n, args.days, args.until)
+    else:
+        rows = index.time_series(args.days, args.channel, args.until)
+
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False))
+    else:
+        for key, count in rows:
+            print(f"{count:8d}  {key}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,160 +1,131 @@
 """
 Модуль для работы с Яндекс.Метрикой
 Предоставляет безопасный API для отправки событий и параметров
+
+События не отправляются в браузер по одному: они накапливаются в очереди клиента,
+повторяющиеся события объединяются, и очередь отправляется одним вызовом
+после паузы в событиях (не позже METRIKA_MAX_DELAY после первого события).
+Функции-помощники в браузере — статический файл web/assets/metrika.js.
 """
+import os
+import sys
 import json
+import asyncio
+import weakref
 from typing import Optional, Dict, Any
 
 
 # ID счетчика Яндекс.Метрики
 METRIKA_ID = 106259012
 
-# Флаг инициализации глобальной функции
-_metrika_helper_initialized = False
+# Пауза в событиях, после которой очередь отправляется (секунды)
+METRIKA_FLUSH_INTERVAL = float(os.getenv('METRIKA_FLUSH_INTERVAL', '1.0'))
+# Максимальная задержка отправки первого события в очереди (секунды)
+METRIKA_MAX_DELAY = float(os.getenv('METRIKA_MAX_DELAY', '3.0'))
+
+# События, из которых в пачку попадает только последнее (например, изменение периода
+# при наборе даты), остальные события отправляются все
+COALESCED_EVENTS = {'change_period'}
+
+
+class _EventQueue:
+    """Очередь событий одного клиента"""
+
+    def __init__(self, client):
+        self.client = client
+        self.events = []
+        self.params = {}
+        self.first_at = None
+        self.handle = None
+
+    def add_event(self, event_name: str, payload: Optional[Dict[str, Any]]):
+        if event_name in COALESCED_EVENTS:
+            self.events = [e for e in self.events if e[0] != event_name]
+        self.events.append((event_name, payload or None))
+        self._schedule()
+
+    def add_params(self, params: Dict[str, Any]):
+        self.params.update(params)
+        self._schedule()
+
+    def _schedule(self):
+        """Откладывает отправку до паузы в событиях (debounce с ограничением задержки)"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self.first_at is None:
+            self.first_at = now
+        if self.handle is not None:
+            self.handle.cancel()
+        delay = min(METRIKA_FLUSH_INTERVAL, max(0.0, self.first_at + METRIKA_MAX_DELAY - now))
+        self.handle = loop.call_later(delay, self.flush)
+
+    def flush(self):
+        """Отправляет накопленные события одним вызовом JavaScript"""
+        if self.handle is not None:
+            self.handle.cancel()
+        self.handle = None
+        self.first_at = None
+        batch = []
+        if self.params:
+            batch.append(['params', self.params])
+        batch += [['goal', name, payload] for name, payload in self.events]
+        self.events = []
+        self.params = {}
+        if not batch or self.client.is_deleted:
+            return
+        try:
+            self.client.run_javascript(
+                f'window.analtgMetrika && analtgMetrika({json.dumps(batch, ensure_ascii=False)})'
+            )
+        except Exception as e:
+            print(f"Warning: Yandex Metrika flush failed: {e}", file=sys.stderr)
+
 
+_queues = weakref.WeakKeyDictionary()
 
-def _ensure_helper_initialized():
-    """Инициализирует глобальную JavaScript функцию для работы с Метрикой"""
-    global _metrika_helper_initialized
-    if _metrika_helper_initialized:
-        return
-    
+
+def _get_queue() -> _EventQueue:
+    """Возвращает очередь событий текущего клиента"""
     from nicegui import ui
-    
-    # Создаем глобальную функцию для отправки событий
-    helper_script = f"""
-    (function() {{
-        window._ymTrack = function(eventName, params) {{
-            if (window.ym) {{
-                try {{
-                    if (params && Object.keys(params).length > 0) {{
-                        window.ym({METRIKA_ID}, 'reachGoal', eventName, params);
-                    }} else {{
-                        window.ym({METRIKA_ID}, 'reachGoal', eventName);
-                    }}
-                    console.log('Yandex Metrika: tracked event', eventName, params || '');
-                }} catch(e) {{
-                    console.warn('Yandex Metrika error:', e);
-                }}
-            }} else {{
-                console.warn('Yandex Metrika: window.ym not available');
-            }}
-        }};
-        
-        window._ymSetParams = function(params) {{
-            if (window.ym) {{
-                try {{
-                    window.ym({METRIKA_ID}, 'params', params);
-                    console.log('Yandex Metrika: set params', params);
-                }} catch(e) {{
-                    console.warn('Yandex Metrika error:', e);
-                }}
-            }} else {{
-                console.warn('Yandex Metrika: window.ym not available');
-            }}
-        }};
-    }})();
-    """
-    
-    ui.add_body_html(f'<script>{helper_script}</script>')
-    _metrika_helper_initialized = True
+
+    client = ui.context.client
+    queue = _queues.get(client)
+    if queue is None:
+        queue = _queues[client] = _EventQueue(client)
+    return queue
 
 
 def track(event_name: str, payload: Optional[Dict[str, Any]] = None) -> None:
     """
     Безопасно отправляет событие в Яндекс.Метрику.
-    
+
     Args:
         event_name: Название события (goal)
         payload: Опциональные параметры события
-    
+
     Примеры:
         track('get_statistics')
         track('change_period', {'period_start': '2024-01-01', 'period_end': '2024-01-31'})
     """
     try:
-        _ensure_helper_initialized()
-        from nicegui import ui
-        
-        # Используем JSON для безопасной передачи параметров
-        if payload:
-            params_json = json.dumps(payload, ensure_ascii=False)
-            # Используем более надежный способ вызова с проверкой доступности функции
-            js_code = f"""
-            (function() {{
-                if (typeof window._ymTrack === 'function') {{
-                    window._ymTrack({json.dumps(event_name)}, {params_json});
-                }} else {{
-                    // Если функция еще не загружена, ждем и пробуем снова
-                    setTimeout(function() {{
-                        if (typeof window._ymTrack === 'function') {{
-                            window._ymTrack({json.dumps(event_name)}, {params_json});
-                        }} else {{
-                            console.warn('Yandex Metrika: _ymTrack function not available');
-                        }}
-                    }}, 100);
-                }}
-            }})();
-            """
-        else:
-            js_code = f"""
-            (function() {{
-                if (typeof window._ymTrack === 'function') {{
-                    window._ymTrack({json.dumps(event_name)});
-                }} else {{
-                    setTimeout(function() {{
-                        if (typeof window._ymTrack === 'function') {{
-                            window._ymTrack({json.dumps(event_name)});
-                        }} else {{
-                            console.warn('Yandex Metrika: _ymTrack function not available');
-                        }}
-                    }}, 100);
-                }}
-            }})();
-            """
-        
-        # Выполняем JavaScript код
-        ui.run_javascript(js_code)
+        _get_queue().add_event(event_name, payload)
     except Exception as e:
         # Логируем ошибку для отладки, но не прерываем работу приложения
         print(f"Yandex Metrika track error: {e}")
-        pass
 
 
 def set_params(params: Dict[str, Any]) -> None:
     """
     Устанавливает пользовательские параметры в Яндекс.Метрике.
-    
+    Параметры из нескольких вызовов объединяются до отправки.
+
     Args:
         params: Словарь с параметрами (например, {'user_type': 'guest', 'source': 'direct'})
-    
+
     Пример:
         set_params({'user_type': 'guest', 'source': 'direct'})
     """
     try:
-        _ensure_helper_initialized()
-        from nicegui import ui
-        
-        params_json = json.dumps(params, ensure_ascii=False)
-        js_code = f"""
-        (function() {{
-            if (typeof window._ymSetParams === 'function') {{
-                window._ymSetParams({params_json});
-            }} else {{
-                setTimeout(function() {{
-                    if (typeof window._ymSetParams === 'function') {{
-                        window._ymSetParams({params_json});
-                    }} else {{
-                        console.warn('Yandex Metrika: _ymSetParams function not available');
-                    }}
-                }}, 100);
-            }}
-        }})();
-        """
-        
-        ui.run_javascript(js_code)
+        _get_queue().add_params(params)
     except Exception as e:
         print(f"Yandex Metrika set_params error: {e}")
-        pass
-
-
@@ -1,15 +1,31 @@
 import os
+# Замеры запуска начинаются с импорта core.startup, поэтому он импортируется первым
+from core.startup import STARTUP, on_startup as on_serving
 from dotenv import load_dotenv
-from nicegui import ui
+from nicegui import app, ui
+STARTUP.checkpoint('nicegui_import')
 
 # Импорты из новых модулей
 from core.state import STATE
+from core.compute import start_lag_monitor, stop_compute
+from core.request_logger import stop_request_logger
+from core.prefetch import start_prefetch, stop_prefetch
+from core.fetch_workers import check_fetch_workers, start_fetch_workers, stop_fetch_workers
+from core.metrics import register_metrics_route
+from core.admin import register_admin_routes
+from core.api import register_api_routes
 from ui.settings import render_settings
 from ui.stats import render_stats
 from ui.top_posts import render_top_posts
 from ui.graphs import render_graphs
 from ui.posting_insights import render_posting_insights
+from ui.periods import render_periods
+from ui.portfolio import render_portfolio
 from ui.footer import render_footer
+from ui.assets import add_asset_links
+from ui.lazy_cards import CardLoader
+# pandas, matplotlib и Telethon здесь не импортируются — см. core/startup.py
+STARTUP.checkpoint('app_modules_import')
 
 # ------------------ CONFIG LOADING ----------------------
 def get_env_path():
@@ -20,29 +36,13 @@ def get_env_path():
 load_dotenv(get_env_path())
 API_ID = os.getenv('API_ID', '')
 API_HASH = os.getenv('API_HASH', '')
+STARTUP.checkpoint('config')
 
 
-# Стили в стиле других сайтов
+# Общие стили и скрипты подключаются как кешируемые статические файлы (web/assets)
+add_asset_links()
+
 ui.add_head_html('''
-    <style>
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', 'Roboto', 'Helvetica Neue', Arial, sans-serif;
-            background: #f9fafb; 
-            color: #111827;
-        }
-        .plots-grid {
-            display: grid;
-            grid-template-columns: repeat(2, 1fr);
-            gap: 20px;
-            width: 100%;
-        }
-        @media (max-width: 768px) {
-            .plots-grid {
-                grid-template-columns: 1fr !important;
-            }
-        }
-    </style>
-    
     <!-- Yandex.Metrika counter -->
     <script type="text/javascript">
         (function(m,e,t,r,i,k,a){
@@ -95,39 +95,8 @@ ui.add_head_html('''
                 }, 5000);
             }
         })();
-        
-        // Глобальная функция для отправки событий (инициализируется сразу)
-        (function() {
-            window._ymTrack = function(eventName, params) {
-                if (window.ym && typeof window.ym === 'function') {
-                    try {
-                        if (params && Object.keys(params).length > 0) {
-                            window.ym(106259012, 'reachGoal', eventName, params);
-                        } else {
-                            window.ym(106259012, 'reachGoal', eventName);
-                        }
-                        console.log('Yandex Metrika: tracked event', eventName, params || '');
-                    } catch(e) {
-                        console.warn('Yandex Metrika error:', e);
-                    }
-                } else {
-                    console.warn('Yandex Metrika: window.ym not available');
-                }
-            };
-            
-            window._ymSetParams = function(params) {
-                if (window.ym && typeof window.ym === 'function') {
-                    try {
-                        window.ym(106259012, 'params', params);
-                        console.log('Yandex Metrika: set params', params);
-                    } catch(e) {
-                        console.warn('Yandex Metrika error:', e);
-                    }
-                } else {
-                    console.warn('Yandex Metrika: window.ym not available');
-                }
-            };
-        })();
+
+        // Функции отправки событий — web/assets/metrika.js
     </script>
 
     <noscript>
@@ -141,6 +110,27 @@ ui.add_head_html('''
 
 # STATE импортирован из core.state
 
+# Монитор задержек event loop и исполнитель для тяжелых вычислений
+app.on_startup(start_lag_monitor)
+app.on_shutdown(stop_compute)
+# Очередь лога запросов дописывается на диск при остановке
+app.on_shutdown(stop_request_logger)
+# Процессы загрузки из Telegram (при FETCH_WORKERS > 0)
+check_fetch_workers()
+app.on_startup(start_fetch_workers)
+app.on_shutdown(stop_fetch_workers)
+# Предзагрузка популярных каналов в кеш постов
+app.on_startup(lambda: start_prefetch(API_ID, API_HASH))
+app.on_shutdown(stop_prefetch)
+# Метрики для Prometheus (маршрут /metrics)
+register_metrics_route()
+# Трассы запросов и профилирование для администратора (при заданном ADMIN_TOKEN)
+register_admin_routes()
+# JSON API статистики для внешних дашбордов (/api/...)
+register_api_routes(API_ID, API_HASH)
+# Отчет о времени запуска и прогрев (STARTUP_MODE=warm) после открытия порта
+app.on_startup(on_serving)
+
 # Инициализация UI
 with ui.column().classes('w-full items-center gap-6').style('padding: 40px 20px; max-width: 1400px; margin: 0 auto;'):
     with ui.column().classes('w-full items-center mb-8'):
@@ -150,15 +140,20 @@ with ui.column().classes('w-full items-center gap-6').style('padding: 40px 20px;
     # В NiceGUI порядок элементов в DOM определяется порядком их создания
     # Поэтому создаем settings первым, чтобы он отображался сверху
     
+    # Содержимое карточек вычисляется по мере их появления на экране
+    cards = CardLoader()
+    
     # Сначала создаем скрытые карточки (они нужны для settings)
-    stats_card, stats_container = render_stats()
-    top_posts_card = render_top_posts()
-    insights_card, insights_container = render_posting_insights()
-    graphs_card = render_graphs()
+    stats_card, stats_container = render_stats(cards)
+    top_posts_card = render_top_posts(cards)
+    insights_card, insights_container = render_posting_insights(cards)
+    graphs_card = render_graphs(cards)
+    periods_card = render_periods(API_ID, API_HASH, cards)
     
     
     # Затем создаем settings (он будет первым в DOM и отобразится сверху)
-    settings_card = render_settings(API_ID, API_HASH, stats_card, stats_container, graphs_card, top_posts_card, insights_card, insights_container)
+    settings_card = render_settings(API_ID, API_HASH, stats_card, stats_container, graphs_card, top_posts_card, insights_card, insights_container, cards,
+                                    periods_card=periods_card)
     
     # Перемещаем settings_card в начало DOM с помощью JavaScript
     # Это нужно, чтобы settings всегда был сверху, даже если создается после других карточек
@@ -206,10 +201,15 @@ with ui.column().classes('w-full items-center gap-6').style('padding: 40px 20px;
     </script>
     ''')
     
+    # Сравнение нескольких каналов (не зависит от карточек одного канала)
+    render_portfolio(API_ID, API_HASH)
+    
     # Footer в конце
     render_footer()
 
+STARTUP.checkpoint('page_build')
+
 # Запуск приложения
 # Примечание: index.html обслуживается веб-сервером (Nginx/Apache)
 # который проксирует запросы к NiceGUI на этом порту
-ui.run(title='Аналитика Телеграм-канала', host='127.0.0.1', port=8000, reload=False)
+ui.run(title='Аналитика Телеграм-канала', host='127.0.0.1', port=int(os.getenv('PORT', '8000')), reload=False)
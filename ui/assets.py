@@ -0,0 +1,51 @@
+"""
+Статические ресурсы интерфейса (стили и скрипты) из web/assets
+
+Файлы отдаются с долгим кешированием, а в URL добавляется хеш содержимого,
+поэтому после изменения файла браузер загрузит новую версию.
+"""
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+
+ASSETS_DIR = Path(__file__).parent.parent / 'web' / 'assets'
+ASSETS_URL = '/assets'
+ASSETS_MAX_AGE = 365 * 24 * 3600
+
+# Флаг регистрации маршрута статических файлов
+_assets_registered = False
+
+
+def register_assets():
+    """Регистрирует маршрут статических файлов (один раз на процесс)"""
+    global _assets_registered
+    if _assets_registered:
+        return
+
+    from nicegui import app
+
+    app.add_static_files(ASSETS_URL, ASSETS_DIR, max_cache_age=ASSETS_MAX_AGE)
+    _assets_registered = True
+
+
+@lru_cache(maxsize=None)
+def asset_url(name: str) -> str:
+    """
+    Возвращает относительный URL ресурса с версией по хешу содержимого.
+    Относительный путь работает и напрямую, и за прокси с префиксом /app.
+    """
+    version = hashlib.md5((ASSETS_DIR / name).read_bytes()).hexdigest()[:10]
+    return f"{ASSETS_URL.lstrip('/')}/{name}?v={version}"
+
+
+def add_asset_links():
+    """Подключает стили и скрипты к странице текущего клиента"""
+    register_assets()
+
+    from nicegui import ui
+
+    ui.add_head_html(
+        f'<link rel="stylesheet" href="{asset_url("analtg.css")}">\n'
+        f'<script src="{asset_url("analtg.js")}"></script>\n'
+        f'<script src="{asset_url("metrika.js")}"></script>'
+    )
@@ -0,0 +1,100 @@
+"""
+HTML-фрагменты: предкомпилированные шаблоны и дельта-обновления
+
+Шаблон размечает изменяемые значения атрибутом data-slot. Если новый фрагмент
+имеет ту же структуру, что и уже показанный клиенту, по websocket отправляются
+только изменившиеся значения слотов, а не весь HTML.
+"""
+import json
+import string
+import weakref
+from html import escape
+
+
+class Template:
+    """
+    Предкомпилированный HTML-шаблон с именованными слотами.
+
+    Слот `{name}` подставляет текст, слот `{name@attr}` — значение атрибута attr
+    элемента с data-slot="name". Значения экранируются при рендеринге.
+    """
+
+    def __init__(self, key: str, source: str):
+        self.key = key
+        # Отступы разметки не нужны в браузере — убираем их один раз при компиляции
+        self.source = '\n'.join(filter(None, (line.strip() for line in source.splitlines())))
+        self.slots = tuple(
+            field for _, field, _, _ in string.Formatter().parse(self.source) if field
+        )
+        self._format = self.source.format
+
+    def render(self, values: dict) -> str:
+        """Рендерит шаблон с указанными значениями слотов"""
+        return self._format(**{slot: escape(str(values.get(slot, ''))) for slot in self.slots})
+
+    def __reduce__(self):
+        # Шаблоны передаются в процессы-исполнители по ключу и исходнику
+        return (Template, (self.key, self.source))
+
+
+class _FragmentState:
+    """Последний показанный клиенту фрагмент"""
+
+    def __init__(self):
+        self.key = None
+        self.values = {}
+        self.revision = 0
+
+
+_states = weakref.WeakKeyDictionary()
+
+
+def show_fragment(element, template: Template, values: dict) -> None:
+    """
+    Показывает фрагмент в ui.html-элементе.
+
+    При совпадении структуры с уже показанным фрагментом отправляет клиенту только
+    изменившиеся значения, иначе отправляет весь HTML.
+
+    Args:
+        element: Элемент ui.html
+        template: Шаблон фрагмента
+        values: Значения слотов
+    """
+    state = _states.get(element)
+    if state is None:
+        state = _states[element] = _FragmentState()
+
+    values = {slot: str(values.get(slot, '')) for slot in template.slots}
+
+    if state.key == template.key:
+        changed = {slot: value for slot, value in values.items() if state.values.get(slot) != value}
+        state.values = values
+        if not changed:
+            return
+        # Синхронизируем серверное состояние без отправки, чтобы переподключившийся
+        # клиент получил актуальный HTML, а клиенту отправляем только изменения
+        with element._props.suspend_updates():
+            element.content = _wrap(template.render(values), state.revision)
+        element.client.run_javascript(f'window.analtgPatch && analtgPatch({element.id}, {json.dumps(changed, ensure_ascii=False)})')
+        return
+
+    # Новая структура: ревизия гарантирует, что HTML отличается от ранее показанного
+    # (клиентский компонент пропускает рендеринг совпадающего HTML)
+    state.revision += 1
+    state.key = template.key
+    state.values = values
+    element.content = _wrap(template.render(values), state.revision)
+
+
+def clear_fragment(element, html: str = '') -> None:
+    """Показывает в элементе произвольный HTML вне шаблонов (пустое состояние, ошибка)"""
+    state = _states.get(element)
+    if state is not None:
+        state.key = None
+        state.values = {}
+    element.content = html
+
+
+def _wrap(html: str, revision: int) -> str:
+    return f'<div class="fragment" data-rev="{revision}">{html}</div>'
@@ -1,39 +1,22 @@
 """
 UI компонент: Блок графиков
 """
-import datetime
-import pandas as pd
-import matplotlib.pyplot as plt
 import tempfile
 from nicegui import ui
-from core.state import STATE
-from core.analytics import agg_period, period_by_rus
+from core.analytics import aggregate_by_period, period_by_rus
+from core.tracing import start_trace
 
 
 def plot_stat_all(posts, start_date, end_date, period):
-    """Генерирует графики для всех метрик"""
-    df = pd.DataFrame(posts)
-    if df.empty:
+    """
+    Генерирует графики для всех метрик.
+    Использует объектный API matplotlib (без pyplot), поэтому безопасна для вызова из потоков.
+    """
+    # pandas и matplotlib импортируются при первом построении (см. core/startup.py)
+    from matplotlib.figure import Figure
+    grouped = aggregate_by_period(posts, period)
+    if grouped.empty:
         return []
-    df = agg_period(df, period)
-    grouped = df.groupby('period').agg({
-        'likes': 'sum',
-        'comments': 'sum',
-        'reposts': 'sum',
-        'views': 'sum',
-        'id': 'count'
-    }).rename(columns={'id':'posts'}).reset_index()
-    grouped = grouped.sort_values("period")
-    er_values = []
-    likes = grouped["likes"].tolist()
-    comments = grouped["comments"].tolist()
-    reposts = grouped["reposts"].tolist()
-    views = grouped["views"].tolist()
-    for i in range(len(grouped)):
-        t_eng = likes[i] + comments[i] + reposts[i]
-        er = t_eng / views[i] * 100 if views[i] > 0 else 0
-        er_values.append(er)
-    grouped['ER'] = er_values
 
     imgs = []
     colors = ['#3778bf', '#ffa600', '#43aa8b', '#590d22', '#1e88e5', '#e74c3c']
@@ -47,7 +30,8 @@ def plot_stat_all(posts, start_date, end_date, period):
     ]
 
     for fld, lbl, clr in fields:
-        fig, ax = plt.subplots(figsize=(7, 2.35))
+        fig = Figure(figsize=(7, 2.35))
+        ax = fig.subplots()
         x = grouped["period"].astype(str).tolist()
         ys = grouped[fld].tolist()
         ax.plot(x, ys, marker='o', color=clr)
@@ -55,17 +39,21 @@ def plot_stat_all(posts, start_date, end_date, period):
         ax.set_xlabel(period_by_rus(period))
         ax.set_ylabel(lbl)
         ax.grid(True, alpha=0.23)
-        plt.xticks(rotation=30)
-        plt.tight_layout()
+        ax.tick_params(axis='x', labelrotation=30)
+        fig.tight_layout()
         fn = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-        plt.savefig(fn.name, bbox_inches='tight', dpi=100)
-        plt.close(fig)
+        fig.savefig(fn.name, bbox_inches='tight', dpi=100)
         imgs.append(fn.name)
     return imgs
 
 
-def render_graphs():
-    """Рендерит блок графиков"""
+def render_graphs(card_loader=None):
+    """
+    Рендерит блок графиков
+    
+    Args:
+        card_loader: CardLoader клиента; открытые графики перестраиваются, когда карточка видна
+    """
     graphs_card = ui.card().classes('w-full').style(
         'background: #fff; border: 1px solid #e5e7eb; border-radius: 16px; padding: 32px; max-width: 1200px; display: none;'
     )
@@ -85,18 +73,27 @@ def render_graphs():
             )
         
         plot_zone = ui.column().classes('w-full mt-6')
+        # Пользователь уже открывал графики — для новых данных их стоит перестроить
+        plots_opened = False
         
-        def on_plot():
-            if not STATE.posts:
+        async def on_plot():
+            nonlocal plots_opened
+            # Посты и период, загруженные этим клиентом (не общий STATE)
+            data = card_loader.data if card_loader else None
+            params = card_loader.params if card_loader else None
+            if not data or not data['posts'] or not params:
                 plot_zone.clear()
                 with plot_zone:
                     ui.label("Пока нет данных. Получите статистику выше.").classes('text-red-600')
                 return
             period_map = {7: 'week', 30: 'month', 90: 'quarter'}
             period = period_map.get(aggr_combo.value, 'week')
-            start_date = STATE.last_fetch_params.get("start_date", (datetime.date.today().replace(year=datetime.date.today().year - 1)).strftime("%Y-%m-%d"))
-            end_date = STATE.last_fetch_params.get("end_date", datetime.date.today().strftime("%Y-%m-%d"))
-            files = plot_stat_all(STATE.posts, start_date, end_date, period)
+            start_date = params['start_date']
+            end_date = params['end_date']
+            plots_opened = True
+            with start_trace('plot', period=period, posts=len(data['posts'])):
+                # Повторный выбор периода агрегации для тех же данных берется из кеша
+                files = await card_loader.cached(('graphs', period), plot_stat_all, data['posts'], start_date, end_date, period)
             plot_zone.clear()
             if files:
                 # Названия графиков для скачивания
@@ -151,5 +148,13 @@ def render_graphs():
                     ui.label("Нет доступных графиков.").classes('text-red-600')
         btn_plot.on('click', on_plot)
     
+    if card_loader:
+        async def load_graphs(params):
+            # Графики строятся по кнопке; после смены данных открытые графики
+            # перестраиваются, только когда карточка становится видимой
+            if plots_opened:
+                await on_plot()
+        card_loader.add('graphs', graphs_card, load_graphs)
+    
     return graphs_card
 
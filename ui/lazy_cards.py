@@ -0,0 +1,161 @@
+"""
+Ленивое вычисление содержимого карточек дашборда
+
+Карточка вычисляется, когда становится видимой в браузере (IntersectionObserver
+в web/assets/analtg.js сообщает об этом событием analtg_card_visible).
+Результаты кешируются для текущих параметров, а незавершенные вычисления
+отменяются, если параметры изменились раньше.
+"""
+import sys
+import time
+import asyncio
+from collections import OrderedDict
+from nicegui import ui
+from core.compute import run_compute
+from core.metrics import CARD_RENDER_DURATION
+from core.tracing import start_trace
+
+# Сколько результатов вычислений хранить в кеше одного клиента
+CACHE_SIZE = 32
+
+
+class CardLoader:
+    """Ленивая загрузка карточек одного клиента"""
+
+    def __init__(self):
+        self._cards = {}
+        self._loaders = {}
+        self._eager = set()
+        self._visible = set()
+        self._params = None
+        self._params_key = None
+        self._data = None
+        self._rendered = {}
+        self._tasks = {}
+        self._cache = OrderedDict()
+
+        client = ui.context.client
+        ui.on('analtg_card_visible', self._handle_visibility)
+        client.on_connect(lambda: client.run_javascript('window.analtgObserveCards && analtgObserveCards()'))
+
+    @property
+    def params(self):
+        """Текущие параметры (None, если данных нет)"""
+        return self._params
+
+    @property
+    def data(self):
+        """Данные, загруженные для текущих параметров этим клиентом (None, если данных нет)"""
+        return self._data
+
+    def add(self, name: str, card, loader, eager: bool = False):
+        """
+        Регистрирует карточку.
+
+        Args:
+            name: Имя карточки
+            card: Элемент карточки (за его видимостью следит браузер)
+            loader: Корутина loader(params), вычисляющая и отображающая содержимое
+            eager: Вычислять сразу после смены параметров, не дожидаясь видимости
+        """
+        card.props(f'data-lazy-card={name}')
+        self._cards[name] = card
+        self._loaders[name] = loader
+        if eager:
+            self._eager.add(name)
+
+    def set_params(self, params, data=None):
+        """
+        Устанавливает параметры, для которых вычисляются карточки.
+        Отменяет вычисления для прежних параметров; None означает «данных нет».
+
+        Args:
+            params: dict с параметрами (channel, start_date, end_date, ...) или None
+            data: dict с загруженными для params постами (posts, previous_posts):
+                карточки клиента берут их отсюда, а не из общего STATE
+        """
+        key = tuple(sorted(params.items())) if params else None
+        if key == self._params_key:
+            return
+        self._data = data if key is not None else None
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        self._rendered.clear()
+        self._cache.clear()
+        self._params = dict(params) if params else None
+        self._params_key = key
+        if key is not None:
+            # Прежнее содержимое остается на месте (для дельта-обновлений), но помечается
+            # как устаревшее до завершения вычисления
+            for card in self._cards.values():
+                card.classes(add='card-loading')
+            for name in self._eager | self._visible:
+                self.request(name)
+
+    def request(self, name: str, force: bool = False):
+        """
+        Запускает вычисление карточки, если оно еще не выполнено для текущих параметров.
+
+        Args:
+            name: Имя карточки
+            force: Перевычислить, даже если карточка уже отображена
+        """
+        if self._params_key is None or name not in self._loaders:
+            return
+        running = self._tasks.get(name)
+        if running is not None and not running.done():
+            if not force:
+                return
+            running.cancel()
+        if not force and self._rendered.get(name) == self._params_key:
+            return
+        self._tasks[name] = asyncio.create_task(self._load(name, self._params_key))
+
+    async def _load(self, name: str, key):
+        started = time.perf_counter()
+        try:
+            # Задача запущена из запроса загрузки и наследует его request_id
+            with start_trace(f'card:{name}'):
+                await self._loaders[name](self._params)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error loading card {name}: {e}", file=sys.stderr)
+            return
+        CARD_RENDER_DURATION.observe(time.perf_counter() - started, name)
+        if key == self._params_key:
+            self._rendered[name] = key
+            self._cards[name].classes(remove='card-loading')
+
+    async def cached(self, key, func, *args):
+        """
+        Возвращает результат func(*args) для текущих параметров из кеша
+        или вычисляет его в исполнителе (core.compute).
+
+        Args:
+            key: Ключ результата в пределах текущих параметров
+            func: Функция вычисления
+            *args: Аргументы функции
+        """
+        cache_key = (self._params_key, key)
+        if cache_key in self._cache:
+            self._cache.move_to_end(cache_key)
+            return self._cache[cache_key]
+        result = await run_compute(func, *args)
+        # Параметры могли смениться, пока шло вычисление — такой результат не кешируем
+        if cache_key[0] == self._params_key:
+            self._cache[cache_key] = result
+            while len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return result
+
+    def _handle_visibility(self, e):
+        name = e.args.get('card') if isinstance(e.args, dict) else None
+        if name not in self._loaders:
+            return
+        if e.args.get('visible'):
+            self._visible.add(name)
+            self.request(name)
+        else:
+            self._visible.discard(name)
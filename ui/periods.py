@@ -0,0 +1,89 @@
+"""
+UI компонент: Сравнение периодов (MoM, YoY, последние недели)
+"""
+from html import escape
+from nicegui import ui
+from core.analytics import delta_direction, format_metric
+from core.periods import PERIOD_SPECS, compare_many, fetch_periods, resolve_periods
+from ui.fragments import clear_fragment
+
+# Столбцы таблицы: (поле, подпись, формат значения)
+PERIOD_COLUMNS = [
+    ('posts', "Постов", format_metric),
+    ('views', "Просмотров", format_metric),
+    ('likes', "Лайков", format_metric),
+    ('comments', "Комментариев", format_metric),
+    ('reposts', "Репостов", format_metric),
+    ('avg_er', "Средний ER", lambda v: f"{v:.2f}%"),
+]
+
+DEFAULT_SPECS = ['previous', 'year_ago', 'weeks:4']
+
+
+def periods_html(rows: list) -> str:
+    """Компактная таблица: значения периодов и дельты к базовым периодам"""
+    head = ''.join(f'<th>{label}</th>' for _, label, _ in PERIOD_COLUMNS)
+    body = []
+    for row in rows:
+        tds = []
+        for field, _, fmt in PERIOD_COLUMNS:
+            delta = ''
+            if row['deltas']:
+                d = row['deltas'][field]
+                direction, icon, percent_str = delta_direction(d['absolute'], d['percent'])
+                delta = f'<div class="delta {direction}"><span class="delta-icon">{icon}</span>{percent_str}</div>'
+            tds.append(f'<td>{fmt(row["metrics"][field])}{delta}</td>')
+        period = f"{row['start_date']} — {row['end_date']}"
+        body.append(
+            f'<tr><th>{escape(row["label"])}<div class="periods-range">{period}</div></th>{"".join(tds)}</tr>'
+        )
+    return f'<div class="periods"><table class="periods-table"><tr><th></th>{head}</tr>{"".join(body)}</table></div>'
+
+
+def render_periods(api_id, api_hash, card_loader):
+    """
+    Рендерит блок сравнения нескольких периодов
+
+    Args:
+        api_id: API ID Telegram
+        api_hash: API Hash Telegram
+        card_loader: CardLoader клиента; сравнение вычисляется, когда карточка видна
+    """
+    periods_card = ui.card().classes('w-full').style(
+        'background: #fff; border: 1px solid #e5e7eb; border-radius: 16px; padding: 32px; max-width: 1200px; display: none;'
+    )
+    client_key = ui.context.client.id
+
+    with periods_card:
+        ui.label('Сравнение периодов').classes('text-xl font-semibold mb-2').style('color: #111827;')
+        ui.label(
+            'Текущий период против предыдущего, прошлогоднего и последних недель'
+        ).classes('text-sm mb-4').style('color: #6b7280;')
+        specs_select = ui.select(
+            PERIOD_SPECS, value=list(DEFAULT_SPECS), multiple=True, label='Сравнить с'
+        ).classes('w-full mb-4').props('use-chips')
+        periods_container = ui.html('', sanitize=False).classes('w-full')
+
+    async def load(params):
+        # Посты, загруженные этим клиентом для params (общий STATE могли перезаписать другие клиенты)
+        data = card_loader.data
+        if not params or not data or not data['posts']:
+            return
+        specs = [spec for spec in PERIOD_SPECS if spec in (specs_select.value or [])]
+        periods = resolve_periods(params['start_date'], params['end_date'], specs)
+        # Посты текущего (и предыдущего) периода уже загружены — догружается только остальное
+        known_posts = list(data['posts'])
+        known_ranges = [(params['start_date'], params['end_date'])]
+        if params.get('prev_start'):
+            known_posts += data['previous_posts']
+            known_ranges.append((params['prev_start'], params['prev_end']))
+        posts = await fetch_periods(
+            api_id, api_hash, params['channel'], periods, known_posts=known_posts, known_ranges=known_ranges,
+            client_key=client_key
+        )
+        rows = await card_loader.cached(('periods', tuple(specs)), compare_many, posts, periods)
+        clear_fragment(periods_container, periods_html(rows))
+
+    specs_select.on_value_change(lambda: card_loader.request('periods', force=True))
+    card_loader.add('periods', periods_card, load)
+    return periods_card
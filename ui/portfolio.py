@@ -0,0 +1,177 @@
+"""
+UI компонент: Сравнение каналов (портфель)
+"""
+import asyncio
+import datetime
+from html import escape
+from nicegui import ui
+from core.analytics import format_metric
+from core.compute import run_compute
+from core.portfolio import (
+    GRID_BLOCKS, GRID_HOURS, PORTFOLIO_MAX_CHANNELS, fetch_portfolio, parse_channels, portfolio_stats,
+)
+from core.services import extract_channel_username
+from core.tracing import new_request_id, start_trace
+from core.yandex_metrika import track
+from ui.fragments import clear_fragment
+
+
+# Строки таблицы: (подпись, поле, формат)
+PORTFOLIO_ROWS = [
+    ("Постов", 'posts', format_metric),
+    ("Просмотров", 'views', format_metric),
+    ("Просмотров на пост", 'avg_views', lambda v: format_metric(int(round(v)))),
+    ("Лайков", 'likes', format_metric),
+    ("Комментариев", 'comments', format_metric),
+    ("Репостов", 'reposts', format_metric),
+    ("Средний ER", 'avg_er', lambda v: f"{v:.2f}%"),
+]
+
+DAY_SHORT = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+
+
+def _grid_html(cells: dict) -> str:
+    """Сетка «день недели x часы»: насыщенность ячейки — средний ER относительно лучшей ячейки канала"""
+    best = max((cell['avg_er'] for cell in cells.values()), default=0)
+    header = ''.join(
+        f'<th>{block * GRID_HOURS:02d}</th>' for block in range(GRID_BLOCKS)
+    )
+    rows = []
+    for day, day_name in enumerate(DAY_SHORT):
+        tds = []
+        for block in range(GRID_BLOCKS):
+            cell = cells.get((day, block))
+            if not cell:
+                tds.append('<td class="empty"></td>')
+                continue
+            alpha = 0.1 + 0.9 * (cell['avg_er'] / best) if best else 0.1
+            title = (f"{day_name} {block * GRID_HOURS:02d}:00–{(block + 1) * GRID_HOURS:02d}:00: "
+                     f"постов {cell['posts']}, ER {cell['avg_er']:.2f}%, просмотров {cell['avg_views']:.0f}")
+            tds.append(f'<td style="background: rgba(5, 150, 105, {alpha:.2f});" title="{escape(title)}"></td>')
+        rows.append(f'<tr><th>{day_name}</th>{"".join(tds)}</tr>')
+    return f'<table class="portfolio-grid"><tr><th></th>{header}</tr>{"".join(rows)}</table>'
+
+
+def portfolio_html(posts_by_channel: dict, errors: dict, channels: list) -> str:
+    """Таблица метрик каналов рядом и сетки времени публикаций (вычисления — один проход по всем каналам)"""
+    stats = portfolio_stats(posts_by_channel)
+    summary, grids = stats['summary'], stats['grids']
+    names = [escape('@' + extract_channel_username(channel)) for channel in channels]
+    head = ''.join(f'<th>{name}</th>' for name in names)
+    rows = []
+    for label, field, fmt in PORTFOLIO_ROWS:
+        values = [summary[channel][field] for channel in channels if channel in summary]
+        best = max(values) if values and max(values) > 0 else None
+        tds = []
+        for channel in channels:
+            if channel not in summary:
+                tds.append('<td class="error">—</td>')
+                continue
+            value = summary[channel][field]
+            css = ' class="best"' if value == best else ''
+            tds.append(f'<td{css}>{fmt(value)}</td>')
+        rows.append(f'<tr><th>{label}</th>{"".join(tds)}</tr>')
+    table = f'<table class="portfolio-table"><tr><th></th>{head}</tr>{"".join(rows)}</table>'
+
+    grid_cards = []
+    for channel, name in zip(channels, names):
+        if channel in errors:
+            body = f'<div class="error-state">Ошибка загрузки: {escape(errors[channel])}</div>'
+        elif not summary[channel]['posts']:
+            body = '<div class="empty-state">Нет постов за период</div>'
+        else:
+            body = _grid_html(grids[channel])
+        grid_cards.append(f'<div class="portfolio-channel"><div class="portfolio-channel-title">{name}</div>{body}</div>')
+    return (
+        f'<div class="portfolio">{table}'
+        f'<div class="insights-title">Время публикаций и ER</div>'
+        f'<div class="portfolio-grids">{"".join(grid_cards)}</div></div>'
+    )
+
+
+def render_portfolio(api_id, api_hash):
+    """Рендерит блок сравнения нескольких каналов за один период"""
+    today = datetime.date.today()
+    portfolio_card = ui.card().classes('w-full').style(
+        'background: #fff; border: 1px solid #e5e7eb; border-radius: 16px; padding: 32px; max-width: 1200px;'
+    )
+
+    with portfolio_card:
+        ui.label('Сравнение каналов').classes('text-xl font-semibold mb-2').style('color: #111827;')
+        ui.label(
+            f'Канал клиента и конкуренты за один период (до {PORTFOLIO_MAX_CHANNELS} каналов)'
+        ).classes('text-sm mb-4').style('color: #6b7280;')
+        channels_input = ui.textarea(
+            'Каналы (по одному в строке)', placeholder='@channel_one\n@channel_two'
+        ).classes('w-full mb-4').props('autogrow')
+        with ui.row().classes('w-full gap-4'):
+            date_from = ui.input(
+                label='Дата от (YYYY-MM-DD)',
+                value=(today - datetime.timedelta(days=89)).strftime('%Y-%m-%d')
+            ).classes('flex-1')
+            date_to = ui.input(label='Дата до (YYYY-MM-DD)', value=today.strftime('%Y-%m-%d')).classes('flex-1')
+        compare_button = ui.button('Сравнить каналы', color='primary').classes('w-full mt-2').style(
+            'background: #111827; color: #fff; font-weight: 600; padding: 10px 24px; border-radius: 8px; font-size: 16px;'
+        )
+        progress_label = ui.label('').style('color: #059669; font-size: 14px; font-weight: 500;')
+        result_container = ui.html('', sanitize=False).classes('w-full mt-4')
+
+    current = None
+    client_key = ui.context.client.id
+
+    def cancel_current():
+        if current is not None and not current.done():
+            current.cancel()
+
+    # Закрытая вкладка не должна продолжать загрузку
+    ui.context.client.on_delete(cancel_current)
+
+    async def on_compare():
+        nonlocal current
+        channels = parse_channels(channels_input.value)
+        d_from = date_from.value.strip()
+        d_to = date_to.value.strip()
+        if len(channels) < 2:
+            progress_label.text = "⛔ Укажите хотя бы два канала"
+            return
+        if len(channels) > PORTFOLIO_MAX_CHANNELS:
+            progress_label.text = f"⛔ Не больше {PORTFOLIO_MAX_CHANNELS} каналов"
+            return
+        try:
+            if datetime.datetime.strptime(d_from, '%Y-%m-%d') > datetime.datetime.strptime(d_to, '%Y-%m-%d'):
+                progress_label.text = "⛔ Дата 'от' не должна быть позже даты 'до'"
+                return
+        except ValueError:
+            progress_label.text = "⛔ Проверьте формат дат (YYYY-MM-DD)"
+            return
+
+        track('compare_channels', {'channels': len(channels)})
+        request_id = new_request_id()
+        current = asyncio.current_task()
+        compare_button.disable()
+        progress_label.text = f"⏳ Загрузка каналов: 0 из {len(channels)}"
+
+        def on_progress(done, total):
+            progress_label.text = f"⏳ Загрузка каналов: {done} из {total}"
+
+        try:
+            with start_trace('portfolio', request_id=request_id, channels=len(channels),
+                             start_date=d_from, end_date=d_to):
+                posts_by_channel, errors = await fetch_portfolio(
+                    api_id, api_hash, channels, d_from, d_to, client_key=client_key, on_progress=on_progress
+                )
+                html = await run_compute(portfolio_html, posts_by_channel, errors, channels)
+            clear_fragment(result_container, html)
+            failed = f", с ошибкой: {len(errors)}" if errors else ""
+            progress_label.text = f"✅ Каналов: {len(channels)}{failed}"
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            clear_fragment(result_container)
+            progress_label.text = f"⛔ Ошибка: {str(e)} (запрос {request_id})"
+        finally:
+            current = None
+            compare_button.enable()
+
+    compare_button.on('click', on_compare)
+    return portfolio_card
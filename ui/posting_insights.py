@@ -1,10 +1,11 @@
 """
 UI компонент: Блок инсайтов о времени публикаций
 """
-import datetime
+from functools import lru_cache
 from nicegui import ui
-from core.state import STATE
 from core.posting_insights import analyze_posting_times
+from core.analytics import filter_posts_by_period
+from ui.fragments import Template, show_fragment
 
 
 def format_percent_diff(percent_diff: float, metric_type: str) -> str:
@@ -21,8 +22,73 @@ def format_percent_diff(percent_diff: float, metric_type: str) -> str:
             return f"на {abs(percent_diff):.1f}% ниже вовлечённости"
 
 
-def render_posting_insights():
-    """Рендерит блок инсайтов о времени публикаций"""
+INSUFFICIENT_TEMPLATE = Template('insights_insufficient', """<div class="insights-container">
+    <div class="insufficient-data">
+        <div class="insufficient-title">Недостаточно данных</div>
+        <div class="insufficient-text" data-slot="message">{message}</div>
+        <div class="insufficient-meta">
+            Постов: <span data-slot="posts_count">{posts_count}</span> |
+            Период: <span data-slot="days_range">{days_range}</span> дней
+        </div>
+    </div>
+</div>""")
+
+MESSAGE_TEMPLATE = Template('insights_message', """<div class="insights-container">
+    <div class="insufficient-data">
+        <div class="insufficient-text" data-slot="message">{message}</div>
+    </div>
+</div>""")
+
+# Карточки инсайтов: (слот, подпись, класс строки разницы)
+BEST_CARDS = [
+    ('best_views', 'Для просмотров', 'insight-diff'),
+    ('best_er', 'Для ER (вовлечённости)', 'insight-diff'),
+]
+NEGATIVE_CARDS = [
+    ('worst_views', 'Минимальный охват', 'insight-diff muted'),
+    ('worst_er', 'Минимальная ER', 'insight-diff muted'),
+]
+
+_CARD_TEMPLATE = """
+            <div class="insight-card">
+                <div class="insight-metric-label">{label}</div>
+                <div class="insight-main-value" data-slot="{key}_when">{{{key}_when}}</div>
+                <div class="{diff_class}" data-slot="{key}_diff">{{{key}_diff}}</div>
+                <div class="insight-meta" data-slot="{key}_meta">{{{key}_meta}}</div>
+            </div>"""
+
+_SECTION_TEMPLATE = """
+    <section class="{section_class}">
+        <div class="insights-title">{title}</div>
+        <div class="insights-grid">{cards}
+        </div>
+    </section>"""
+
+
+@lru_cache(maxsize=None)
+def insights_template(cards: tuple) -> Template:
+    """Возвращает (компилируемый один раз) шаблон инсайтов для указанного набора карточек"""
+    sections = []
+    for section_class, title, config in [
+        ('insights-section', 'Лучшее время публикаций', BEST_CARDS),
+        ('insights-section insights-negative', 'Когда лучше не публиковать контент', NEGATIVE_CARDS),
+    ]:
+        section_cards = ''.join(
+            _CARD_TEMPLATE.format(key=key, label=label, diff_class=diff_class)
+            for key, label, diff_class in config if key in cards
+        )
+        if section_cards:
+            sections.append(_SECTION_TEMPLATE.format(section_class=section_class, title=title, cards=section_cards))
+    return Template(f"insights:{','.join(cards)}", f'<div class="insights-container">{"".join(sections)}\n</div>')
+
+
+def render_posting_insights(card_loader=None):
+    """
+    Рендерит блок инсайтов о времени публикаций
+    
+    Args:
+        card_loader: CardLoader клиента; инсайты вычисляются, когда карточка видна
+    """
     insights_card = ui.card().classes('w-full').style(
         'background: #fff; border: 1px solid #e5e7eb; border-radius: 16px; padding: 32px; max-width: 1200px; display: none;'
     )
@@ -35,244 +101,86 @@ def render_posting_insights():
         # Контейнер для инсайтов
         insights_container = ui.html('', sanitize=False).classes('w-full')
     
+    if card_loader:
+        card_loader.add('insights', insights_card, lambda params: update_posting_insights(insights_container, card_loader, params))
+    
     return insights_card, insights_container
 
 
-def update_posting_insights(insights_container):
-    """Обновляет отображение инсайтов"""
-    if not STATE.posts or not insights_container:
+async def update_posting_insights(insights_container, card_loader, params):
+    """Обновляет отображение инсайтов по постам, загруженным клиентом для params (анализ вне event loop)"""
+    data = card_loader.data
+    if not data or not data['posts'] or not insights_container:
         return
     
-    start_date = STATE.last_fetch_params.get("start_date", "")
-    end_date = STATE.last_fetch_params.get("end_date", "")
+    start_date = params.get("start_date", "")
+    end_date = params.get("end_date", "")
     if not start_date or not end_date:
         return
     
+    template, values = await card_loader.cached('insights', posting_insights_fragment, data['posts'], start_date, end_date)
+    show_fragment(insights_container, template, values)
+
+
+def posting_insights_fragment(posts, start_date, end_date):
+    """
+    Анализирует время публикаций и формирует фрагмент с инсайтами.
+    
+    Args:
+        posts: Список всех постов
+        start_date: Начало периода (YYYY-MM-DD)
+        end_date: Конец периода (YYYY-MM-DD)
+    
+    Returns:
+        tuple: (Template, dict значений слотов)
+    """
     # Фильтруем посты по периоду
-    start = datetime.datetime.strptime(start_date, "%Y-%m-%d").date()
-    end = datetime.datetime.strptime(end_date, "%Y-%m-%d").date()
-    selected_posts = [
-        post for post in STATE.posts
-        if start <= datetime.datetime.strptime(post['date'], "%Y-%m-%d").date() <= end
-    ]
+    selected_posts = filter_posts_by_period(posts, start_date, end_date)
     
     # Анализируем время публикаций
     analysis = analyze_posting_times(selected_posts)
     
-    # CSS стили
-    css_styles = """
-    <style>
-        .insights-container {
-            max-width: 1200px;
-            margin: 0 auto;
-        }
-        .insights-section {
-            margin-bottom: 40px;
-        }
-        .insights-title {
-            font-size: 18px;
-            font-weight: 700;
-            color: #111827;
-            margin-bottom: 20px;
-        }
-        .insights-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(280px, 1fr));
-            gap: 16px;
-        }
-        .insight-card {
-            background: #ffffff;
-            border: 1px solid #e5e7eb;
-            border-radius: 12px;
-            padding: 20px;
-            display: flex;
-            flex-direction: column;
-        }
-        .insight-metric-label {
-            font-size: 12px;
-            font-weight: 500;
-            color: #6b7280;
-            text-transform: uppercase;
-            letter-spacing: 0.5px;
-            margin-bottom: 12px;
-        }
-        .insight-main-value {
-            font-size: 18px;
-            font-weight: 700;
-            color: #111827;
-            margin-bottom: 8px;
-            line-height: 1.4;
-        }
-        .insight-diff {
-            font-size: 14px;
-            font-weight: 600;
-            color: #059669;
-            margin-bottom: 12px;
-        }
-        .insight-meta {
-            font-size: 12px;
-            color: #6b7280;
-            margin-top: auto;
-            padding-top: 12px;
-            border-top: 1px solid #f3f4f6;
-        }
-        .insights-negative {
-            margin-top: 40px;
-        }
-        .insufficient-data {
-            background: #ffffff;
-            border: 1px solid #e5e7eb;
-            border-radius: 12px;
-            padding: 20px;
-            text-align: center;
-        }
-        .insufficient-title {
-            font-size: 16px;
-            font-weight: 600;
-            color: #111827;
-            margin-bottom: 8px;
-        }
-        .insufficient-text {
-            font-size: 14px;
-            color: #6b7280;
-            margin-bottom: 8px;
-        }
-        .insufficient-meta {
-            font-size: 12px;
-            color: #9ca3af;
-        }
-        @media (max-width: 768px) {
-            .insights-grid {
-                grid-template-columns: 1fr;
-            }
-        }
-    </style>
-    """
-    
     if not analysis.get('has_data', False):
         message = analysis.get('message', 'Нет данных для анализа')
         if analysis.get('insufficient_data', False):
-            html = f"""
-            {css_styles}
-            <div class="insights-container">
-                <div class="insufficient-data">
-                    <div class="insufficient-title">Недостаточно данных</div>
-                    <div class="insufficient-text">{message}</div>
-                    <div class="insufficient-meta">
-                        Постов: {analysis.get('posts_count', 0)} | 
-                        Период: {analysis.get('days_range', 0)} дней
-                    </div>
-                </div>
-            </div>
-            """
-        else:
-            html = f"""
-            {css_styles}
-            <div class="insights-container">
-                <div class="insufficient-data">
-                    <div class="insufficient-text">{message}</div>
-                </div>
-            </div>
-            """
-        insights_container.content = html
-        return
+            return INSUFFICIENT_TEMPLATE, {
+                'message': message,
+                'posts_count': analysis.get('posts_count', 0),
+                'days_range': analysis.get('days_range', 0),
+            }
+        return MESSAGE_TEMPLATE, {'message': message}
     
-    # Формируем HTML с инсайтами
-    sections = []
+    values = {}
     
     # 1. Блок "Лучшее время публикаций"
-    best_cards = []
-    
     # Лучшее время для охвата
     if analysis.get('best_views'):
         best_views = analysis['best_views'][0]
-        percent_diff = best_views['percent_diff']
-        diff_text = format_percent_diff(percent_diff, 'views')
-        
-        best_cards.append(f"""
-        <div class="insight-card">
-            <div class="insight-metric-label">Для просмотров</div>
-            <div class="insight-main-value">{best_views['day']}, {best_views['time_range']}</div>
-            <div class="insight-diff">{diff_text}</div>
-            <div class="insight-meta">
-                Среднее: {best_views['value']:.0f} просмотров · Постов: {best_views['posts_count']}
-            </div>
-        </div>
-        """)
+        values['best_views_when'] = f"{best_views['day']}, {best_views['time_range']}"
+        values['best_views_diff'] = format_percent_diff(best_views['percent_diff'], 'views')
+        values['best_views_meta'] = f"Среднее: {best_views['value']:.0f} просмотров · Постов: {best_views['posts_count']}"
     
     # Лучшее время для вовлечённости
     if analysis.get('best_er'):
         best_er = analysis['best_er'][0]
-        percent_diff = best_er['percent_diff']
-        diff_text = format_percent_diff(percent_diff, 'er')
-        
-        best_cards.append(f"""
-        <div class="insight-card">
-            <div class="insight-metric-label">Для ER (вовлечённости)</div>
-            <div class="insight-main-value">{best_er['day']}, {best_er['time_range']}</div>
-            <div class="insight-diff">{diff_text}</div>
-            <div class="insight-meta">
-                Средний ER: {best_er['value']:.2f}% · Постов: {best_er['posts_count']}
-            </div>
-        </div>
-        """)
-    
-    if best_cards:
-        sections.append(f"""
-        <section class="insights-section">
-            <div class="insights-title">Лучшее время публикаций</div>
-            <div class="insights-grid">
-                {''.join(best_cards)}
-            </div>
-        </section>
-        """)
+        values['best_er_when'] = f"{best_er['day']}, {best_er['time_range']}"
+        values['best_er_diff'] = format_percent_diff(best_er['percent_diff'], 'er')
+        values['best_er_meta'] = f"Средний ER: {best_er['value']:.2f}% · Постов: {best_er['posts_count']}"
     
     # 2. Блок "Когда лучше не публиковать контент"
-    negative_cards = []
-    
     if analysis.get('worst_views'):
         worst_views = analysis['worst_views'][0]
-        negative_cards.append(f"""
-        <div class="insight-card">
-            <div class="insight-metric-label">Минимальный охват</div>
-            <div class="insight-main-value">{worst_views['day']}, {worst_views['time_range']}</div>
-            <div class="insight-diff" style="color: #6b7280;">Ниже среднего</div>
-            <div class="insight-meta">
-                Среднее: {worst_views['value']:.0f} просмотров · Постов: {worst_views.get('posts_count', 0)}
-            </div>
-        </div>
-        """)
+        values['worst_views_when'] = f"{worst_views['day']}, {worst_views['time_range']}"
+        values['worst_views_diff'] = "Ниже среднего"
+        values['worst_views_meta'] = f"Среднее: {worst_views['value']:.0f} просмотров · Постов: {worst_views.get('posts_count', 0)}"
     
     if analysis.get('worst_er'):
         worst_er = analysis['worst_er'][0]
-        negative_cards.append(f"""
-        <div class="insight-card">
-            <div class="insight-metric-label">Минимальная ER</div>
-            <div class="insight-main-value">{worst_er['day']}, {worst_er['time_range']}</div>
-            <div class="insight-diff" style="color: #6b7280;">Ниже среднего</div>
-            <div class="insight-meta">
-                Средний ER: {worst_er['value']:.2f}% · Постов: {worst_er.get('posts_count', 0)}
-            </div>
-        </div>
-        """)
-    
-    if negative_cards:
-        sections.append(f"""
-        <section class="insights-section insights-negative">
-            <div class="insights-title">Когда лучше не публиковать контент</div>
-            <div class="insights-grid">
-                {''.join(negative_cards)}
-            </div>
-        </section>
-        """)
+        values['worst_er_when'] = f"{worst_er['day']}, {worst_er['time_range']}"
+        values['worst_er_diff'] = "Ниже среднего"
+        values['worst_er_meta'] = f"Средний ER: {worst_er['value']:.2f}% · Постов: {worst_er.get('posts_count', 0)}"
     
-    # Объединяем все части
-    html = f"""
-    {css_styles}
-    <div class="insights-container">
-        {''.join(sections)}
-    </div>
-    """
-    
-    insights_container.content = html
-
+    cards = tuple(
+        key for key, _, _ in BEST_CARDS + NEGATIVE_CARDS if f'{key}_when' in values
+    )
+    return insights_template(cards), values
@@ -1,16 +1,20 @@
 """
 UI компонент: Блок настроек
 """
+import sys
+import asyncio
 import datetime
 from nicegui import ui
 from core.state import STATE
-from core.services import fetch_posts_async, extract_channel_username
-from core.analytics import calculate_previous_period, compare_periods, calculate_er
+from core.services import extract_channel_username
+from core.post_cache import (
+    fetch_posts_cached, fetch_posts_swr, revalidate, speculate_posts, partial_progress, POST_CACHE_TTL, POST_CACHE_STALE_TTL,
+)
+from core.analytics import calculate_previous_period
 from core.request_logger import log_statistics_request
+from core.tracing import new_request_id, start_trace, span
 from core.yandex_metrika import track
-from ui.stats import stats_html
-from ui.top_posts import update_top_posts
-from ui.posting_insights import update_posting_insights
+from ui.fragments import clear_fragment
 
 
 def is_valid_date(date_str: str) -> bool:
@@ -22,6 +26,13 @@ def is_valid_date(date_str: str) -> bool:
         return False
 
 
+def format_wait(seconds: float) -> str:
+    """Форматирует оценку ожидания для пользователя"""
+    if seconds < 60:
+        return f"{max(1, round(seconds))} с"
+    return f"{round(seconds / 60)} мин"
+
+
 def render_settings(
     api_id: str,
     api_hash: str,
@@ -30,7 +41,9 @@ def render_settings(
     graphs_card,
     top_posts_card,
     insights_card,
-    insights_container
+    insights_container,
+    card_loader,
+    periods_card=None
 ):
     """
     Рендерит блок настроек
@@ -44,6 +57,8 @@ def render_settings(
         top_posts_card: Карточка топ-постов
         insights_card: Карточка инсайтов о времени публикаций
         insights_container: Контейнер для HTML инсайтов
+        card_loader: CardLoader клиента (вычисляет содержимое карточек по мере их показа)
+        periods_card: Карточка сравнения периодов
     """
     settings_card = ui.card().classes('w-full').style(
         'background: #fff; border: 1px solid #e5e7eb; border-radius: 16px; padding: 32px; max-width: 800px;'
@@ -69,14 +84,102 @@ def render_settings(
         fetch_button = ui.button('Получить статистику', color='primary').classes('w-full mt-2').style(
             'background: #111827; color: #fff; font-weight: 600; padding: 12px 24px; border-radius: 8px; font-size: 20px;'
         )
-        progress_label = ui.label('').classes('mt-4').style('color: #059669; font-size: 14px; font-weight: 500;')
+        with ui.row().classes('w-full items-center gap-4 mt-4'):
+            progress_label = ui.label('').style('color: #059669; font-size: 14px; font-weight: 500;')
+            # Отмена загрузки освобождает место в очереди загрузок (core.admission)
+            cancel_button = ui.button('Отменить').props('flat dense no-caps').style('color: #6b7280; font-size: 14px;')
+        cancel_button.set_visibility(False)
+        
+        # Задача текущей загрузки клиента и причина ее отмены
+        current_fetch = None
+        cancel_reason = None
+        # Фоновое обновление показанных устаревших данных
+        revalidation = None
+        # Предзагрузка предыдущего периода до нажатия кнопки: ((канал, от, до), задача)
+        speculation = None
+        
+        def data_cards():
+            return [card for card in (stats_card, graphs_card, top_posts_card, insights_card, periods_card) if card]
+        
+        def mark_stale(stale: bool):
+            """Помечает карточки как показывающие устаревшие данные"""
+            for card in data_cards():
+                if stale:
+                    card.classes(add='card-stale')
+                else:
+                    card.classes(remove='card-stale')
+        
+        def cancel_revalidation():
+            nonlocal revalidation
+            if revalidation is not None and not revalidation.done():
+                revalidation.cancel()
+            revalidation = None
+            mark_stale(False)
+        
+        def cancel_speculation():
+            nonlocal speculation
+            if speculation is not None and not speculation[1].done():
+                speculation[1].cancel()
+            speculation = None
+        
+        async def stop_speculation():
+            """Останавливает предзагрузку перед загрузкой пользователя (та продолжит просмотр с того же места)"""
+            task = speculation[1] if speculation is not None else None
+            cancel_speculation()
+            if task is not None:
+                await asyncio.wait([task])
+        
+        async def run_speculation(channel: str, prev_start: str, prev_end: str, client_key):
+            try:
+                await speculate_posts(api_id, api_hash, channel, prev_start, prev_end, limit=1500, client_key=client_key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Warning: speculative fetch of {channel} failed: {e}", file=sys.stderr)
+        
+        def speculate_previous():
+            """Начинает фоновую загрузку предыдущего периода, если включено сравнение"""
+            nonlocal speculation
+            channel = channel_input.value.strip()
+            d_from = date_from.value.strip()
+            d_to = date_to.value.strip()
+            if not compare_switch.value or not channel or not is_valid_date(d_from) or not is_valid_date(d_to) or d_from > d_to:
+                return
+            prev_start, prev_end = calculate_previous_period(d_from, d_to)
+            key = (channel, prev_start, prev_end)
+            if speculation is not None and speculation[0] == key and not speculation[1].done():
+                return
+            cancel_speculation()
+            speculation = (key, asyncio.create_task(run_speculation(channel, prev_start, prev_end, ui.context.client.id)))
+        
+        def cancel_fetch(reason: str):
+            """Отменяет текущую загрузку (просмотренные посты сохраняются для следующего запроса)"""
+            nonlocal cancel_reason
+            if current_fetch is not None and not current_fetch.done():
+                cancel_reason = reason
+                current_fetch.cancel()
+        
+        def on_disconnect():
+            cancel_fetch('disconnect')
+            cancel_revalidation()
+            cancel_speculation()
+        
+        cancel_button.on('click', lambda: cancel_fetch('user'))
+        # Закрытая вкладка не должна продолжать загрузку
+        ui.context.client.on_delete(on_disconnect)
             
         def auto_reset_stats():
             """Сбрасывает статистику при изменении параметров"""
+            # Загрузка для прежних параметров больше не нужна
+            cancel_fetch('params')
+            cancel_revalidation()
+            cancel_speculation()
             STATE.reset()
+            # Отменяем незавершенные вычисления карточек для прежних параметров
+            card_loader.set_params(None)
             
             if stats_container:
-                stats_container.content = ""
+                clear_fragment(stats_container)
             
             progress_label.text = ""
             
@@ -89,6 +192,8 @@ def render_settings(
                 top_posts_card.style('display: none;')
             if insights_card:
                 insights_card.style('display: none;')
+            if periods_card:
+                periods_card.style('display: none;')
 
         def on_date_change():
             """Обработчик изменения дат - отслеживает событие change_period"""
@@ -107,10 +212,49 @@ def render_settings(
         channel_input.on('change', lambda _: auto_reset_stats())
         date_from.on('change', lambda _: on_date_change())
         date_to.on('change', lambda _: on_date_change())
-        compare_switch.on('change', lambda _: auto_reset_stats())
+        def on_compare_change(e):
+            """Сравнение включено после загрузки периода — предыдущий период загружается заранее"""
+            loaded = bool(STATE.last_fetch_params)
+            auto_reset_stats()
+            if e.value and loaded:
+                speculate_previous()
+
+        compare_switch.on_value_change(on_compare_change)
+        # Наведение на кнопку при включенном сравнении — тоже повод начать загрузку заранее
+        fetch_button.on('mouseenter', lambda _: speculate_previous())
+        
+        async def refresh_stale(channel: str, params: dict, compare: bool, client_key):
+            """Загружает свежие данные вместо показанных устаревших и обновляет карточки"""
+            try:
+                with span('revalidate'):
+                    await revalidate(api_id, api_hash, channel, limit=1500, client_key=client_key)
+                    posts = await fetch_posts_cached(
+                        api_id, api_hash, channel, params['start_date'], params['end_date'], limit=1500, client_key=client_key
+                    )
+                    previous_posts = await fetch_posts_cached(
+                        api_id, api_hash, channel, params['prev_start'], params['prev_end'], limit=1500, client_key=client_key
+                    ) if compare else []
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Warning: failed to revalidate {channel}: {e}", file=sys.stderr)
+                progress_label.text = f"⚠️ Показаны сохраненные данные: обновить их не удалось ({e})"
+                return
+            STATE.posts = posts
+            STATE.previous_posts = previous_posts
+            STATE.data_version += 1
+            # Новая версия пересчитывает видимые карточки (фрагменты обновляются по изменившимся слотам)
+            card_loader.set_params({**params, 'version': STATE.data_version},
+                                   data={'posts': posts, 'previous_posts': previous_posts})
+            mark_stale(False)
+            if compare:
+                progress_label.text = f"✅ Данные обновлены: {len(posts)} постов (текущий) и {len(previous_posts)} постов (предыдущий)"
+            else:
+                progress_label.text = f"✅ Данные обновлены: {len(posts)} постов"
     
         async def on_fetch():
             """Обработчик кнопки получения статистики"""
+            nonlocal current_fetch, cancel_reason, revalidation
             channel = channel_input.value.strip()
             d_from = date_from.value.strip()
             d_to = date_to.value.strip()
@@ -148,79 +292,119 @@ def render_settings(
             # Это гарантирует, что запрос будет залогирован даже при ошибке загрузки
             # Используем канал как логин (извлекаем username из ссылки)
             channel_login = extract_channel_username(channel)
-            log_statistics_request(start_date=d_from, end_date=d_to, login=channel_login)
+            # Идентификатор запроса связывает запись лога с трассой этапов (core.tracing)
+            request_id = new_request_id()
+            log_statistics_request(start_date=d_from, end_date=d_to, login=channel_login, request_id=request_id)
 
+            cancel_revalidation()
             fetch_button.disable()
+            # Предзагрузка уступает загрузке пользователя: просмотренное ею продолжится в ней
+            await stop_speculation()
             progress_label.text = "⏳ Получение постов..."
+            current_fetch = asyncio.current_task()
+            cancel_reason = None
+            cancel_button.set_visibility(True)
             
             async def progress_cb(msg):
                 progress_label.text = msg
             
+            def queue_cb(position, wait):
+                progress_label.text = f"⏳ В очереди на загрузку: {position}-й, ожидание ≈ {format_wait(wait)}"
+            
+            client_key = ui.context.client.id
+            
+            # Повторная загрузка того же периода идет мимо кеша постов; иначе устаревшие
+            # посты показываются сразу и обновляются в фоне
+            cache_age = 0 if is_refresh else POST_CACHE_TTL
+            stale_age = 0 if is_refresh else POST_CACHE_STALE_TTL
+            
             try:
-                # Загружаем данные основного периода
-                STATE.posts = await fetch_posts_async(api_id, api_hash, channel, d_from, d_to, limit=1500, progress_callback=progress_cb)
-                STATE.last_fetch_params = {"start_date": d_from, "end_date": d_to}
-                STATE.last_channel = channel
-                STATE.compare_enabled = compare
-                STATE.start_date = d_from
-                STATE.end_date = d_to
-                STATE.channel = channel
+                with start_trace('fetch', request_id=request_id, channel=channel_login,
+                                 start_date=d_from, end_date=d_to, compare=compare, refresh=bool(is_refresh)):
+                    # Загружаем данные основного периода (из кеша, если он свежий)
+                    with span('fetch_current'):
+                        posts, stale = await fetch_posts_swr(
+                            api_id, api_hash, channel, d_from, d_to, limit=1500, stale_age=stale_age,
+                            progress_callback=progress_cb, max_age=cache_age, client_key=client_key, queue_callback=queue_cb
+                        )
+                    # Посты этой загрузки остаются у карточек клиента (CardLoader.data), даже если
+                    # за время загрузки предыдущего периода общий STATE сбросит другой клиент
+                    STATE.posts = posts
+                    STATE.last_fetch_params = {"start_date": d_from, "end_date": d_to}
+                    STATE.last_channel = channel
+                    STATE.compare_enabled = compare
+                    STATE.start_date = d_from
+                    STATE.end_date = d_to
+                    STATE.channel = channel
                 
-                comparison_data = None
+                    prev_start = prev_end = ''
                 
-                # Если включено сравнение, загружаем данные предыдущего периода
-                if compare:
-                    prev_start, prev_end = calculate_previous_period(d_from, d_to)
-                    progress_label.text = f"⏳ Загрузка предыдущего периода ({prev_start} — {prev_end})..."
-                    STATE.previous_posts = await fetch_posts_async(
-                        api_id, api_hash, channel, prev_start, prev_end, limit=1500, progress_callback=None
-                    )
-                    
-                    # Фильтруем посты по периодам
-                    start = datetime.datetime.strptime(d_from, "%Y-%m-%d").date()
-                    end = datetime.datetime.strptime(d_to, "%Y-%m-%d").date()
-                    prev_start_dt = datetime.datetime.strptime(prev_start, "%Y-%m-%d").date()
-                    prev_end_dt = datetime.datetime.strptime(prev_end, "%Y-%m-%d").date()
-                    
-                    current_posts = [
-                        post for post in STATE.posts
-                        if start <= datetime.datetime.strptime(post['date'], "%Y-%m-%d").date() <= end
-                    ]
-                    previous_posts = [
-                        post for post in STATE.previous_posts
-                        if prev_start_dt <= datetime.datetime.strptime(post['date'], "%Y-%m-%d").date() <= prev_end_dt
-                    ]
-                    
-                    comparison_data = compare_periods(current_posts, previous_posts)
-                    progress_label.text = f"✅ Получено {len(current_posts)} постов (текущий) и {len(previous_posts)} постов (предыдущий)"
-                else:
-                    STATE.previous_posts = []
-                    progress_label.text = f"✅ Получено {len(STATE.posts)} постов"
+                    # Если включено сравнение, загружаем данные предыдущего периода
+                    if compare:
+                        prev_start, prev_end = calculate_previous_period(d_from, d_to)
+                        progress_label.text = f"⏳ Загрузка предыдущего периода ({prev_start} — {prev_end})..."
+                        with span('fetch_previous'):
+                            previous_posts, previous_stale = await fetch_posts_swr(
+                                api_id, api_hash, channel, prev_start, prev_end, limit=1500, stale_age=stale_age,
+                                progress_callback=None, max_age=cache_age, client_key=client_key, queue_callback=queue_cb
+                            )
+                            stale = stale or previous_stale
+                        progress_label.text = f"✅ Получено {len(posts)} постов (текущий) и {len(previous_posts)} постов (предыдущий)"
+                    else:
+                        previous_posts = []
+                        progress_label.text = f"✅ Получено {len(posts)} постов"
+                    STATE.posts = posts
+                    STATE.previous_posts = previous_posts
+                    STATE.data_version += 1
                 
-                html = stats_html(STATE.posts, d_from, d_to, channel, comparison_data)
-                stats_container.content = html
-                # Показываем блоки статистики и графиков
-                stats_card.style('display: block;')
-                graphs_card.style('display: block;')
-                top_posts_card.style('display: block;')
-                insights_card.style('display: block;')
-                # Обновляем инсайты о времени публикаций
-                update_posting_insights(insights_container)
-                # Обновляем топ-посты с метрикой по умолчанию (ER) после небольшой задержки
-                # чтобы гарантировать, что контейнер полностью инициализирован в DOM
-                def update_top_posts_delayed():
-                    update_top_posts('er')
-                ui.timer(0.1, update_top_posts_delayed, once=True)
+                    # Содержимое карточек вычисляется лениво: саммари — сразу,
+                    # остальные карточки — когда становятся видимыми
+                    params = {
+                        'channel': channel,
+                        'start_date': d_from,
+                        'end_date': d_to,
+                        'prev_start': prev_start,
+                        'prev_end': prev_end,
+                        'version': STATE.data_version,
+                    }
+                    card_loader.set_params(params, data={'posts': posts, 'previous_posts': previous_posts})
+                    # Показываем блоки статистики и графиков
+                    stats_card.style('display: block;')
+                    graphs_card.style('display: block;')
+                    top_posts_card.style('display: block;')
+                    insights_card.style('display: block;')
+                    if periods_card:
+                        periods_card.style('display: block;')
+                    if stale:
+                        # Карточки уже показаны по сохраненным данным, свежие загружаются в фоне
+                        mark_stale(True)
+                        progress_label.text += " · сохраненные данные, обновляются…"
+                        revalidation = asyncio.create_task(refresh_stale(channel, params, compare, client_key))
+            except asyncio.CancelledError:
+                current_fetch = None
+                # При смене параметров состояние уже сброшено, при закрытии вкладки показывать некому
+                if cancel_reason == 'user':
+                    auto_reset_stats()
+                    progress_label.text = "⏹ Загрузка отменена"
             except Exception as e:
                 STATE.reset()
-                progress_label.text = f"⛔ Ошибка: {str(e)}"
-                stats_container.content = ""
+                card_loader.set_params(None)
+                progress_label.text = f"⛔ Ошибка: {str(e)} (запрос {request_id})"
+                # Просмотренные сообщения сохранены: повтор продолжит загрузку, а не начнет ее заново
+                resumable = partial_progress(channel, 1500)
+                if resumable:
+                    progress_label.text += f". Повторите запрос — загрузка продолжится после {resumable} просмотренных сообщений"
+                clear_fragment(stats_container)
                 # Скрываем блоки при ошибке
                 stats_card.style('display: none;')
                 graphs_card.style('display: none;')
                 top_posts_card.style('display: none;')
                 insights_card.style('display: none;')
+                if periods_card:
+                    periods_card.style('display: none;')
             finally:
+                current_fetch = None
+                cancel_button.set_visibility(False)
                 fetch_button.enable()
 
         fetch_button.on('click', on_fetch)
@@ -1,15 +1,68 @@
 """
 UI компонент: Блок статистики
 """
-import datetime
 from nicegui import ui
-from core.analytics import calculate_er, calculate_previous_period, format_metric, format_delta
-from typing import Optional
+from core.analytics import (
+    calculate_er, calculate_previous_period, compare_period_posts, delta_direction, filter_posts_by_period, format_metric
+)
+from ui.fragments import Template, show_fragment
 
 
-def stats_html(posts, start_date, end_date, channel='', comparison_data=None):
+# Карточки саммари: (подпись, ключ метрики)
+STAT_BLOCKS = [
+    ("Постов", "posts"),
+    ("Просмотров", "views"),
+    ("Лайков", "likes"),
+    ("Комментариев", "comments"),
+    ("Репостов", "reposts"),
+]
+
+_CARD_TEMPLATE = """
+    <div class="stat-card">
+        <div class="stat-card-label">{label}</div>
+        <div class="stat-card-value" data-slot="{key}">{{{key}}}</div>{delta}
+    </div>"""
+
+_ER_CARD_TEMPLATE = """
+    <div class="stat-card accent">
+        <div class="stat-card-label">Средний ER</div>
+        <div class="stat-card-value" data-slot="avg_er">{{avg_er}}</div>{delta}
+    </div>"""
+
+_DELTA_TEMPLATE = """
+        <div class="{{d_{key}@class}}" data-slot="d_{key}">
+            <span class="delta-icon" data-slot="d_{key}_icon">{{d_{key}_icon}}</span>
+            <span class="delta-value" data-slot="d_{key}_pct">{{d_{key}_pct}}</span>
+        </div>"""
+
+
+def _build_stats_template(with_compare: bool) -> Template:
+    """Собирает шаблон саммари (с блоком сравнения или без)"""
+    def delta(key):
+        return _DELTA_TEMPLATE.format(key=key) if with_compare else ""
+
+    cards = ''.join(_CARD_TEMPLATE.format(label=label, key=key, delta=delta(key)) for label, key in STAT_BLOCKS)
+    cards += _ER_CARD_TEMPLATE.format(delta=delta("avg_er"))
+    if with_compare:
+        header = """
+    <h2 class="stats-title with-compare" data-slot="title">{title}</h2>
+    <div class="stats-compare" data-slot="compare">{compare}</div>"""
+    else:
+        header = """
+    <h2 class="stats-title" data-slot="title">{title}</h2>"""
+    return Template(
+        'stats_compare' if with_compare else 'stats',
+        f'<div class="stats-summary">{header}\n    <div class="stats-grid">{cards}\n    </div>\n</div>'
+    )
+
+
+STATS_TEMPLATE = _build_stats_template(with_compare=False)
+STATS_COMPARE_TEMPLATE = _build_stats_template(with_compare=True)
+
+
+def stats_fragment(posts, start_date, end_date, channel='', comparison_data=None):
     """
-    Генерирует HTML со статистикой.
+    Рассчитывает саммари и возвращает шаблон и значения его слотов.
     
     Args:
         posts: Список всех постов
@@ -17,36 +70,30 @@ def stats_html(posts, start_date, end_date, channel='', comparison_data=None):
         end_date: Конец периода (YYYY-MM-DD)
         channel: Имя канала
         comparison_data: Данные сравнения (результат compare_periods) или None
+    
+    Returns:
+        tuple: (Template, dict значений слотов)
     """
-    start = datetime.datetime.strptime(start_date, "%Y-%m-%d").date()
-    end = datetime.datetime.strptime(end_date, "%Y-%m-%d").date()
-    selected_posts = [
-        post for post in posts
-        if start <= datetime.datetime.strptime(post['date'], "%Y-%m-%d").date() <= end
-    ]
+    selected_posts = filter_posts_by_period(posts, start_date, end_date)
     
     # Используем данные сравнения, если они есть, иначе рассчитываем метрики
     if comparison_data:
         current_metrics = comparison_data['current']
-        total_posts = current_metrics['posts']
-        total_views = current_metrics['views']
-        total_likes = current_metrics['likes']
-        total_comments = current_metrics['comments']
-        total_reposts = current_metrics['reposts']
-        avg_er = current_metrics['avg_er']
         deltas = comparison_data['deltas']
     else:
-        total_posts = len(selected_posts)
-        total_views = sum(post.get('views', 0) for post in selected_posts)
-        total_likes = sum(post['likes'] for post in selected_posts)
-        total_comments = sum(post['comments'] for post in selected_posts)
-        total_reposts = sum(post['reposts'] for post in selected_posts)
         er_list = []
         for p in selected_posts:
             views = p.get('views', 0)
             er = calculate_er(p.get('likes',0), p.get('comments',0), p.get('reposts',0), views)
             er_list.append(er)
-        avg_er = sum(er_list)/len(er_list) if er_list else 0
+        current_metrics = {
+            'posts': len(selected_posts),
+            'views': sum(post.get('views', 0) for post in selected_posts),
+            'likes': sum(post['likes'] for post in selected_posts),
+            'comments': sum(post['comments'] for post in selected_posts),
+            'reposts': sum(post['reposts'] for post in selected_posts),
+            'avg_er': sum(er_list)/len(er_list) if er_list else 0,
+        }
         deltas = None
     
     # Обновляем _er для постов (нужно для format_top_posts) - считаем один раз
@@ -55,84 +102,82 @@ def stats_html(posts, start_date, end_date, channel='', comparison_data=None):
             views = p.get('views', 0)
             p['_er'] = calculate_er(p.get('likes',0), p.get('comments',0), p.get('reposts',0), views)
 
-    blocks = [
-        ("Постов", total_posts, "posts"),
-        ("Просмотров", total_views, "views"),
-        ("Лайков", total_likes, "likes"),
-        ("Комментариев", total_comments, "comments"),
-        ("Репостов", total_reposts, "reposts"),
-        ("Средний ER", f"{avg_er:.2f}%", "avg_er"),
-    ]
-
-    metrics = []
-    for label, value, metric_key in blocks[:-1]:
-        delta_html = ""
-        if deltas and metric_key in deltas:
-            delta = deltas[metric_key]
-            delta_html = format_delta(delta['absolute'], delta['percent'])
-        
-        metrics.append(f"""
-        <div style='
-            background: #fff;
-            border: 1px solid #e5e7eb;
-            border-radius: 12px;
-            padding: 18px 10px 10px 10px;
-            display: flex; flex-direction:column; align-items:center;'>
-            <div style='font-size:12px; color:#6b7280; margin-bottom: 7px;'>{label}</div>
-            <div style='font-size:26px; font-weight:700; color:#111827;'>{format_metric(value)}</div>
-            {delta_html}
-        </div>
-        """)
-
-    # ER карточка с дельтой
-    er_delta_html = ""
-    if deltas and "avg_er" in deltas:
-        delta = deltas["avg_er"]
-        er_delta_html = format_delta(delta['absolute'], delta['percent'], is_light_bg=True)
+    values = {
+        'title': f"Саммари за период {start_date} — {end_date}",
+        'avg_er': f"{current_metrics['avg_er']:.2f}%",
+    }
+    for _, key in STAT_BLOCKS:
+        values[key] = format_metric(current_metrics[key])
+
+    if not comparison_data:
+        return STATS_TEMPLATE, values
+
+    prev_start, prev_end = calculate_previous_period(start_date, end_date)
+    values['compare'] = f"📊 Сравнение с предыдущим периодом: {prev_start} — {prev_end}"
+    for key in [key for _, key in STAT_BLOCKS] + ['avg_er']:
+        delta = deltas[key]
+        direction, icon, percent_str = delta_direction(delta['absolute'], delta['percent'])
+        values[f'd_{key}@class'] = f"delta {direction}"
+        values[f'd_{key}_icon'] = icon
+        values[f'd_{key}_pct'] = percent_str
+    return STATS_COMPARE_TEMPLATE, values
+
+
+def stats_html(posts, start_date, end_date, channel='', comparison_data=None):
+    """
+    Генерирует HTML со статистикой.
     
-    metrics.append(f"""
-        <div style='
-            background: linear-gradient(135deg, #059669 25%, #047857 100%);
-            border-radius: 12px; padding: 18px 10px 10px 10px; color: #fff; display:flex; flex-direction:column; align-items:center;'>
-            <div style='font-size:12px; opacity: 0.85; margin-bottom: 7px;'>Средний ER</div>
-            <div style='font-size:26px; font-weight:700;'>{blocks[-1][1]}</div>
-            {er_delta_html}
-        </div>""")
-
-    # Формируем заголовок
-    if comparison_data:
-        prev_start, prev_end = calculate_previous_period(start_date, end_date)
-        header = f"""
-        <h2 style="font-size:24px; font-weight:700; color:#111827; font-family:sans-serif; margin-bottom: 8px;">
-            Саммари за период {start_date} — {end_date}
-        </h2>
-        <div style="font-size:14px; color:#6b7280; margin-bottom: 16px;">
-            📊 Сравнение с предыдущим периодом: {prev_start} — {prev_end}
-        </div>
-        """
-    else:
-        header = f"""
-        <h2 style="font-size:24px; font-weight:700; color:#111827; font-family:sans-serif;">
-            Саммари за период {start_date} — {end_date}
-        </h2>
-        """
+    Args:
+        posts: Список всех постов
+        start_date: Начало периода (YYYY-MM-DD)
+        end_date: Конец периода (YYYY-MM-DD)
+        channel: Имя канала
+        comparison_data: Данные сравнения (результат compare_periods) или None
+    """
+    template, values = stats_fragment(posts, start_date, end_date, channel, comparison_data)
+    return template.render(values)
+
+
+async def load_stats(stats_container, card_loader, params):
+    """
+    Вычисляет и отображает саммари для параметров карточек.
     
-    return f"""
-    <div style="margin: 0 auto; max-width:1200px;">
-        {header}
-        <div style="display: grid; grid-template-columns: repeat(auto-fit,minmax(180px,1fr)); gap: 13px; margin-bottom: 35px;">
-            {''.join(metrics)}
-        </div>
-    </div>"""
+    Args:
+        stats_container: Контейнер для HTML статистики
+        card_loader: CardLoader клиента (кеширует результаты)
+        params: Параметры (channel, start_date, end_date, prev_start, prev_end)
+    """
+    # Посты, загруженные этим клиентом для params (общий STATE могли перезаписать другие клиенты)
+    data = card_loader.data
+    if not data:
+        return
+    comparison_data = None
+    if params.get('prev_start'):
+        comparison_data, _, _ = await card_loader.cached(
+            'comparison', compare_period_posts, data['posts'], data['previous_posts'],
+            params['start_date'], params['end_date'], params['prev_start'], params['prev_end']
+        )
+    template, values = await card_loader.cached(
+        'stats', stats_fragment, data['posts'], params['start_date'], params['end_date'], params['channel'], comparison_data
+    )
+    show_fragment(stats_container, template, values)
 
 
-def render_stats():
-    """Рендерит блок статистики"""
+def render_stats(card_loader=None):
+    """
+    Рендерит блок статистики
+    
+    Args:
+        card_loader: CardLoader клиента; саммари вычисляется сразу после загрузки данных
+    """
     stats_card = ui.card().classes('w-full').style(
         'background: #fff; border: 1px solid #e5e7eb; border-radius: 16px; padding: 32px; max-width: 1200px; display: none;'
     )
     with stats_card:
         stats_container = ui.html('', sanitize=False).classes('w-full')
     
+    if card_loader:
+        # Саммари — первая карточка под настройками, поэтому считаем его не дожидаясь видимости
+        card_loader.add('stats', stats_card, lambda params: load_stats(stats_container, card_loader, params), eager=True)
+    
     return stats_card, stats_container
-
@@ -0,0 +1,43 @@
+// Общие скрипты интерфейса аналитики
+
+// Применяет дельта-обновление к HTML-фрагменту: ключ "slot" заменяет текст
+// элементов с data-slot="slot", ключ "slot@attr" — значение атрибута attr
+window.analtgPatch = function (elementId, values) {
+    var root = getHtmlElement(elementId);
+    if (!root) {
+        return;
+    }
+    Object.keys(values).forEach(function (key) {
+        var parts = key.split('@');
+        var nodes = root.querySelectorAll('[data-slot="' + parts[0] + '"]');
+        for (var i = 0; i < nodes.length; i++) {
+            if (parts.length > 1) {
+                nodes[i].setAttribute(parts[1], values[key]);
+            } else {
+                nodes[i].textContent = values[key];
+            }
+        }
+    });
+};
+
+// Сообщает серверу о появлении карточек в области видимости (ленивое вычисление)
+var analtgCardObserver = window.IntersectionObserver ? new IntersectionObserver(function (entries) {
+    entries.forEach(function (entry) {
+        emitEvent('analtg_card_visible', {
+            card: entry.target.getAttribute('data-lazy-card'),
+            visible: entry.isIntersecting,
+        });
+    });
+}) : null;
+
+window.analtgObserveCards = function () {
+    var cards = document.querySelectorAll('[data-lazy-card]:not([data-lazy-observed])');
+    for (var i = 0; i < cards.length; i++) {
+        cards[i].setAttribute('data-lazy-observed', '1');
+        if (analtgCardObserver) {
+            analtgCardObserver.observe(cards[i]);
+        } else {
+            emitEvent('analtg_card_visible', {card: cards[i].getAttribute('data-lazy-card'), visible: true});
+        }
+    }
+};
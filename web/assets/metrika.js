@@ -0,0 +1,84 @@
+/* Отправка событий Яндекс.Метрики пачками (см. core/yandex_metrika.py) */
+
+(function () {
+    var METRIKA_ID = 106259012;
+    var pending = [];
+    var retryTimer = null;
+    // Сколько ждать загрузки счетчика (как таймаут загрузчика в <head>), мс
+    var LOAD_TIMEOUT = 5000;
+    var RETRY_INTERVAL = 250;
+    // Больше событий в очереди не держим: самые старые отбрасываются
+    var MAX_PENDING = 100;
+    var waitStarted = null;
+    // Счетчик не загрузился (блокировщик, CSP, сеть) — события больше не копятся
+    var unavailable = false;
+
+    window._ymTrack = function (eventName, params) {
+        if (!window.ym) {
+            console.warn('Yandex Metrika: window.ym not available');
+            return;
+        }
+        try {
+            if (params && Object.keys(params).length > 0) {
+                window.ym(METRIKA_ID, 'reachGoal', eventName, params);
+            } else {
+                window.ym(METRIKA_ID, 'reachGoal', eventName);
+            }
+        } catch (e) {
+            console.warn('Yandex Metrika error:', e);
+        }
+    };
+
+    window._ymSetParams = function (params) {
+        if (!window.ym) {
+            console.warn('Yandex Metrika: window.ym not available');
+            return;
+        }
+        try {
+            window.ym(METRIKA_ID, 'params', params);
+        } catch (e) {
+            console.warn('Yandex Metrika error:', e);
+        }
+    };
+
+    function flush() {
+        retryTimer = null;
+        if (typeof window.ym !== 'function') {
+            if (waitStarted === null) {
+                waitStarted = Date.now();
+            }
+            if (Date.now() - waitStarted >= LOAD_TIMEOUT) {
+                console.warn('Yandex Metrika: script failed to load, ' + pending.length + ' events dropped');
+                unavailable = true;
+                pending = [];
+                return;
+            }
+            // Счетчик еще загружается — одна общая повторная попытка на всю очередь
+            retryTimer = setTimeout(flush, RETRY_INTERVAL);
+            return;
+        }
+        var batch = pending;
+        pending = [];
+        batch.forEach(function (item) {
+            if (item[0] === 'params') {
+                window._ymSetParams(item[1]);
+            } else {
+                window._ymTrack(item[1], item[2]);
+            }
+        });
+    }
+
+    // Пачка от сервера: [['goal', name, params|null], ['params', params], ...]
+    window.analtgMetrika = function (batch) {
+        if (unavailable) {
+            return;
+        }
+        pending.push.apply(pending, batch);
+        if (pending.length > MAX_PENDING) {
+            pending.splice(0, pending.length - MAX_PENDING);
+        }
+        if (retryTimer === null) {
+            flush();
+        }
+    };
+})();